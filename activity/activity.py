@@ -45,8 +45,10 @@ from cogs.utils.chat_formatting import pagify
 from __main__ import send_cmd_help
 from .utils.dataIO import dataIO
 from .utils import checks
+from .card import PlotRenderer
 
-from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 try:
     import psutil
@@ -66,6 +68,62 @@ PATH = os.path.join(*PATH_LIST)
 JSON = os.path.join(*PATH_LIST, "settings.json")
 HOST = '127.0.0.1'
 INTERVAL = 5
+SAVE_INTERVAL = 60
+SAVE_MAX_CHANGES = 1000
+
+# plot renderer worker processes and cached PNGs
+PLOT_WORKERS = 1
+PLOT_CACHE_SIZE = 16
+
+EMOJI_P = re.compile('\<\:.+?\:\d+\>')
+UEMOJI_P = re.compile(u'['
+                      u'\U0001F300-\U0001F64F'
+                      u'\U0001F680-\U0001F6FF'
+                      u'\uD83C-\uDBFF\uDC00-\uDFFF'
+                      u'\u2600-\u26FF\u2700-\u27BF]{1,2}',
+                      re.UNICODE)
+
+
+def plot_activity(message_time):
+    """Plot messages per hour for each day of the week.
+
+    Runs in a worker process. Return PNG bytes.
+
+    message_time: tuple of (hours, counts) for each day
+    """
+    facecolor = '#32363b'
+    edgecolor = '#eeeeee'
+    spinecolor = '#999999'
+    tickcolor = '#999999'
+
+    fig = Figure()
+    axes = fig.subplots(7, sharex=True, sharey=True)
+
+    for ax in axes:
+        for spine in ax.spines.values():
+            spine.set_edgecolor(spinecolor)
+
+    for ax, (x, y) in zip(axes, message_time):
+        if not x:
+            continue
+        ax.plot(x, y, 'o-')
+        ax.tick_params(axis='x', colors=tickcolor)
+        ax.tick_params(axis='y', colors=tickcolor)
+
+    axes[-1].set_xticks(range(0, 24, 4))
+
+    fig.subplots_adjust(hspace=0)
+    for ax in axes[:-1]:
+        for label in ax.get_xticklabels():
+            label.set_visible(False)
+
+    FigureCanvasAgg(fig)
+    with io.BytesIO() as f:
+        fig.savefig(
+            f, format="png", facecolor=facecolor,
+            edgecolor=edgecolor, transparent=True)
+        return f.getvalue()
+
 
 class Activity:
     """Activity Logger.
@@ -95,13 +153,30 @@ class Activity:
         self.lock = False
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
         self.rank_max = 5
+        # write-behind: counters are updated in memory and flushed
+        # to disk by the loop task, or when too many changes pile up
+        self.changes = 0
+        self.task = bot.loop.create_task(self.loop_task())
+        self.plot_renderer = PlotRenderer(
+            bot.loop, workers=PLOT_WORKERS, cache_size=PLOT_CACHE_SIZE)
 
     def __unload(self):
         self.lock = True
+        self.task.cancel()
+        self.flush()
+        self.plot_renderer.shutdown()
         self.session.close()
         for h in self.handles.values():
             h.close()
 
+    async def loop_task(self):
+        """Loop task: flush pending changes to disk."""
+        await self.bot.wait_until_ready()
+        await asyncio.sleep(SAVE_INTERVAL)
+        self.flush()
+        if self is self.bot.get_cog('Activity'):
+            self.task = self.bot.loop.create_task(self.loop_task())
+
     @commands.group(pass_context=True)
     @checks.is_owner()
     async def activityset(self, ctx: Context):
@@ -253,58 +328,29 @@ class Activity:
         if settings is None:
             return
 
-        facecolor = '#32363b'
-        edgecolor = '#eeeeee'
-        spinecolor = '#999999'
-        footercolor = '#999999'
-        labelcolor = '#cccccc'
-        tickcolor = '#999999'
-        titlecolor = '#ffffff'
-
-        # settings[day][hour]
-        fig, axes = plt.subplots(7, sharex=True, sharey=True)
-
-        plt.xticks(range(0, 24, 4))
-
-        days = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat']
-        days_gen = (d for d in days)
-
-        for ax in axes:
-            ax.ylabel = next(days_gen)
-            # await self.bot.say(day)
-            for spine in ax.spines.values():
-                spine.set_edgecolor(spinecolor)
-
-        for i, (k, v) in enumerate(settings.items()):
+        message_time = []
+        for k, v in settings.items():
             # fix legacy data  issues where v is not a dict
             if isinstance(v, dict):
-                x = [str(k) for k in v.keys()]
-                y = [int(k) for k in v.values()]
-                axes[i].plot(x, y, 'o-')
-                axes[i].tick_params(axis='x', colors=tickcolor)
-                axes[i].tick_params(axis='y', colors=tickcolor)
+                x = tuple(str(k) for k in v.keys())
+                y = tuple(int(k) for k in v.values())
+                message_time.append((x, y))
+            else:
+                message_time.append(((), ()))
+        message_time = tuple(message_time)
 
-        fig.subplots_adjust(hspace=0)
-        plt.setp([a.get_xticklabels() for a in fig.axes[:-1]], visible=False)
+        png = await self.plot_renderer.render(plot_activity, message_time)
 
         plot_filename = 'plot.png'
         plot_name = ""
 
-        with io.BytesIO() as f:
-            plt.savefig(
-                f, format="png", facecolor=facecolor,
-                edgecolor=edgecolor, transparent=True)
-            f.seek(0)
+        with io.BytesIO(png) as f:
             await ctx.bot.send_file(
                 ctx.message.channel,
                 f,
                 filename=plot_filename,
                 content=plot_name)
 
-        fig.clf()
-        plt.clf()
-        plt.cla()
-
     def get_message_ranks(
             self, server: discord.Server, time_id: str, top_max=5):
         """Return message ranks by time id as a list."""
@@ -467,8 +513,7 @@ class Activity:
 
             # log emojis usage
             # Discord emojis: <:joyless:230104023305420801>
-            emoji_p = re.compile('\<\:.+?\:\d+\>')
-            emojis = emoji_p.findall(message.content)
+            emojis = EMOJI_P.findall(message.content)
             if len(emojis):
                 for emoji in emojis:
                     if emoji not in server_settings['emojis']:
@@ -477,13 +522,7 @@ class Activity:
                             'count': 0
                         }
                     server_settings['emojis'][emoji]['count'] += 1
-            uemoji_p = re.compile(u'['
-                                  u'\U0001F300-\U0001F64F'
-                                  u'\U0001F680-\U0001F6FF'
-                                  u'\uD83C-\uDBFF\uDC00-\uDFFF'
-                                  u'\u2600-\u26FF\u2700-\u27BF]{1,2}',
-                                  re.UNICODE)
-            emojis = uemoji_p.findall(message.content)
+            emojis = UEMOJI_P.findall(message.content)
             if len(emojis):
                 for emoji in emojis:
                     if emoji not in server_settings['emojis']:
@@ -499,7 +538,7 @@ class Activity:
             day = date.strftime("%w")
             server_settings['message_time'][day][hour] += 1
 
-        self.save_json()
+        self.mark_dirty()
 
     async def on_command(self, command: Command, ctx: Context):
         """Log command used."""
@@ -527,44 +566,40 @@ class Activity:
             }
         server_commands[command.name]['count'] += 1
 
-        self.save_json()
+        self.mark_dirty()
 
     def check_server_settings(self, server: discord.Server):
         """Verify server settings are available."""
         if server.id not in self.settings:
             self.settings[server.id] = {}
+            self.mark_dirty()
 
         server_settings = self.settings[server.id]
 
-        if 'server_id' not in server_settings:
-            server_settings['server_id'] = server.id
-        if 'server_name' not in server_settings:
-            server_settings['server_name'] = server.name
-        if 'on_off' not in server_settings:
-            server_settings['on_off'] = False
+        defaults = {
+            'server_id': server.id,
+            'server_name': server.name,
+            'on_off': False
+        }
+        for k, v in defaults.items():
+            if k not in server_settings:
+                server_settings[k] = v
+                self.mark_dirty()
 
         time_id = self.get_time_id()
 
         if time_id not in server_settings:
             server_settings[time_id] = {}
+            self.mark_dirty()
 
-        if 'messages' not in server_settings[time_id]:
-            server_settings[time_id]['messages'] = {}
-        if 'commands' not in server_settings[time_id]:
-            server_settings[time_id]['commands'] = {}
-        if 'mentions' not in server_settings[time_id]:
-            server_settings[time_id]['mentions'] = {}
-        if 'channels' not in server_settings[time_id]:
-            server_settings[time_id]['channels'] = {}
-        if 'emojis' not in server_settings[time_id]:
-            server_settings[time_id]['emojis'] = {}
-        if 'message_time' not in server_settings[time_id]:
-            server_settings[time_id]['message_time'] = {}
+        for k in ['messages', 'commands', 'mentions', 'channels', 'emojis',
+                  'message_time']:
+            if k not in server_settings[time_id]:
+                server_settings[time_id][k] = {}
+                self.mark_dirty()
 
         self.check_message_time_settings(server)
 
-        self.save_json()
-
     def check_message_time_settings(self, server: discord.Server):
         """Create message time fields if not already set."""
         time_id = self.get_time_id()
@@ -573,6 +608,7 @@ class Activity:
             if str(day) not in settings:
                 settings[str(day)] = {
                     '{:02d}'.format(h): 0 for h in range(0, 24)}
+                self.mark_dirty()
 
         # legacy get rids of hourly data
         new_settings = settings.copy()
@@ -580,7 +616,6 @@ class Activity:
             if len(k) > 1:
                 del new_settings[k]
         settings = new_settings
-        self.save_json()
 
     def get_time_id(self, date: datetime.date=None):
         """Return current year, week as a tuple."""
@@ -603,9 +638,25 @@ class Activity:
             time_id = self.get_time_id()
         return self.settings[server.id][time_id]["commands"]
 
+    def mark_dirty(self):
+        """Record a pending change.
+
+        Settings are flushed by the loop task every SAVE_INTERVAL seconds,
+        or immediately once SAVE_MAX_CHANGES changes are pending.
+        """
+        self.changes += 1
+        if self.changes >= SAVE_MAX_CHANGES:
+            self.flush()
+
+    def flush(self):
+        """Save settings if there are pending changes."""
+        if self.changes:
+            self.save_json()
+
     def save_json(self):
         """Save settings."""
         dataIO.save_json(JSON, self.settings)
+        self.changes = 0
 
 
 def check_folders():
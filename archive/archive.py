@@ -26,8 +26,12 @@ DEALINGS IN THE SOFTWARE.
 
 import os
 import io
+import asyncio
+import gzip
 import json
+import time
 from collections import defaultdict
+from itertools import islice
 import discord
 from discord.ext import commands
 import datetime as dt
@@ -39,6 +43,20 @@ from cogs.utils.dataIO import dataIO
 
 PATH = os.path.join("data", "archive")
 JSON = os.path.join(PATH, "settings.json")
+CHANNELS_PATH = os.path.join(PATH, "channels")
+
+# messages per archive segment file
+SEGMENT_SIZE = 10000
+# messages buffered before they are written out
+FLUSH_SIZE = 500
+
+JOBS_PATH = os.path.join(PATH, "jobs")
+# channels archived at the same time; each channel is its own rate limit bucket
+ARCHIVE_CONCURRENCY = 4
+# messages per channel per run of a server archive
+FULL_ARCHIVE_LIMIT = 100000
+# seconds between progress updates
+PROGRESS_INTERVAL = 10
 
 
 def nested_dict():
@@ -46,6 +64,270 @@ def nested_dict():
     return defaultdict(nested_dict)
 
 
+def snowflake(obj):
+    """Snowflake id of a message, object or datetime."""
+    if obj is None:
+        return None
+    if isinstance(obj, dt.datetime):
+        return discord.utils.time_snowflake(obj)
+    return int(obj.id)
+
+
+def message_dict(message):
+    """Archived fields of a message."""
+    msg = {
+        'author_id': message.author.id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+        'id': message.id,
+        'reactions': [],
+        'attachments': []
+    }
+    for reaction in message.reactions:
+        r = {
+            'custom_emoji': reaction.custom_emoji,
+            'count': reaction.count
+        }
+        if reaction.custom_emoji:
+            # <:emoji_name:emoji_id>
+            r['emoji'] = '<:{}:{}>'.format(
+                reaction.emoji.name,
+                reaction.emoji.id)
+        else:
+            r['emoji'] = reaction.emoji
+        msg['reactions'].append(r)
+
+    for attach in message.attachments:
+        msg['attachments'].append(attach['url'])
+    return msg
+
+
+class ChannelArchive:
+    """Append-only message archive of a channel.
+
+    Messages are stored oldest first as gzip compressed JSON lines, split
+    into segment files of SEGMENT_SIZE messages. Each write appends a gzip
+    member and updates checkpoint.json with the last archived message,
+    so an interrupted archive continues where it stopped.
+
+    The archive only grows forward from start_id, the snowflake it was
+    started after, and has no gaps. There must be only one instance per
+    channel at a time; the Archive cog keeps them with a lock each.
+    """
+
+    def __init__(self, server_id, channel_id):
+        """Init."""
+        self.path = os.path.join(CHANNELS_PATH, server_id, channel_id)
+        self.checkpoint_path = os.path.join(self.path, "checkpoint.json")
+        if dataIO.is_valid_json(self.checkpoint_path):
+            self.checkpoint = dataIO.load_json(self.checkpoint_path)
+        else:
+            self.checkpoint = {
+                "start_id": None,
+                "last_id": None,
+                "last_timestamp": None,
+                "count": 0,
+                "segments": []
+            }
+
+    @property
+    def start_id(self):
+        """Snowflake the archive was started after."""
+        start_id = self.checkpoint.get("start_id")
+        if start_id is None:
+            return None
+        return int(start_id)
+
+    def covers(self, channel):
+        """True if the archive starts at channel creation.
+
+        An empty archive is always started from channel creation.
+        """
+        return self.last_id is None or self.start_id == int(channel.id)
+
+    @property
+    def last_id(self):
+        """Snowflake of last archived message."""
+        last_id = self.checkpoint["last_id"]
+        if last_id is None:
+            return None
+        return int(last_id)
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, segment["file"])
+
+    def append(self, messages, start_id=None):
+        """Append messages, oldest first, skipping already archived ones.
+
+        start_id is recorded as the start of the archive on first write.
+        """
+        last_id = self.last_id
+        if last_id is not None:
+            messages = [m for m in messages if int(m['id']) > last_id]
+        if not len(messages):
+            return 0
+        os.makedirs(self.path, exist_ok=True)
+        if self.checkpoint.get("start_id") is None and last_id is None:
+            self.checkpoint["start_id"] = start_id
+
+        segments = self.checkpoint["segments"]
+        count = len(messages)
+        while len(messages):
+            if not len(segments) or segments[-1]["count"] >= SEGMENT_SIZE:
+                segments.append({
+                    "file": "{:05d}.jsonl.gz".format(len(segments) + 1),
+                    "count": 0,
+                    "size": 0
+                })
+            segment = segments[-1]
+            batch = messages[:SEGMENT_SIZE - segment["count"]]
+            messages = messages[len(batch):]
+            with open(self.segment_path(segment), "ab") as f:
+                # drop anything written after the last checkpoint; the
+                # position is not moved by truncate, so seek to the new end
+                f.truncate(segment["size"])
+                f.seek(0, os.SEEK_END)
+                with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                    for msg in batch:
+                        gz.write((json.dumps(msg) + "\n").encode("utf-8"))
+                segment["size"] = f.tell()
+            segment["count"] += len(batch)
+            self.checkpoint["count"] += len(batch)
+            self.checkpoint["last_id"] = batch[-1]['id']
+            self.checkpoint["last_timestamp"] = batch[-1]['timestamp']
+
+        dataIO.save_json(self.checkpoint_path, self.checkpoint)
+        return count
+
+    def messages(self, after_id=None):
+        """Iterate archived messages oldest first."""
+        for segment in self.checkpoint["segments"]:
+            with open(self.segment_path(segment), "rb") as f:
+                data = io.BytesIO(f.read(segment["size"]))
+            with gzip.GzipFile(fileobj=data, mode="rb") as gz:
+                for line in gz:
+                    msg = json.loads(line.decode("utf-8"))
+                    if after_id is None or int(msg['id']) > after_id:
+                        yield msg
+
+
+class ServerArchiveJob:
+    """Archive all readable text channels of a server.
+
+    Channels are streamed into their channel archives concurrently, up to
+    ARCHIVE_CONCURRENCY at a time, while discord.py paces requests per
+    route. Finished channels are recorded in jobs/<server>.json and each
+    channel archive keeps its own checkpoint, so a cancelled job resumes
+    where it stopped when started again.
+    """
+
+    def __init__(self, cog, server, channel):
+        """Init."""
+        self.cog = cog
+        self.bot = cog.bot
+        self.server = server
+        # channel progress is reported to
+        self.channel = channel
+        self.path = os.path.join(JOBS_PATH, "{}.json".format(server.id))
+        if dataIO.is_valid_json(self.path):
+            self.state = dataIO.load_json(self.path)
+        else:
+            self.state = {"done": []}
+        self.channels = [
+            c for c in server.channels
+            if c.type == discord.ChannelType.text
+            and c.permissions_for(server.me).read_message_history]
+        self.messages = 0
+        self.active = set()
+        self.errors = []
+        self.started = None
+        self.progress_message = None
+        self.task = None
+
+    def save(self):
+        dataIO.save_json(self.path, self.state)
+
+    def pending(self):
+        """Channels not archived yet."""
+        done = set(self.state["done"])
+        return [c for c in self.channels if c.id not in done]
+
+    def status(self):
+        """Progress as text."""
+        elapsed = time.monotonic() - self.started if self.started else 0
+        rate = self.messages / elapsed if elapsed else 0
+        out = "Archiving {}: {}/{} channels, {:,} messages, {:.1f} messages/s.".format(
+            self.server.name, len(self.state["done"]), len(self.channels),
+            self.messages, rate)
+        if len(self.active):
+            out += "\nIn progress: {}".format(", ".join(sorted(self.active)))
+        return out
+
+    def add_messages(self, count):
+        self.messages += count
+
+    async def archive_channel(self, channel, semaphore):
+        async with semaphore:
+            self.active.add(channel.name)
+            try:
+                saved = await self.cog.save_channel(
+                    channel, FULL_ARCHIVE_LIMIT, progress=self.add_messages)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # record and carry on with the other channels
+                self.errors.append("{}: {}: {}".format(
+                    channel.name, type(e).__name__, e))
+                return
+            finally:
+                self.active.discard(channel.name)
+            if saved >= FULL_ARCHIVE_LIMIT:
+                return
+            # channel is complete when the run did not hit the limit and
+            # the archive has all of it
+            if self.cog.get_archive(channel).covers(channel):
+                self.state["done"].append(channel.id)
+                self.save()
+            else:
+                self.errors.append(
+                    "{}: archive does not start at channel creation.".format(
+                        channel.name))
+
+    async def report_loop(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await self.bot.edit_message(self.progress_message, self.status())
+
+    async def run(self):
+        """Run job. Cancel the task to stop."""
+        self.started = time.monotonic()
+        reporter = None
+        semaphore = asyncio.Semaphore(ARCHIVE_CONCURRENCY)
+        try:
+            self.progress_message = await self.bot.send_message(
+                self.channel, self.status())
+            reporter = self.bot.loop.create_task(self.report_loop())
+            await asyncio.gather(*[
+                self.archive_channel(c, semaphore) for c in self.pending()])
+        except asyncio.CancelledError:
+            result = "Archive cancelled. Run it again to resume."
+        else:
+            if len(self.pending()):
+                result = "Archive paused at the per run limit. Run it again to continue."
+            else:
+                result = "Archive complete."
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            self.cog.jobs.pop(self.server.id, None)
+
+        await self.bot.edit_message(self.progress_message, self.status())
+        for page in pagify("\n".join([result] + self.errors)):
+            await self.bot.send_message(self.channel, page)
+
+
 class Archive:
     """Archive activity.
 
@@ -59,6 +341,34 @@ class Archive:
         self.settings = nested_dict()
         self.settings.update(dataIO.load_json(JSON))
         self.units = {"minute": 60, "hour": 3600, "day": 86400, "week": 604800, "month": 2592000}
+        self.migrate_settings()
+        # server id -> ServerArchiveJob
+        self.jobs = {}
+        # channel id -> ChannelArchive, and the lock held while writing it
+        self.archives = {}
+        self.archive_locks = defaultdict(asyncio.Lock)
+
+    def __unload(self):
+        for job in self.jobs.values():
+            job.task.cancel()
+
+    def migrate_settings(self):
+        """Move messages archived in settings into channel archives."""
+        migrated = False
+        for server_id, channels in list(self.settings.items()):
+            if server_id == "channel_listen" or not isinstance(channels, dict):
+                continue
+            for channel_id, messages in channels.items():
+                if isinstance(messages, list):
+                    # the newest messages of a channel; kept apart so that
+                    # the archive can still start from channel creation
+                    path = os.path.join(CHANNELS_PATH, server_id, channel_id)
+                    os.makedirs(path, exist_ok=True)
+                    dataIO.save_json(os.path.join(path, "legacy.json"), messages)
+            self.settings.pop(server_id)
+            migrated = True
+        if migrated:
+            dataIO.save_json(JSON, self.settings)
 
     @commands.group(pass_context=True, no_pm=True)
     async def archive(self, ctx):
@@ -69,75 +379,62 @@ class Archive:
     @checks.mod_or_permissions()
     @archive.command(name="channel", pass_context=True, no_pm=True)
     async def archive_channel(self, ctx, channel: discord.Channel, count=1000):
-        """Archive channel messages."""
+        """Archive the next count messages of a channel.
+
+        Continues from the last archived message of the channel, or from
+        channel creation, and writes out the messages saved.
+        """
+        archive = self.get_archive(channel)
+        last_id = archive.last_id
         await self.save_channel(channel, count)
-        await self.log_channel(ctx, channel)
+        await self.log_channel(ctx, channel, archive, after_id=last_id)
 
         await self.bot.say("Channel logged.")
 
-    async def save_channel(self, channel: discord.Channel, count=1000, before=None, after=None, reverse=False):
-        """Save channel messages."""
-        server = channel.server
-        if server.id not in self.settings:
-            self.settings[server.id] = {}
-
-        channel_messages = []
-
-        async for message in self.bot.logs_from(
-                channel, limit=count, before=before, after=after, reverse=reverse):
-            msg ={
-                'author_id': message.author.id,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'id': message.id,
-                'reactions': []
-            }
-            for reaction in message.reactions:
-                r = {
-                    'custom_emoji': reaction.custom_emoji,
-                    'count': reaction.count
-                }
-                if reaction.custom_emoji:
-                    # <:emoji_name:emoji_id>
-                    r['emoji'] = '<:{}:{}>'.format(
-                        reaction.emoji.name,
-                        reaction.emoji.id)
-                else:
-                    r['emoji'] = reaction.emoji
-                msg['reactions'].append(r)
-            channel_messages.append(msg)
-
-        channel_messages = sorted(
-            channel_messages, key=lambda x: x['timestamp'])
-
-        self.settings[server.id][channel.id] = channel_messages
-        dataIO.save_json(JSON, self.settings)
+    def get_archive(self, channel: discord.Channel):
+        """Archive of a channel, shared by all commands and jobs."""
+        if channel.id not in self.archives:
+            self.archives[channel.id] = ChannelArchive(channel.server.id, channel.id)
+        return self.archives[channel.id]
 
-    async def log_channel(self, ctx, channel: discord.Channel):
-        """Write channel messages from a channel."""
-        server = ctx.message.server
+    async def save_channel(self, channel: discord.Channel, count=1000, progress=None):
+        """Stream the next count messages of a channel into its archive.
 
-        channel_messages = self.settings[server.id][channel.id]
-        for message in channel_messages:
-            author_id = message['author_id']
-            author = server.get_member(author_id)
-            author_mention = author_id
-            if author is not None:
-                author_mention = author.mention
-            content = message['content']
-            timestamp = message['timestamp']
-            message_id = message['id']
-
-            description = '{}: {}'.format(author_mention, content)
-
-            em = discord.Embed(
-                title=channel.name,
-                description=description)
-
-            for reaction in message['reactions']:
-                em.add_field(name=reaction['emoji'], value=reaction['count'])
-
-            em.set_footer(text='{} - ID: {}'.format(timestamp, message_id))
+        Messages are fetched oldest first after the archive checkpoint, or
+        from channel creation. Only one writer runs per channel at a time.
+        progress is called with the number of messages in each write.
+        Return number of messages saved.
+        """
+        archive = self.get_archive(channel)
+        async with self.archive_locks[channel.id]:
+            after_id = archive.last_id
+            if after_id is None:
+                # channel id is older than any message in it
+                after_id = int(channel.id)
+
+            saved = 0
+            batch = []
+            async for message in self.bot.logs_from(
+                    channel, limit=count,
+                    after=discord.Object(id=str(after_id)), reverse=True):
+                batch.append(message_dict(message))
+                if len(batch) >= FLUSH_SIZE:
+                    written = archive.append(batch, start_id=channel.id)
+                    saved += written
+                    batch = []
+                    if progress is not None:
+                        progress(written)
+            written = archive.append(batch, start_id=channel.id)
+            saved += written
+            if progress is not None:
+                progress(written)
+            return saved
+
+    async def log_channel(self, ctx, channel: discord.Channel, archive, after_id=None, count=None):
+        """Write archived messages of a channel."""
+        server = channel.server
+        for message in islice(archive.messages(after_id=after_id), count):
+            em = self.message_embed(server, channel, message)
             await self.bot.say(embed=em)
 
     @checks.serverowner_or_permissions()
@@ -201,29 +498,45 @@ class Archive:
     @checks.serverowner_or_permissions()
     @archiveserver.command(name="full", pass_context=True, no_pm=True)
     async def archiveserver_full(self, ctx, server_name):
-        """Archive all messages from a server. Return as JSON."""
+        """Archive all messages from a server.
+
+        Channels are archived in parallel with progress reported here.
+        Cancel with [p]archiveserver cancel; running it again resumes.
+        """
         server = discord.utils.get(self.bot.servers, name=server_name)
         if server is None:
             await self.bot.say("Server not found.")
             return
-        log = {}
-        for channel in server.channels:
-            await self.bot.type()
-            log[channel.id] = {
-                "id": channel.id,
-                "name": channel.name,
-                "messages": await self.channel_messages(channel, count=10000)
-            }
+        if server.id in self.jobs:
+            await self.bot.say("This server is already being archived.")
+            return
+        job = ServerArchiveJob(self, server, ctx.message.channel)
+        job.task = self.bot.loop.create_task(job.run())
+        self.jobs[server.id] = job
 
-        filename = "server_archive-{}.json".format(server.id)
-        with io.StringIO() as f:
-            json.dump(log, f, indent=4)
-            f.seek(0)
-            await ctx.bot.send_file(
-                ctx.message.channel,
-                f,
-                filename=filename
-            )
+    @checks.serverowner_or_permissions()
+    @archiveserver.command(name="cancel", pass_context=True, no_pm=True)
+    async def archiveserver_cancel(self, ctx, server_name):
+        """Cancel a running server archive."""
+        server = discord.utils.get(self.bot.servers, name=server_name)
+        if server is None or server.id not in self.jobs:
+            await self.bot.say("No archive is running for that server.")
+            return
+        self.jobs[server.id].task.cancel()
+
+    @checks.serverowner_or_permissions()
+    @archiveserver.command(name="status", pass_context=True, no_pm=True)
+    async def archiveserver_status(self, ctx):
+        """Show running archives of this server or started from it."""
+        server = ctx.message.server
+        jobs = [
+            job for job in self.jobs.values()
+            if server in (job.server, job.channel.server)]
+        if not len(jobs):
+            await self.bot.say("No archive is running.")
+            return
+        for job in jobs:
+            await self.bot.say(job.status())
 
     @checks.serverowner_or_permissions()
     @archiveserver.command(name="listen", pass_context=True, no_pm=True)
@@ -271,123 +584,23 @@ class Archive:
         channel = discord.utils.get(server.channels, id=settings["log_channel_id"])
         if channel is None:
             return
-        msg = {
-            'author_id': message.author.id,
-            'content': message.content,
-            'timestamp': message.timestamp.isoformat(),
-            'id': message.id,
-            'reactions': [],
-            'attachments': []
-        }
-        for reaction in message.reactions:
-            r = {
-                'custom_emoji': reaction.custom_emoji,
-                'count': reaction.count
-            }
-            if reaction.custom_emoji:
-                # <:emoji_name:emoji_id>
-                r['emoji'] = '<:{}:{}>'.format(
-                    reaction.emoji.name,
-                    reaction.emoji.id)
-            else:
-                r['emoji'] = reaction.emoji
-            msg['reactions'].append(r)
-
-        for attach in message.attachments:
-            msg['attachments'].append(attach['url'])
+        msg = message_dict(message)
         em = self.message_embed(message.server, message.channel, msg)
         await self.bot.send_message(channel, embed=em)
 
 
-    async def channel_messages(self, channel: discord.Channel,
-            count=1000, before=None, after=None, reverse=False):
-        messages = []
-
-        async for message in self.bot.logs_from(
-                channel, limit=count, before=before, after=after, reverse=reverse):
-            msg = {
-                "timestamp": message.timestamp.isoformat(),
-                "author_id": message.author.id,
-                "author_name": message.author.name,
-                "content": message.content,
-                "embeds": message.embeds,
-                "channel_id": message.channel.id,
-                "channel_name": message.channel.name,
-                "server_id": message.server.id,
-                "server_name": message.server.name,
-                "mention_everyone": message.mention_everyone,
-                "mentions_id": [m.id for m in message.mentions],
-                "mentions_name": [m.name for m in message.mentions],
-                "reactions": [],
-                "attachments": []
-            }
-            for reaction in message.reactions:
-                r = {
-                    'custom_emoji': reaction.custom_emoji,
-                    'count': reaction.count
-                }
-                if reaction.custom_emoji:
-                    # <:emoji_name:emoji_id>
-                    r['emoji'] = '<:{}:{}>'.format(
-                        reaction.emoji.name,
-                        reaction.emoji.id)
-                else:
-                    r['emoji'] = reaction.emoji
-                msg['reactions'].append(r)
-
-            for attach in message.attachments:
-                msg['attachments'].append(attach['url'])
-                messages.append(msg)
-
-        messages = sorted(messages, key=lambda x: x['timestamp'])
-        return messages
-
-
     async def log_server_channel(
             self, ctx, server: discord.Server, channel: discord.Channel,
-            count=1000, before=None, after=None, reverse=False):
-        """Save channel messages."""
-        channel_messages = []
+            count=1000, before=None, after=None):
+        """Write out channel messages.
 
+        The messages are fetched for output only. They are not added to
+        the channel archive, which only grows forward without gaps.
+        """
         await self.bot.say("Logging messages.")
-
         async for message in self.bot.logs_from(
-                channel, limit=count, before=before, after=after, reverse=reverse):
-            msg ={
-                'author_id': message.author.id,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'id': message.id,
-                'reactions': [],
-                'attachments': []
-            }
-            for reaction in message.reactions:
-                r = {
-                    'custom_emoji': reaction.custom_emoji,
-                    'count': reaction.count
-                }
-                if reaction.custom_emoji:
-                    # <:emoji_name:emoji_id>
-                    r['emoji'] = '<:{}:{}>'.format(
-                        reaction.emoji.name,
-                        reaction.emoji.id)
-                else:
-                    r['emoji'] = reaction.emoji
-                msg['reactions'].append(r)
-
-            for attach in message.attachments:
-                msg['attachments'].append(attach['url'])
-            channel_messages.append(msg)
-
-        channel_messages = sorted(
-            channel_messages, key=lambda x: x['timestamp'])
-
-        self.settings[server.id][channel.id] = channel_messages
-        dataIO.save_json(JSON, self.settings)
-
-        # write out
-        for message in channel_messages:
-            em = self.message_embed(server, channel, message)
+                channel, limit=count, before=before, after=after, reverse=True):
+            em = self.message_embed(server, channel, message_dict(message))
             await self.bot.say(embed=em)
 
     def message_embed(self, server, channel, message):
@@ -410,7 +623,7 @@ class Archive:
         for reaction in message['reactions']:
             em.add_field(name=reaction['emoji'], value=reaction['count'])
 
-        for attach in message['attachments']:
+        for attach in message.get('attachments', []):
             em.set_image(url=attach)
 
         em.set_footer(text='{} - ID: {}'.format(timestamp, message_id))
@@ -419,8 +632,9 @@ class Archive:
 
 def check_folder():
     """Check folder."""
-    if not os.path.exists(PATH):
-        os.makedirs(PATH)
+    for path in [PATH, CHANNELS_PATH, JOBS_PATH]:
+        if not os.path.exists(path):
+            os.makedirs(path)
 
 
 def check_file():
@@ -23,7 +23,9 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import os
+import asyncio
 import datetime as dt
+import heapq
 import aiohttp
 
 import discord
@@ -38,6 +40,7 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 import gspread
 from fuzzywuzzy import fuzz
+from fuzzywuzzy import utils as fuzz_utils
 
 PATH = os.path.join("data", "banned")
 JSON = os.path.join(PATH, "settings.json")
@@ -52,6 +55,9 @@ SCOPES = [
 SERVICE_KEY_JSON = os.path.join(PATH, "service_key.json")
 APPLICATION_NAME = "Red Discord Bot Banned Cog"
 
+# seconds between sheet fetches
+REFRESH_INTERVAL = 300
+
 FIELDS = {
     'IGN': 'IGN',
     'PlayerTag': 'Player tag',
@@ -78,6 +84,55 @@ class Player:
         self.banned_date = banned_date
 
 
+class BanList:
+    """In-memory snapshot of the ban list sheet.
+
+    Records are indexed by player tag and by normalized IGN. Normalized
+    IGNs are also kept as a list for fuzzy matching so that they are
+    not reprocessed on every search.
+    """
+
+    def __init__(self, records):
+        """Constructor."""
+        self.records = records
+        self.timestamp = dt.datetime.utcnow()
+        self.by_tag = {}
+        self.by_raw_ign = {}
+        self.by_ign = {}
+        self.fuzzy_index = []
+        for record in records:
+            self.by_tag.setdefault(record['PlayerTag'], record)
+            self.by_raw_ign.setdefault(record['IGN'], record)
+            ign = self.normalize(record['IGN'])
+            self.by_ign.setdefault(ign, record)
+            self.fuzzy_index.append((ign, record))
+
+    @staticmethod
+    def normalize(ign):
+        return fuzz_utils.full_process(str(ign))
+
+    def find_tag(self, tag):
+        return self.by_tag.get(tag)
+
+    def find_ign(self, ign):
+        """Exact match by IGN, then by normalized IGN."""
+        record = self.by_raw_ign.get(ign)
+        if record is not None:
+            return record
+        return self.by_ign.get(self.normalize(ign))
+
+    def closest(self, ign, limit):
+        """Records with the closest IGNs, best first."""
+        query = self.normalize(ign)
+        # earlier rows win ties
+        scored = (
+            (fuzz.ratio(query, record_ign), -index)
+            for index, (record_ign, record) in enumerate(self.fuzzy_index))
+        return [
+            self.fuzzy_index[-index][1]
+            for ratio, index in heapq.nlargest(limit, scored)]
+
+
 class Banned:
     """Manage people who are banned from the RACF.
 
@@ -88,6 +143,26 @@ class Banned:
         """Constructor."""
         self.bot = bot
         self.settings = dataIO.load_json(JSON)
+        # authorized gspread client, created on first fetch
+        self.gc = None
+        # BanList by server id
+        self.ban_lists = {}
+        self.task = bot.loop.create_task(self.loop_task())
+
+    def __unload(self):
+        self.task.cancel()
+
+    async def loop_task(self):
+        """Refresh ban lists in the background."""
+        await self.bot.wait_until_ready()
+        while self is self.bot.get_cog("Banned"):
+            for server_id in list(self.ban_lists.keys()):
+                try:
+                    await self.refresh(server_id)
+                except Exception:
+                    # keep serving the last snapshot
+                    pass
+            await asyncio.sleep(REFRESH_INTERVAL)
 
     def check_server_settings(self, server):
         """check server settings. Init if necessary."""
@@ -131,6 +206,7 @@ class Banned:
         async with aiohttp.get(url) as cred:
             with open(SERVICE_KEY_JSON, "wb") as f:
                 f.write(await cred.read())
+        self.gc = None
 
         await self.bot.say(
             "Attachment received and saved as {}".format(SERVICE_KEY_JSON))
@@ -147,6 +223,7 @@ class Banned:
         server = ctx.message.server
         self.check_server_settings(server)
         self.settings[server.id]["SHEET_ID"] = id
+        self.ban_lists.pop(server.id, None)
         await self.bot.say("Saved Google Spreadsheet ID.")
         dataIO.save_json(JSON, self.settings)
 
@@ -225,24 +302,57 @@ class Banned:
         if ctx.invoked_subcommand is None:
             await send_cmd_help(ctx)
 
-    def get_sheet(self, ctx) -> gspread.Worksheet:
-        """Return values from spreadsheet."""
-        server = ctx.message.server
+    def get_sheet(self, server_id) -> gspread.Worksheet:
+        """Return first worksheet of server spreadsheet.
 
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            SERVICE_KEY_JSON, scopes=SCOPES)
-        spreadsheetId = self.settings[server.id]["SHEET_ID"]
-        gc = gspread.authorize(credentials)
-        sh = gc.open_by_key(spreadsheetId)
+        Blocking. The authorized client is reused until its token expires.
+        """
+        if self.gc is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(
+                SERVICE_KEY_JSON, scopes=SCOPES)
+            self.gc = gspread.authorize(credentials)
+        elif self.gc.auth.access_token_expired:
+            self.gc.login()
+        spreadsheetId = self.settings[server_id]["SHEET_ID"]
+        sh = self.gc.open_by_key(spreadsheetId)
         worksheet = sh.get_worksheet(0)
 
         return worksheet
 
-    def get_players(self, ctx):
-        """Return lisst of players as dictionary."""
-        sheet = self.get_sheet(ctx)
-        records = sheet.get_all_records(default_blank="-")
-        return records
+    def fetch_records(self, server_id):
+        """Return list of players as dictionary. Blocking."""
+        sheet = self.get_sheet(server_id)
+        return sheet.get_all_records(default_blank="-")
+
+    async def refresh(self, server_id):
+        """Fetch sheet in an executor and replace the snapshot."""
+        records = await self.bot.loop.run_in_executor(
+            None, self.fetch_records, server_id)
+        ban_list = await self.bot.loop.run_in_executor(None, BanList, records)
+        self.ban_lists[server_id] = ban_list
+        return ban_list
+
+    async def get_ban_list(self, ctx) -> BanList:
+        """Ban list snapshot of server, fetched on first use."""
+        server = ctx.message.server
+        if server.id not in self.ban_lists:
+            await self.bot.type()
+            await self.refresh(server.id)
+        return self.ban_lists[server.id]
+
+    async def get_players(self, ctx):
+        """Return list of players as dictionary."""
+        ban_list = await self.get_ban_list(ctx)
+        return ban_list.records
+
+    @banned.command(name="refresh", pass_context=True)
+    @checks.mod_or_permissions()
+    async def banned_refresh(self, ctx):
+        """Fetch ban list from sheet now."""
+        server = ctx.message.server
+        ban_list = await self.refresh(server.id)
+        await self.bot.say(
+            "Loaded {} banned players.".format(len(ban_list.records)))
 
     @banned.command(name="list", pass_context=True)
     async def banned_list(self, ctx):
@@ -253,7 +363,7 @@ class Banned:
 
         Optional arguments.
         """
-        players = self.get_players(ctx)
+        players = await self.get_players(ctx)
         players = sorted(players, key=lambda x: x['IGN'])
 
         out = [
@@ -282,12 +392,8 @@ class Banned:
         """Show banned player by player tag."""
         if not tag.startswith('#'):
             tag = '#{}'.format(tag)
-        players = self.get_players(ctx)
-        player = None
-        for p in players:
-            if p['PlayerTag'] == tag:
-                player = p
-                break
+        ban_list = await self.get_ban_list(ctx)
+        player = ban_list.find_tag(tag)
         if player is None:
             await self.bot.say('Cannot find player with that tag.')
             return
@@ -297,41 +403,31 @@ class Banned:
     @banned.command(name="ign", pass_context=True, aliases=['name'])
     async def banned_ign(self, ctx, *, ign):
         """Find player by IGN."""
-        players = self.get_players(ctx)
-        player = None
+        ban_list = await self.get_ban_list(ctx)
 
         # find exact match
-        for p in players:
-            if p['IGN'] == ign:
-                player = p
-                break
+        player = ban_list.find_ign(ign)
 
         if player is not None:
             await self.bot.say(embed=self.player_embed(ctx, player))
             return
 
         # find fuzzy match
-        fuzz_ratio = []
-        for id, p in enumerate(players):
-            ratio = fuzz.ratio(ign, p['IGN'])
-            fuzz_ratio.append({
-                "id": id,
-                "ratio": ratio,
-                "player": p
-            })
-        fuzz_ratio = sorted(fuzz_ratio, key=lambda x: x["ratio"], reverse=True)
+        list_max = 5
+        matches = ban_list.closest(ign, list_max + 1)
+        if not matches:
+            await self.bot.say('Cannot find any players.')
+            return
 
         await self.bot.say('Exact IGN not found. Showing closest match:')
         await self.bot.say(
             embed=self.player_embed(
-                ctx, fuzz_ratio[0]["player"]))
+                ctx, matches[0]))
 
         out = []
-        list_max = 5
         out.append('Here are other top matches:'.format(list_max))
 
-        for r in fuzz_ratio[1:list_max + 1]:
-            player = r["player"]
+        for player in matches[1:]:
             out.append('+ {} ({})'.format(player['IGN'], player['PlayerTag']))
 
         for page in pagify('\n'.join(out), shorten_by=24):
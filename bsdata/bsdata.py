@@ -39,6 +39,9 @@ from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 from discord.ext.commands import Context
 
+from .crprofile import PlayerTagIndex
+from .httpclient import SessionHTTP
+
 try:
     import aiohttp
 except ImportError:
@@ -107,18 +110,19 @@ def format_timedelta(td):
     return '{0[0]} hr {0[1]} min {0[2]} sec'.format(l)
 
 
-async def fetch(url, timeout=10, headers=None):
+async def fetch(bot, url, timeout=10, headers=None):
     """Fetch URL.
 
-    :param session: aiohttp.ClientSession
+    :param bot: Red bot, used to access the shared HTTPClient cog
     :param url: URL
     :return: Response in JSON
     """
     try:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url, timeout=timeout) as resp:
-                data = await resp.json()
-                return data
+        http = bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(bot.loop)
+        status, data = await http.get_json(url, headers=headers, timeout=timeout)
+        return data
     except asyncio.TimeoutError:
         return None
     except aiohttp.ClientResponseError:
@@ -137,20 +141,31 @@ class BotEmoji:
         self.bot = bot
         self.mapping = mapping
 
-    def name(self, name):
-        """Emoji by name."""
-        for emoji in self.bot.get_all_emojis():
-            if emoji.name == name:
-                return '<:{}:{}>'.format(emoji.name, emoji.id)
-        return ''
+    def get(self, name):
+        """Emoji object by name or None.
 
-    def named(self, name):
-        """Emoji object by name"""
+        Looked up from the shared EmojiIndex cog. If it is not loaded,
+        scan the bot emojis.
+        """
+        index = self.bot.get_cog("EmojiIndex")
+        if index is not None:
+            return index.emojis.get(name)
         for emoji in self.bot.get_all_emojis():
             if emoji.name == name:
                 return emoji
         return None
 
+    def name(self, name):
+        """Emoji by name."""
+        emoji = self.get(name)
+        if emoji is None:
+            return ''
+        return '<:{}:{}>'.format(emoji.name, emoji.id)
+
+    def named(self, name):
+        """Emoji object by name"""
+        return self.get(name)
+
     def key(self, key):
         """Chest emojis by api key name or key.
 
@@ -656,6 +671,7 @@ class BSDataSettings:
         """Init."""
         self.bot = bot
         self.settings = dataIO.load_json(JSON)
+        self.tag_index = PlayerTagIndex()
 
     def save(self):
         """Save settings to file."""
@@ -664,6 +680,7 @@ class BSDataSettings:
     def init_server(self, server):
         """Initialize server settings."""
         self.settings["servers"][server.id] = SERVER_DEFAULTS
+        self.tag_index.reset(server.id)
         self.save()
 
     def check_server_settings(self, server):
@@ -737,9 +754,15 @@ class BSDataSettings:
         """Add or edit a player."""
         if "players" not in self.settings["servers"][server.id]:
             self.settings["servers"][server.id]["players"] = {}
-        self.settings["servers"][server.id]["players"][member_id] = player_tag
+        players = self.settings["servers"][server.id]["players"]
+        self.tag_index.update(server.id, member_id, players.get(member_id), player_tag)
+        players[member_id] = player_tag
         self.save()
 
+    def tag2member_id(self, server, player_tag):
+        """Return member id associated with player tag."""
+        return self.tag_index.member_id(server.id, self.get_players(server), player_tag)
+
 
 class BSData:
     """Brawl Stars Clan management."""
@@ -819,7 +842,7 @@ class BSData:
     async def get_band_data(self, tag):
         """Return band data JSON."""
         url = "{}{}".format(self.settings.band_api_url, tag)
-        data = await fetch(url, headers={"Authorization": self.settings.api_auth})
+        data = await fetch(self.bot, url, headers={"Authorization": self.settings.api_auth})
         return data
 
     def tag2member(self, tag=None):
@@ -1052,7 +1075,7 @@ class BSData:
     async def get_player_data(self, tag):
         """Return player data JSON."""
         url = "{}{}".format(self.settings.player_api_url, tag)
-        data = await fetch(url, headers={"Authorization": self.settings.api_auth})
+        data = await fetch(self.bot, url, headers={"Authorization": self.settings.api_auth})
         return data
 
     async def get_player_model(self, tag):
@@ -1137,14 +1160,10 @@ class BSData:
 
     def get_discord_member(self, server, player_tag):
         """Return Discord member if tag is associated."""
-        member_id = None
         try:
-            players = self.settings.get_players(server)
-            for k, v in players.items():
-                if v == player_tag:
-                    member_id = k
+            member_id = self.settings.tag2member_id(server, player_tag)
         except KeyError:
-            pass
+            member_id = None
         if member_id is None:
             return None
         return server.get_member(member_id)
@@ -1219,7 +1238,7 @@ class BSData:
 
         await self.bot.type()
         url = self.settings.event_api_url
-        data = await fetch(url, headers={"Authorization": self.settings.api_auth})
+        data = await fetch(self.bot, url, headers={"Authorization": self.settings.api_auth})
         if data is None:
             await self.bot.say("Error fetching events from API.")
             return
@@ -29,29 +29,32 @@ matplotlib.use('Agg')
 from .utils.dataIO import dataIO
 from __main__ import send_cmd_help
 from cogs.utils.chat_formatting import pagify, box
+from concurrent.futures import ProcessPoolExecutor
 from discord.ext import commands
 from discord.ext.commands import Context
 from itertools import islice
-from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from random import choice
 import datetime
-import asyncio
 import discord
 import itertools
 import io
+import numpy as np
 import os
 import re
 import string
 import pprint
-import statistics
 
 from .deck import Deck
 from collections import namedtuple
+from collections import OrderedDict
 
 
 settings_path = "data/card/settings.json"
 crdata_path = "data/card/clashroyale.json"
 cardpop_path = "data/card/cardpop.json"
+cardpop_columns_path = "data/card/cardpop_columns"
 crtexts_path = "data/card/crtexts.json"
 dates_path = "data/card/dates.json"
 
@@ -65,6 +68,10 @@ max_deck_show = 5
 
 PAGINATION_TIMEOUT = 20.0
 
+# plots are rendered in a process pool and cached as PNG bytes
+PLOT_WORKERS = 2
+PLOT_CACHE_SIZE = 32
+
 discord_ui_bgcolor = discord.Color(value=int('36393e', 16))
 
 
@@ -73,6 +80,324 @@ def take(n, iterable):
     return list(islice(iterable, n))
 
 
+def figure_to_png(fig, **kwargs):
+    """Return figure as PNG bytes."""
+    FigureCanvasAgg(fig)
+    with io.BytesIO() as f:
+        fig.savefig(f, format="png", **kwargs)
+        return f.getvalue()
+
+
+def plot_cardtrend(x, labels, series):
+    """Plot card trends and return PNG bytes.
+
+    Runs in a worker process.
+
+    x: snapshot ids
+    labels: x tick labels
+    series: tuple of (card name, usage per snapshot)
+    """
+    facecolor = '#32363b'
+    edgecolor = '#eeeeee'
+    spinecolor = '#999999'
+    footercolor = '#999999'
+    labelcolor = '#cccccc'
+    tickcolor = '#999999'
+    titlecolor = '#ffffff'
+
+    fig = Figure(
+        figsize=(8, 6),
+        dpi=192,
+        facecolor=facecolor,
+        edgecolor=edgecolor)
+
+    ax = fig.add_subplot(111)
+    ax.grid(True, alpha=0.3)
+
+    ax.set_title('Clash Royale Card Trends', color=titlecolor)
+    ax.set_xlabel('Snapshots')
+    ax.set_ylabel('Usage')
+
+    for spine in ax.spines.values():
+        spine.set_edgecolor(spinecolor)
+
+    ax.xaxis.label.set_color(labelcolor)
+    ax.yaxis.label.set_color(labelcolor)
+    ax.tick_params(axis='x', colors=tickcolor)
+    ax.tick_params(axis='y', colors=tickcolor)
+
+    for name, y in series:
+        ax.plot(x, y, 'o-', label=name)
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=70, fontsize=8, ha='right')
+
+    leg = ax.legend(facecolor=facecolor, edgecolor=spinecolor)
+    for text in leg.get_texts():
+        text.set_color(labelcolor)
+
+    ax.annotate(
+        'Compiled with data from Woody’s popularity snapshots',
+
+        # The point that we'll place the text in relation to
+        xy=(0, 0),
+        # Interpret the x as axes coords, and the y as figure
+        # coords
+        xycoords=('figure fraction'),
+
+        # The distance from the point that the text will be at
+        xytext=(15, 10),
+        # Interpret `xytext` as an offset in points...
+        textcoords='offset points',
+
+        # Any other text parameters we'd like
+        size=8, ha='left', va='bottom', color=footercolor)
+
+    fig.subplots_adjust(left=0.1, right=0.96, top=0.9, bottom=0.2)
+
+    return figure_to_png(
+        fig, facecolor=facecolor, edgecolor=edgecolor, transparent=True)
+
+
+def plot_elixirtrend(points, labels, stats):
+    """Plot elixir trends and return PNG bytes.
+
+    Runs in a worker process.
+
+    points: tuple of (snapshot id, elixir, count) for every deck
+    labels: x tick labels, one per point
+    stats: tuple of (name, snapshot ids, values) for mean and median
+    """
+    # Colors
+    facecolor = '#32363b'
+    edgecolor = '#333333'
+    spinecolor = '#666666'
+    footercolor = '#999999'
+    labelcolor = '#cccccc'
+    tickcolor = '#999999'
+    titlecolor = '#ffffff'
+
+    fig = Figure(
+        figsize=(8, 6),
+        dpi=192,
+        facecolor=facecolor,
+        edgecolor=edgecolor)
+
+    ax = fig.add_subplot(111)
+
+    ax.set_title(
+        'Clash Royale Decks: Average Elixir Trends', color=titlecolor)
+    ax.set_xlabel('Snapshots')
+    ax.set_ylabel('Elixir')
+
+    for spine in ax.spines.values():
+        spine.set_edgecolor(spinecolor)
+
+    ax.xaxis.label.set_color(labelcolor)
+    ax.yaxis.label.set_color(labelcolor)
+    ax.tick_params(axis='x', colors=tickcolor)
+    ax.tick_params(axis='y', colors=tickcolor)
+
+    # scatter plot datapoints
+    x = [int(p[0]) for p in points]
+    y = [p[1] for p in points]
+    area = [p[2] * 2 for p in points]
+    ax.scatter(x, y, s=area, c="yellow")
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=70, fontsize=8, ha='right')
+
+    # plot mean and median
+    for name, x, y in stats:
+        ax.plot(x, y, 'o-', label=name)
+
+    leg = ax.legend(facecolor=facecolor, edgecolor=spinecolor)
+    for text in leg.get_texts():
+        text.set_color(labelcolor)
+
+    ax.annotate(
+        'Compiled with data from Woody’s popularity snapshots',
+        xy=(0, 0),
+        xycoords=('figure fraction'),
+        xytext=(15, 10),
+        textcoords='offset points',
+        size=8, ha='left', va='bottom', color=footercolor)
+
+    fig.subplots_adjust(left=0.1, right=0.96, top=0.9, bottom=0.2)
+
+    return figure_to_png(
+        fig, facecolor=facecolor, edgecolor=edgecolor, transparent=True)
+
+
+class PlotRenderer:
+    """Render plots in a process pool and cache them as PNG bytes.
+
+    Shared by the Card and ClashRoyale cogs. Results are cached by plot
+    function and arguments; the cache is only touched from the event loop.
+    """
+
+    def __init__(self, loop, workers=PLOT_WORKERS, cache_size=PLOT_CACHE_SIZE):
+        """Init."""
+        self.loop = loop
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def shutdown(self):
+        """Shut down worker processes."""
+        self.executor.shutdown(wait=False)
+
+    async def render(self, func, *args):
+        """Render plot with func(*args) and return PNG bytes."""
+        key = (func.__name__,) + args
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        png = await self.loop.run_in_executor(self.executor, func, *args)
+        self.cache[key] = png
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return png
+
+
+class CardPopStore:
+    """Card popularity snapshots as columnar arrays.
+
+    Compiled from cardpop.json by data/scripts/popcolumns.py and
+    memory-mapped at load. Cards are columns in sorted order; decks are
+    rows grouped by snapshot with a card bitmask, count and elixir.
+    """
+
+    ARRAYS = [
+        "card_count", "card_change", "card_present",
+        "deck_snapshot", "deck_mask", "deck_count", "deck_elixir"]
+
+    def __init__(self, index, arrays):
+        self.snapshots = index["snapshots"]
+        self.cards = index["cards"]
+        self.snapshot_index = {s: i for i, s in enumerate(self.snapshots)}
+        self.card_index = {c: i for i, c in enumerate(self.cards)}
+        self.words = (len(self.cards) + 63) // 64
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map compiled arrays from path."""
+        index = dataIO.load_json(os.path.join(path, "index.json"))
+        arrays = {
+            name: np.load(
+                os.path.join(path, "{}.npy".format(name)), mmap_mode='r')
+            for name in cls.ARRAYS}
+        return cls(index, arrays)
+
+    def __contains__(self, snapshot_id):
+        return str(snapshot_id) in self.snapshot_index
+
+    def card_counts(self, card, snapshot_ids):
+        """Return usage of card for each snapshot id, 0 if missing."""
+        out = np.zeros(len(snapshot_ids), dtype=np.int64)
+        c = self.card_index.get(card)
+        if c is None:
+            return out
+        for i, snapshot_id in enumerate(snapshot_ids):
+            s = self.snapshot_index.get(str(snapshot_id))
+            if s is not None:
+                out[i] = self.card_count[s, c]
+        return out
+
+    def card_stats(self, card, snapshot_id):
+        """Return (count, change) of card in snapshot or None."""
+        s = self.snapshot_index.get(str(snapshot_id))
+        c = self.card_index.get(card)
+        if s is None or c is None or not self.card_present[s, c]:
+            return None
+        return int(self.card_count[s, c]), int(self.card_change[s, c])
+
+    def top_cards(self, snapshot_id):
+        """Return list of (card, count, change) in snapshot by usage."""
+        s = self.snapshot_index[str(snapshot_id)]
+        present = np.flatnonzero(self.card_present[s])
+        counts = self.card_count[s, present]
+        order = present[np.argsort(-counts, kind='stable')]
+        return [
+            (self.cards[c],
+             int(self.card_count[s, c]),
+             int(self.card_change[s, c]))
+            for c in order]
+
+    def cards_mask(self, cards):
+        """Return bitmask of cards."""
+        mask = np.zeros(self.words, dtype='<u8')
+        for card in cards:
+            c = self.card_index[card]
+            mask[c // 64] |= np.uint64(1) << np.uint64(c % 64)
+        return mask
+
+    def snapshot_decks(self, snapshot_id):
+        """Return deck rows of a snapshot."""
+        s = self.snapshot_index.get(str(snapshot_id))
+        if s is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.deck_snapshot == s)
+
+    def find_decks(self, snapshot_id, cards):
+        """Return deck rows of a snapshot containing all cards."""
+        rows = self.snapshot_decks(snapshot_id)
+        if any(card not in self.card_index for card in cards):
+            return rows[:0]
+        mask = self.cards_mask(cards)
+        masks = self.deck_mask[rows]
+        return rows[np.all(masks & mask == mask, axis=1)]
+
+    def deck_cards(self, row):
+        """Return sorted card names of a deck row."""
+        bits = np.unpackbits(
+            np.ascontiguousarray(self.deck_mask[row]).view(np.uint8),
+            bitorder='little')
+        return [self.cards[c] for c in np.flatnonzero(bits[:len(self.cards)])]
+
+    def deck_key(self, row):
+        """Return deck id used in cardpop.json."""
+        return ', '.join(self.deck_cards(row))
+
+    def deck_row(self, deck, snapshot_id):
+        """Return deck row from deck id or None."""
+        cards = deck.split(', ')
+        rows = self.find_decks(snapshot_id, cards)
+        for row in rows:
+            if len(self.deck_cards(row)) == len(cards):
+                return row
+        return None
+
+    def elixir_mean(self):
+        """Return usage weighted mean elixir per snapshot."""
+        counts = self.deck_count.astype(np.float64)
+        n = len(self.snapshots)
+        total = np.bincount(self.deck_snapshot, weights=counts, minlength=n)
+        elixir = np.bincount(
+            self.deck_snapshot, weights=counts * self.deck_elixir,
+            minlength=n)
+        return elixir / total
+
+    def elixir_median(self):
+        """Return usage weighted median elixir per snapshot.
+
+        Same as the median of every deck elixir repeated count times.
+        """
+        out = np.zeros(len(self.snapshots))
+        for s in range(len(self.snapshots)):
+            rows = np.flatnonzero(self.deck_snapshot == s)
+            if not len(rows):
+                continue
+            order = np.argsort(self.deck_elixir[rows], kind='stable')
+            elixir = self.deck_elixir[rows][order]
+            cum = np.cumsum(self.deck_count[rows][order])
+            n = cum[-1]
+            lo = np.searchsorted(cum, (n - 1) // 2, side='right')
+            hi = np.searchsorted(cum, n // 2, side='right')
+            out[s] = (elixir[lo] + elixir[hi]) / 2
+        return out
+
+
 class Card:
     """Clash Royale Card Popularity snapshots."""
 
@@ -86,7 +411,7 @@ class Card:
 
         self.settings = dataIO.load_json(self.file_path)
         self.crdata = dataIO.load_json(self.crdata_path)
-        self.cardpop = dataIO.load_json(self.cardpop_path)
+        self.cardpop = self.load_cardpop()
         self.crtexts = dataIO.load_json(self.crtexts_path)
         self.dates = dataIO.load_json(self.dates_path)
 
@@ -114,8 +439,18 @@ class Card:
         self.card_thumb_w = int(self.card_w * self.card_thumb_scale)
         self.card_thumb_h = int(self.card_h * self.card_thumb_scale)
 
-        self.plotfigure = 0
-        self.plot_lock = asyncio.Lock()
+        self.plot_renderer = PlotRenderer(bot.loop)
+
+    def __unload(self):
+        self.plot_renderer.shutdown()
+
+    def load_cardpop(self):
+        """Load card popularity snapshots.
+
+        Columns are compiled from cardpop.json by
+        data/scripts/popcolumns.py; run it after updating cardpop.json.
+        """
+        return CardPopStore.load(cardpop_columns_path)
 
     @commands.command(pass_context=True)
     async def card(self, ctx, card=None):
@@ -204,15 +539,7 @@ class Card:
         cards = [self.get_card_name(c) for c in cards]
         # cpids = [self.get_card_cpid(c) for c in cards]
 
-        found_decks = []
-        if snapshot_id in self.cardpop:
-            decks = self.cardpop[snapshot_id]["decks"]
-            for k in decks.keys():
-                deck = decks[k]["deck"]
-                if all(card in deck for card in cards):
-                    found_decks.append(k)
-                # if all(cpid in k for cpid in cpids):
-                #     found_decks.append(k)
+        found_decks = self.cardpop.find_decks(snapshot_id, cards)
 
         await self.bot.say("Found {} decks with {} in Snapshot #{}{}.".format(
             len(found_decks),
@@ -225,18 +552,19 @@ class Card:
             #     "Listing top {} decks:".format(
             #         min([max_deck_show, len(found_decks)])))
 
-            for i, deck in enumerate(found_decks):
+            for i, row in enumerate(found_decks):
                 # Show top 5 deck images only
                 # if i < max_deck_show:
 
                 results_max = 3
 
+                deck = self.cardpop.deck_key(row)
                 cards = deck.split(', ')
                 norm_cards = [self.get_card_from_cpid(c) for c in cards]
 
                 await self.bot.say("**{}**: {}/100: {}".format(
                     i + 1,
-                    self.get_deckpop_count(deck, snapshot_id),
+                    int(self.cardpop.deck_count[row]),
                     self.card_to_str(deck)))
 
                 FakeMember = namedtuple("FakeMember", "name")
@@ -315,36 +643,7 @@ class Card:
                 validated_cards.append(card)
 
         if len(validated_cards) == len(cards):
-
-            facecolor = '#32363b'
-            edgecolor = '#eeeeee'
-            spinecolor = '#999999'
-            footercolor = '#999999'
-            labelcolor = '#cccccc'
-            tickcolor = '#999999'
-            titlecolor = '#ffffff'
-
-            fig = plt.figure(
-                num=1,
-                figsize=(8, 6),
-                dpi=192,
-                facecolor=facecolor,
-                edgecolor=edgecolor)
-            plt.grid(b=True, alpha=0.3)
-
-            ax = fig.add_subplot(111)
-
-            ax.set_title('Clash Royale Card Trends', color=titlecolor)
-            ax.set_xlabel('Snapshots')
-            ax.set_ylabel('Usage')
-
-            for spine in ax.spines.values():
-                spine.set_edgecolor(spinecolor)
-
-            ax.xaxis.label.set_color(labelcolor)
-            ax.yaxis.label.set_color(labelcolor)
-            ax.tick_params(axis='x', colors=tickcolor)
-            ax.tick_params(axis='y', colors=tickcolor)
+            await self.bot.type()
 
             # create labels using snapshot dates
             labels = []
@@ -355,72 +654,30 @@ class Card:
                 labels.append("{}\n   {}".format(id, dtstr))
 
             # process plot only when all the cards are valid
-            for card in validated_cards:
-
-                x = range(cardpop_range_min, cardpop_range_max)
-                y = [int(self.get_cardpop_count(card, id)) for id in x]
-                ax.plot(x, y, 'o-', label=self.card_to_str(card))
-                plt.xticks(x, labels, rotation=70, fontsize=8, ha='right')
-
-            # make tick label font size smaller
-            # for tick in ax.xaxis.get_major_ticks():
-            #     tick.label.set_fontsize(8)
-
-            leg = ax.legend(facecolor=facecolor, edgecolor=spinecolor)
-            for text in leg.get_texts():
-                text.set_color(labelcolor)
-
-            ax.annotate(
-                'Compiled with data from Woody’s popularity snapshots',
-
-                # The point that we'll place the text in relation to
-                xy=(0, 0),
-                # Interpret the x as axes coords, and the y as figure
-                # coords
-                xycoords=('figure fraction'),
-
-                # The distance from the point that the text will be at
-                xytext=(15, 10),
-                # Interpret `xytext` as an offset in points...
-                textcoords='offset points',
+            x = tuple(range(cardpop_range_min, cardpop_range_max))
+            series = []
+            for card in sorted(validated_cards):
+                y = tuple(int(c) for c in self.cardpop.card_counts(card, x))
+                series.append((self.card_to_str(card), y))
 
-                # Any other text parameters we'd like
-                size=8, ha='left', va='bottom', color=footercolor)
-
-            plt.subplots_adjust(left=0.1, right=0.96, top=0.9, bottom=0.2)
+            png = await self.plot_renderer.render(
+                plot_cardtrend, x, tuple(labels), tuple(series))
 
             plot_filename = "{}-plot.png".format("-".join(cards))
             # plot_name = "Card Trends: {}".format(
             #     ", ".join([self.card_to_str(c) for c in validated_cards]))
             plot_name = ""
 
-            with io.BytesIO() as f:
-                plt.savefig(f, format="png", facecolor=facecolor,
-                            edgecolor=edgecolor, transparent=True)
-                f.seek(0)
+            with io.BytesIO(png) as f:
                 await ctx.bot.send_file(
                     ctx.message.channel, f,
                     filename=plot_filename,
                     content=plot_name)
 
-            fig.clf()
-
-        plt.clf()
-        plt.cla()
-
     @commands.command(pass_context=True)
     async def elixirlist(self, ctx: Context):
         """Display average elixir over time."""
-        trend = {}
-
-        for snapshot_id, snapshot in self.cardpop.items():
-            decks = snapshot["decks"]
-            deck_count = 0
-            elixir_all = 0
-            for deck_id, deck_v in decks.items():
-                deck_count += deck_v["count"]
-                elixir_all += deck_v["count"] * deck_v["elixir"]
-            trend[snapshot_id] = elixir_all / deck_count
+        trend = dict(zip(self.cardpop.snapshots, self.cardpop.elixir_mean()))
 
         out = []
         for id in range(cardpop_range_min, cardpop_range_max):
@@ -436,131 +693,46 @@ class Card:
     @commands.command(pass_context=True)
     async def elixirtrend(self, ctx: Context):
         """Plot elixir trend over time."""
-        # sorted by snapshot id
-        trend = {}
-        # unsorted as list of dict
-        trendall = []
-        stats = []
-
-        for snapshot_id, snapshot in self.cardpop.items():
-            decks = snapshot["decks"]
-            # deck_id = 0
-
-            if snapshot_id not in trend:
-                trend[snapshot_id] = []
-
-            for deck_key, deck_v in decks.items():
-                trend[snapshot_id].append({
-                    "elixir": deck_v["elixir"],
-                    "count": deck_v["count"]
-                })
-                trendall.append({
-                    "id": snapshot_id,
-                    "elixir": deck_v["elixir"],
-                    "count": deck_v["count"]
-                })
-
-            # expand count to list for statistics
-            trendstat = []
-            for t in trend[snapshot_id]:
-                trendstat.extend([t["elixir"]] * t["count"])
-            stats.append({
-                "id": snapshot_id,
-                "trend": trendstat,
-                "median": statistics.median(trendstat),
-                "mean": statistics.mean(trendstat)
-            })
-            # print (str(trendstat))
-
-        # Colors
-        facecolor = '#32363b'
-        edgecolor = '#333333'
-        spinecolor = '#666666'
-        footercolor = '#999999'
-        labelcolor = '#cccccc'
-        tickcolor = '#999999'
-        titlecolor = '#ffffff'
-
-        fig = plt.figure(
-            num=1,
-            figsize=(8, 6),
-            dpi=192,
-            facecolor=facecolor,
-            edgecolor=edgecolor)
-        # plt.grid(b=True, alpha=1)
-
-        ax = fig.add_subplot(111)
-
-        ax.set_title(
-            'Clash Royale Decks: Average Elixir Trends', color=titlecolor)
-        ax.set_xlabel('Snapshots')
-        ax.set_ylabel('Elixir')
-
-        for spine in ax.spines.values():
-            spine.set_edgecolor(spinecolor)
-
-        ax.xaxis.label.set_color(labelcolor)
-        ax.yaxis.label.set_color(labelcolor)
-        ax.tick_params(axis='x', colors=tickcolor)
-        ax.tick_params(axis='y', colors=tickcolor)
+        store = self.cardpop
+        deck_ids = [store.snapshots[s] for s in store.deck_snapshot]
+        stats = {
+            "mean": store.elixir_mean(),
+            "median": store.elixir_median()
+        }
+
+        await self.bot.type()
 
         # create labels using snapshot dates
         labels = []
-        # for id in range(cardpop_range_min, cardpop_range_max):
-        for t in trendall:
-            dt = datetime.datetime.strptime(
-                self.dates[str(t["id"])], '%Y-%m-%d')
+        for id in deck_ids:
+            dt = datetime.datetime.strptime(self.dates[id], '%Y-%m-%d')
             dtstr = dt.strftime('%b %d, %y')
-            labels.append("{}\n   {}".format(t["id"], dtstr))
-
-        # cmap=plt.get_cmap(name)
-        # scatter plot datapoints
-        x = [int(t["id"]) for t in trendall]
-        y = [t["elixir"] for t in trendall]
-        area = [t["count"] * 2 for t in trendall]
-        # ax.scatter(x, y, s=area, c="np.arange(100)", cmap="plasma")
-        ax.scatter(x, y, s=area, c="yellow")
-        plt.xticks(x, labels, rotation=70, fontsize=8, ha='right')
-
-        # plot mean and median
-        for p in ["mean", "median"]:
-            x = [s["id"] for s in stats]
-            y = [s[p] for s in stats]
-            ax.plot(x, y, 'o-', label=string.capwords(p))
-
-        leg = ax.legend(facecolor=facecolor, edgecolor=spinecolor)
-        for text in leg.get_texts():
-            text.set_color(labelcolor)
-
-        ax.annotate(
-            'Compiled with data from Woody’s popularity snapshots',
-            xy=(0, 0),
-            xycoords=('figure fraction'),
-            xytext=(15, 10),
-            textcoords='offset points',
-            size=8, ha='left', va='bottom', color=footercolor)
-
-        plt.subplots_adjust(left=0.1, right=0.96, top=0.9, bottom=0.2)
+            labels.append("{}\n   {}".format(id, dtstr))
+
+        points = tuple(zip(
+            deck_ids,
+            store.deck_elixir.tolist(),
+            store.deck_count.tolist()))
+        stat_series = tuple(
+            (string.capwords(p),
+             tuple(store.snapshots),
+             tuple(stats[p].tolist()))
+            for p in ["mean", "median"])
+
+        png = await self.plot_renderer.render(
+            plot_elixirtrend, points, tuple(labels), stat_series)
 
         plot_filename = "elixir-trend-plot.png"
         # plot_name = "Card Trends: {}".format(
         #     ", ".join([self.card_to_str(c) for c in validated_cards]))
         plot_name = ""
 
-        with io.BytesIO() as f:
-            plt.savefig(f, format="png", facecolor=facecolor,
-                        edgecolor=edgecolor, transparent=True)
-            f.seek(0)
+        with io.BytesIO(png) as f:
             await ctx.bot.send_file(
                 ctx.message.channel, f,
                 filename=plot_filename,
                 content=plot_name)
 
-        fig.clf()
-        plt.clf()
-        plt.cla()
-
-
     @commands.command(pass_context=True)
     async def popdata(self, ctx: Context,
         snapshot_id=str(cardpop_range_max - 1), limit=10):
@@ -578,9 +750,8 @@ class Card:
         if limit <= 0:
             limit = 10000
 
-        snapshot = self.cardpop[snapshot_id]
-        cards = snapshot["cardpop"]
-        decks = snapshot["decks"]
+        cards = self.cardpop.top_cards(snapshot_id)
+        decks = self.cardpop.snapshot_decks(snapshot_id)
 
         dt = datetime.datetime.strptime(
             self.dates[str(snapshot_id)], '%Y-%m-%d')
@@ -591,20 +762,18 @@ class Card:
 
         await self.bot.say("**Cards:**")
         out = []
-        for card_key, card_value in take(limit, cards.items()):
+        for card_key, count, change in take(limit, cards):
             out.append("{:4d} ({:3d}) {}".format(
-                card_value["count"],
-                card_value["change"],
-                self.card_to_str(card_key)))
+                count, change, self.card_to_str(card_key)))
         for page in pagify("\n".join(out), shorten_by=12):
             await self.bot.say(box(page, lang="py"))
 
         await self.bot.say("**Decks:**")
         out = []
-        for deck_key, deck_value in take(limit, decks.items()):
+        for row in take(limit, decks):
             out.append("**{:4d}**: {}".format(
-                deck_value["count"],
-                self.card_to_str(deck_key)))
+                self.cardpop.deck_count[row],
+                self.card_to_str(self.cardpop.deck_key(row))))
         for page in pagify("\n".join(out), shorten_by=12):
             await self.bot.say(page)
 
@@ -656,13 +825,11 @@ class Card:
     def get_cardpop_count(self, card=None, snapshot_id=None):
         """Return card popularity count by snapshot id."""
         out = 0
-        snapshot_id = str(snapshot_id)
         if card is not None and snapshot_id is not None:
-            if snapshot_id in self.cardpop:
-                cardpop = self.cardpop[snapshot_id]["cardpop"]
-                cpid = self.get_card_cpid(card)
-                if cpid in cardpop:
-                    out = cardpop[cpid]["count"]
+            stats = self.cardpop.card_stats(
+                self.get_card_cpid(card), snapshot_id)
+            if stats is not None:
+                out = stats[0]
         return out
 
     def get_cardpop(self, card=None, snapshot_id=None):
@@ -671,16 +838,12 @@ class Card:
         Format: Count (Change)
         """
         out = "---"
-        snapshot_id = str(snapshot_id)
 
         if card is not None and snapshot_id is not None:
-            if snapshot_id in self.cardpop:
-                cardpop = self.cardpop[snapshot_id]["cardpop"]
-                cpid = self.get_card_cpid(card)
-                if cpid in cardpop:
-                    out = "**{}** ({})".format(
-                        cardpop[cpid]["count"],
-                        cardpop[cpid]["change"])
+            stats = self.cardpop.card_stats(
+                self.get_card_cpid(card), snapshot_id)
+            if stats is not None:
+                out = "**{}** ({})".format(*stats)
         return out
 
     def get_card_cpid(self, card=None):
@@ -699,11 +862,10 @@ class Card:
     def get_deckpop_count(self, deck=None, snapshot_id=None):
         """Return the deck popularity by snapshot id."""
         out = 0
-        snapshot_id = str(snapshot_id)
-        if snapshot_id in self.cardpop:
-            decks = self.cardpop[snapshot_id]["decks"]
-            if deck in decks:
-                out = decks[deck]["count"]
+        if deck is not None:
+            row = self.cardpop.deck_row(deck, snapshot_id)
+            if row is not None:
+                out = int(self.cardpop.deck_count[row])
         return out
 
 
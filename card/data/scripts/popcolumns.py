@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2017 SML
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+"""
+Compile cardpop.json into columnar arrays for the Card cog.
+
+Run after popdata.py. Output is written to ../cardpop_columns:
+
+index.json          snapshot ids and card names (column order)
+card_count.npy      snapshot x card usage
+card_change.npy     snapshot x card change from previous snapshot
+card_present.npy    snapshot x card, False for cards not in snapshot
+deck_snapshot.npy   snapshot row of each deck
+deck_mask.npy       deck x word card bitmask, bit i is card column i
+deck_count.npy      deck usage
+deck_elixir.npy     deck average elixir
+
+Decks are stored grouped by snapshot in the order of cardpop.json.
+"""
+
+import json
+import os
+
+import numpy as np
+
+cardpop_path = '../cardpop.json'
+columns_path = '../cardpop_columns'
+
+
+def load_json(filename=None):
+    with open(filename, encoding='utf-8', mode="r") as f:
+        json_data = json.load(f)
+    return json_data
+
+
+def save_json(filename=None, data=None):
+    with open(filename, encoding='utf-8', mode='w') as f:
+        json.dump(data, f, indent=4, sort_keys=False, separators=(',', ' : '))
+
+
+def compile_columns(cardpop):
+    """Return index and arrays from cardpop data."""
+    snapshots = list(cardpop.keys())
+    cards = sorted(set(
+        card
+        for snapshot in cardpop.values()
+        for card in snapshot["cardpop"].keys()))
+    card_index = {card: i for i, card in enumerate(cards)}
+    words = (len(cards) + 63) // 64
+
+    card_count = np.zeros((len(snapshots), len(cards)), dtype=np.int16)
+    card_change = np.zeros((len(snapshots), len(cards)), dtype=np.int16)
+    card_present = np.zeros((len(snapshots), len(cards)), dtype=np.bool_)
+
+    deck_rows = []
+    for s, snapshot_id in enumerate(snapshots):
+        snapshot = cardpop[snapshot_id]
+        for card, v in snapshot["cardpop"].items():
+            c = card_index[card]
+            card_count[s, c] = v["count"]
+            card_change[s, c] = v["change"]
+            card_present[s, c] = True
+        for deck in snapshot["decks"].values():
+            deck_rows.append((s, deck))
+
+    deck_snapshot = np.zeros(len(deck_rows), dtype=np.int16)
+    deck_mask = np.zeros((len(deck_rows), words), dtype='<u8')
+    deck_count = np.zeros(len(deck_rows), dtype=np.int16)
+    deck_elixir = np.zeros(len(deck_rows), dtype=np.float64)
+    for d, (s, deck) in enumerate(deck_rows):
+        deck_snapshot[d] = s
+        deck_count[d] = deck["count"]
+        deck_elixir[d] = deck["elixir"]
+        for card in deck["deck"]:
+            c = card_index[card]
+            deck_mask[d, c // 64] |= np.uint64(1) << np.uint64(c % 64)
+
+    index = {
+        "snapshots": snapshots,
+        "cards": cards
+    }
+    arrays = {
+        "card_count": card_count,
+        "card_change": card_change,
+        "card_present": card_present,
+        "deck_snapshot": deck_snapshot,
+        "deck_mask": deck_mask,
+        "deck_count": deck_count,
+        "deck_elixir": deck_elixir
+    }
+    return index, arrays
+
+
+def process_data():
+    index, arrays = compile_columns(load_json(cardpop_path))
+
+    if not os.path.exists(columns_path):
+        os.makedirs(columns_path)
+
+    save_json(os.path.join(columns_path, "index.json"), index)
+    for name, array in arrays.items():
+        np.save(os.path.join(columns_path, "{}.npy".format(name)), array)
+
+process_data()
@@ -25,6 +25,7 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import os
+import re
 from collections import defaultdict
 
 import discord
@@ -42,6 +43,38 @@ def nested_dict():
     return defaultdict(nested_dict)
 
 
+def word_pattern(words):
+    """Regex source matching any of words.
+
+    The alternation is built from a prefix trie, so at each position the
+    regex engine follows one branch per character instead of trying
+    every word. Words which start with a shorter word are dropped since the
+    shorter one already matches.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            if node.get("") is True:
+                break
+            node = node.setdefault(char, {})
+        else:
+            node.clear()
+            node[""] = True
+
+    def build(node):
+        if "" in node:
+            return ""
+        alternatives = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:{})".format("|".join(alternatives))
+
+    return build(trie)
+
+
 class ChannelFilter:
     """Channelf filter"""
 
@@ -49,6 +82,8 @@ class ChannelFilter:
         """Init."""
         self.bot = bot
         self.settings = dataIO.load_json(JSON)
+        # compiled filters by channel id, rebuilt when words change
+        self.patterns = {}
 
     def get_server_settings(self, server):
         """Return server settings."""
@@ -71,6 +106,7 @@ class ChannelFilter:
         if word.lower() not in channel_settings:
             channel_settings.append(word)
             dataIO.save_json(JSON, self.settings)
+            self.patterns.pop(channel.id, None)
 
     def remove_word(self, server, channel, word):
         """Remove word from filter."""
@@ -79,8 +115,23 @@ class ChannelFilter:
             return False
         channel_settings.remove(word)
         dataIO.save_json(JSON, self.settings)
+        self.patterns.pop(channel.id, None)
         return True
 
+    def get_channel_pattern(self, server, channel):
+        """Compiled regex matching any filtered word in channel.
+
+        Return None if nothing is filtered. Does not write settings.
+        """
+        if channel.id not in self.patterns:
+            words = self.settings.get(server.id, {}).get(channel.id, [])
+            words = set(w.lower() for w in words if w)
+            pattern = None
+            if words:
+                pattern = re.compile(word_pattern(words))
+            self.patterns[channel.id] = pattern
+        return self.patterns[channel.id]
+
     @checks.mod_or_permissions()
     @commands.group(pass_context=True, aliases=['cf', 'cfilter'])
     async def channelfilter(self, ctx):
@@ -156,16 +207,18 @@ class ChannelFilter:
         if author.server_permissions.manage_messages:
             return
 
-        channel_settings = self.get_channel_settings(server, channel)
-        for word in channel_settings:
-            if word.lower() in message.content.lower():
-                await self.bot.send_message(
-                    channel,
-                    "{} Your message contains words not permitted on this channel. "
-                    "Repeat offenders will be kicked/banned".format(
-                        author.mention
-                    ))
-                await self.bot.delete_message(message)
+        pattern = self.get_channel_pattern(server, channel)
+        if pattern is None:
+            return
+
+        if pattern.search(message.content.lower()):
+            await self.bot.send_message(
+                channel,
+                "{} Your message contains words not permitted on this channel. "
+                "Repeat offenders will be kicked/banned".format(
+                    author.mention
+                ))
+            await self.bot.delete_message(message)
 
 
 def check_folder():
@@ -41,6 +41,8 @@ from cogs.utils.dataIO import dataIO
 from cogs.utils.chat_formatting import pagify
 from discord.ext import commands
 
+from .httpclient import SessionHTTP
+
 PATH = os.path.join("data", "clans")
 JSON = os.path.join(PATH, "settings.json")
 CACHE = os.path.join(PATH, "cache.json")
@@ -66,6 +68,14 @@ class Clans:
         self.badges = dataIO.load_json(BADGES)
         self._auth = None
 
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
+
     @checks.mod_or_permissions()
     @commands.group(pass_context=True)
     async def clansset(self, ctx):
@@ -136,9 +146,7 @@ class Clans:
         headers = {'auth': self.auth}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30) as resp:
-                    data = await resp.json()
+            status, data = await self.http.get_json(url, headers=headers, timeout=30)
         except json.decoder.JSONDecodeError:
             raise
         except asyncio.TimeoutError:
@@ -152,9 +160,7 @@ class Clans:
         headers = {'auth': self.auth}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30) as resp:
-                    data = await resp.json()
+            status, data = await self.http.get_json(url, headers=headers, timeout=30)
         except json.decoder.JSONDecodeError:
             raise
         except asyncio.TimeoutError:
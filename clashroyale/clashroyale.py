@@ -29,19 +29,18 @@ matplotlib.use('Agg')
 
 
 # from .deck import Deck
+from .card import PlotRenderer
+from .card import plot_cardtrend
+from .deck import DeckImage
 from .utils.dataIO import dataIO
 from __main__ import send_cmd_help
 from cogs.utils.chat_formatting import pagify, box
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from discord.ext import commands
 from discord.ext.commands import Context
 from itertools import islice
-from matplotlib import pyplot as plt
-from PIL import Image
-from PIL import ImageDraw
-from PIL import ImageFont
 from random import choice
-import asyncio
 import datetime
 import discord
 import io
@@ -61,6 +60,9 @@ cardpop_range_max = 24
 max_deck_show = 5
 max_deck_per_user = 5
 
+DECK_IMG_PATH = os.path.join("data", "clashroyale", "img")
+DECK_FONT_PATH = os.path.join("data", "clashroyale", "fonts")
+
 discord_ui_bgcolor = discord.Color(value=int('36393e', 16))
 
 help_text = f"""
@@ -138,6 +140,13 @@ class ClashRoyale:
                 if aka.find('-'):
                     self.cards_abbrev[aka.replace('-', '')] = card_key
 
+        self.plot_renderer = PlotRenderer(bot.loop)
+
+        # Used for Pillow blocking code
+        self.threadex = ThreadPoolExecutor(max_workers=2)
+        self.deck_image = DeckImage(
+            DECK_IMG_PATH, DECK_FONT_PATH, default_name="ClashRoyale")
+
         self.card_w = 302
         self.card_h = 363
         self.card_ratio = self.card_w / self.card_h
@@ -145,12 +154,13 @@ class ClashRoyale:
         self.card_thumb_w = int(self.card_w * self.card_thumb_scale)
         self.card_thumb_h = int(self.card_h * self.card_thumb_scale)
 
-        self.plotfigure = 0
-        self.plot_lock = asyncio.Lock()
-
         # deck validation hack
         self.deck_is_valid = False
 
+    def __unload(self):
+        self.plot_renderer.shutdown()
+        self.threadex.shutdown(wait=False)
+
     def grouper(self, n, iterable, fillvalue=None):
         """Helper function to split lists.
 
@@ -684,36 +694,7 @@ class ClashRoyale:
                 validated_cards.append(card)
 
         if len(validated_cards) == len(cards):
-
-            facecolor = '#32363b'
-            edgecolor = '#eeeeee'
-            spinecolor = '#999999'
-            footercolor = '#999999'
-            labelcolor = '#cccccc'
-            tickcolor = '#999999'
-            titlecolor = '#ffffff'
-
-            fig = plt.figure(
-                num=1,
-                figsize=(8, 6),
-                dpi=192,
-                facecolor=facecolor,
-                edgecolor=edgecolor)
-            plt.grid(b=True, alpha=0.3)
-
-            ax = fig.add_subplot(111)
-
-            ax.set_title('Clash Royale Card Trends', color=titlecolor)
-            ax.set_xlabel('Snapshots')
-            ax.set_ylabel('Usage')
-
-            for spine in ax.spines.values():
-                spine.set_edgecolor(spinecolor)
-
-            ax.xaxis.label.set_color(labelcolor)
-            ax.yaxis.label.set_color(labelcolor)
-            ax.tick_params(axis='x', colors=tickcolor)
-            ax.tick_params(axis='y', colors=tickcolor)
+            await self.bot.type()
 
             # create labels using snapshot dates
             labels = []
@@ -724,59 +705,26 @@ class ClashRoyale:
                 labels.append("{}\n   {}".format(id, dtstr))
 
             # process plot only when all the cards are valid
-            for card in validated_cards:
-
-                x = range(cardpop_range_min, cardpop_range_max)
-                y = [int(self.get_cardpop_count(card, id)) for id in x]
-                ax.plot(x, y, 'o-', label=self.card_to_str(card))
-                plt.xticks(x, labels, rotation=70, fontsize=8, ha='right')
-
-            # make tick label font size smaller
-            # for tick in ax.xaxis.get_major_ticks():
-            #     tick.label.set_fontsize(8)
-
-            leg = ax.legend(facecolor=facecolor, edgecolor=spinecolor)
-            for text in leg.get_texts():
-                text.set_color(labelcolor)
+            x = tuple(range(cardpop_range_min, cardpop_range_max))
+            series = []
+            for card in sorted(validated_cards):
+                y = tuple(int(self.get_cardpop_count(card, id)) for id in x)
+                series.append((self.card_to_str(card), y))
 
-            ax.annotate(
-                'Compiled with data from Woody’s popularity snapshots',
-
-                # The point that we'll place the text in relation to
-                xy=(0, 0),
-                # Interpret the x as axes coords, and the y as figure
-                # coords
-                xycoords=('figure fraction'),
-
-                # The distance from the point that the text will be at
-                xytext=(15, 10),
-                # Interpret `xytext` as an offset in points...
-                textcoords='offset points',
-
-                # Any other text parameters we'd like
-                size=8, ha='left', va='bottom', color=footercolor)
-
-            plt.subplots_adjust(left=0.1, right=0.96, top=0.9, bottom=0.2)
+            png = await self.plot_renderer.render(
+                plot_cardtrend, x, tuple(labels), tuple(series))
 
             plot_filename = "{}-plot.png".format("-".join(cards))
             # plot_name = "Card Trends: {}".format(
             #     ", ".join([self.card_to_str(c) for c in validated_cards]))
             plot_name = ""
 
-            with io.BytesIO() as f:
-                plt.savefig(f, format="png", facecolor=facecolor,
-                            edgecolor=edgecolor, transparent=True)
-                f.seek(0)
+            with io.BytesIO(png) as f:
                 await ctx.bot.send_file(
                     ctx.message.channel, f,
                     filename=plot_filename,
                     content=plot_name)
 
-            fig.clf()
-
-        plt.clf()
-        plt.cla()
-
     @commands.command(pass_context=True)
     async def popdata(self, ctx: Context,
         snapshot_id=str(cardpop_range_max - 1), limit=10):
@@ -966,8 +914,16 @@ class ClashRoyale:
 
     async def upload_deck_image(self, ctx, deck, deck_name, author):
         """Upload deck image to the server."""
+        deck_author_name = author.name if author else ""
+        average_elixir = self.get_average_elixir(deck)
 
-        deck_image = self.get_deck_image(deck, deck_name, author)
+        png = self.deck_image.get_cached(
+            deck, deck_name, deck_author_name, average_elixir)
+        if png is None:
+            png = await self.bot.loop.run_in_executor(
+                self.threadex,
+                self.deck_image.render,
+                deck, deck_name, deck_author_name, average_elixir)
 
         # construct a filename using first three letters of each card
         filename = "deck-{}.png".format("-".join([card[:3] for card in deck]))
@@ -978,97 +934,17 @@ class ClashRoyale:
         # description = "ClashRoyale: {}".format(', '.join(card_names))
         description = ""
 
-        with io.BytesIO() as f:
-            deck_image.save(f, "PNG")
-            f.seek(0)
+        with io.BytesIO(png) as f:
             await ctx.bot.send_file(ctx.message.channel, f,
                 filename=filename, content=description)
 
-    def get_deck_image(self, deck, deck_name=None, deck_author=None):
-        """Construct the deck with Pillow and return image."""
-
-        card_w = 302
-        card_h = 363
-        card_x = 30
-        card_y = 30
-        font_size = 50
-        txt_y_line1 = 430
-        txt_y_line2 = 500
-        txt_x_name = 50
-        txt_x_cards = 503
-        txt_x_elixir = 1872
-
-        bg_image = Image.open("data/clashroyale/img/deck-bg-b.png")
-        size = bg_image.size
-
-        font_file_regular = "data/clashroyale/fonts/OpenSans-Regular.ttf"
-        font_file_bold = "data/clashroyale/fonts/OpenSans-Bold.ttf"
-
-        image = Image.new("RGBA", size)
-        image.paste(bg_image)
-
-        if not deck_name:
-            deck_name = "ClashRoyale"
-
-        # cards
-        for i, card in enumerate(deck):
-            card_image_file = "data/clashroyale/img/cards/{}.png".format(card)
-            card_image = Image.open(card_image_file)
-            # size = (card_w, card_h)
-            # card_image.thumbnail(size)
-            box = (card_x + card_w * i,
-                   card_y,
-                   card_x + card_w * (i+1),
-                   card_h + card_y)
-            image.paste(card_image, box, card_image)
-
-        # elixir
+    def get_average_elixir(self, deck):
+        """Average elixir of deck as string."""
         total_elixir = 0
         for card_key, card_value in self.crdata["Cards"].items():
             if card_key in deck:
                 total_elixir += card_value["elixir"]
-        average_elixir = "{:.3f}".format(total_elixir / 8)
-
-        # text
-        # Take out hyphnens and capitlize the name of each card
-        card_names = [string.capwords(c.replace('-', ' ')) for c in deck]
-
-        txt = Image.new("RGBA", size)
-        txt_name = Image.new("RGBA", (txt_x_cards-30, size[1]))
-        font_regular = ImageFont.truetype(font_file_regular, size=font_size)
-        font_bold = ImageFont.truetype(font_file_bold, size=font_size)
-
-        d = ImageDraw.Draw(txt)
-        d_name = ImageDraw.Draw(txt_name)
-
-        line1 = ', '.join(card_names[:4])
-        line2 = ', '.join(card_names[4:])
-        # card_text = '\n'.join([line0, line1])
-
-        deck_author_name = deck_author.name if deck_author else ""
-
-        d_name.text((txt_x_name, txt_y_line1), deck_name, font=font_bold,
-                         fill=(0xff, 0xff, 0xff, 255))
-        d_name.text((txt_x_name, txt_y_line2), deck_author_name, font=font_regular,
-                         fill=(0xff, 0xff, 0xff, 255))
-        d.text((txt_x_cards, txt_y_line1), line1, font=font_regular,
-                         fill=(0xff, 0xff, 0xff, 255))
-        d.text((txt_x_cards, txt_y_line2), line2, font=font_regular,
-                         fill=(0xff, 0xff, 0xff, 255))
-        d.text((txt_x_elixir, txt_y_line1), "Avg elixir", font=font_bold,
-               fill=(0xff, 0xff, 0xff, 200))
-        d.text((txt_x_elixir, txt_y_line2), average_elixir, font=font_bold,
-               fill=(0xff, 0xff, 0xff, 255))
-
-        image.paste(txt, (0,0), txt)
-        image.paste(txt_name, (0,0), txt_name)
-
-        # scale down and return
-        scale = 0.5
-        scaled_size = tuple([x * scale for x in image.size])
-        image.thumbnail(scaled_size)
-
-        return image
+        return "{:.3f}".format(total_elixir / 8)
 
 
     def normalize_deck_data(self, deck):
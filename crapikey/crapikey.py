@@ -24,6 +24,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
+import asyncio
 import datetime as dt
 import json
 import os
@@ -40,6 +41,8 @@ from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 import statistics
 
+from .httpclient import SessionHTTP
+
 PATH = os.path.join("data", "crapikey")
 JSON = os.path.join(PATH, "settings.json")
 YAML = os.path.join(PATH, "config.yaml")
@@ -98,6 +101,14 @@ class CRAPIKey:
         self.settings = Box(dataIO.load_json(JSON))
         self._config = None
 
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
+
     @property
     def config(self):
         if self._config is None:
@@ -158,13 +169,13 @@ class CRAPIKey:
         """Request json from url."""
         data = None
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    data = await resp.json()
-                    if resp.status != 200:
-                        raise ServerError(data)
+            status, data = await self.http.get_json(url)
+            if status != 200:
+                raise ServerError(data)
         except aiohttp.ClientError:
             raise ServerError(data)
+        except asyncio.TimeoutError:
+            raise ServerError(data)
         except json.JSONDecodeError:
             raise ServerError(data)
         return data
@@ -43,6 +43,9 @@ from cogs.utils.chat_formatting import inline, pagify, box
 from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 
+from .crprofile import PlayerTagIndex
+from .httpclient import SessionHTTP
+
 PATH = os.path.join("data", "crclan")
 PATH_CLANS = os.path.join(PATH, "clans")
 JSON = os.path.join(PATH, "settings.json")
@@ -52,6 +55,9 @@ DATA_UPDATE_INTERVAL = timedelta(minutes=10).seconds
 
 API_FETCH_TIMEOUT = 15
 
+# max number of clans fetched concurrently in update_data
+DATA_UPDATE_CONCURRENCY = 8
+
 BOT_COMMANDER_ROLES = ["Bot Commander"]
 
 CREDITS = 'Selfish + SML'
@@ -510,6 +516,17 @@ class ClanManager:
         self.settings = nested_dict()
         self.settings.update(dataIO.load_json(filepath))
         self.bot = bot
+        # tag: (seconds, loaded) of last fetch in update_data
+        self.fetch_timings = {}
+        self.tag_index = PlayerTagIndex()
+
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
 
     def init_server(self, server):
         """Initialized server settings.
@@ -517,6 +534,7 @@ class ClanManager:
         This will wipe all clan data and player data.
         """
         self.settings["servers"][server.id] = ServerModel.DEFAULTS
+        self.tag_index.reset(server.id)
         self.save()
 
     def init_clans(self, server):
@@ -590,6 +608,7 @@ class ClanManager:
         if "players" not in self.settings["servers"][server.id]:
             self.settings["servers"][server.id]["players"] = {}
         players = self.settings["servers"][server.id]["players"]
+        self.tag_index.update(server.id, member.id, players.get(member.id), tag)
         players[member.id] = tag
         self.settings["servers"][server.id]["players"] = players
         self.save()
@@ -666,12 +685,12 @@ class ClanManager:
         """Return Discord member from player tag."""
         try:
             players = self.settings["servers"][server.id]["players"]
-            for member_id, player_tag in players.items():
-                if player_tag == tag:
-                    return server.get_member(member_id)
         except KeyError:
-            pass
-        return None
+            return None
+        member_id = self.tag_index.member_id(server.id, players, tag)
+        if member_id is None:
+            return None
+        return server.get_member(member_id)
 
     async def get_clan_data(self, server, key=None, tag=None) -> CRClanModel:
         """Return data as CRClanData by key or tag
@@ -723,9 +742,7 @@ class ClanManager:
         url = "{}{}".format(self.clan_api_url, tag)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=API_FETCH_TIMEOUT) as resp:
-                    data = await resp.json()
+            status, data = await self.http.get_json(url, timeout=API_FETCH_TIMEOUT)
         except json.decoder.JSONDecodeError:
             return False
         except asyncio.TimeoutError:
@@ -733,7 +750,7 @@ class ClanManager:
             return False
 
         filepath = self.cached_filepath(tag)
-        dataIO.save_json(filepath, data)
+        await self.bot.loop.run_in_executor(None, dataIO.save_json, filepath, data)
 
         is_cache = False
         timestamp = dt.datetime.utcnow()
@@ -756,40 +773,44 @@ class ClanManager:
         return os.path.join(PATH_CLANS, '{}.json'.format(tag))
 
     async def update_data(self):
-        """Update all data and save to disk."""
-        dataset = []
+        """Update all data and save to disk.
+
+        Clans are fetched concurrently, up to data_update_concurrency
+        at a time. Tags shared across servers are only fetched once.
+        """
+        tags = []
         for server_id in self.settings["servers"]:
             clans = self.settings["servers"][server_id]["clans"]
             for tag in clans.keys():
-                data = await self.update_clan_data(tag)
-                if not data:
-                    data = self.cached_clan_data(tag)
-                if data is None:
-                    data = CRClanModel(loaded=False, tag=tag)
-                dataset.append(data)
-        return dataset
+                if tag not in tags:
+                    tags.append(tag)
+
+        semaphore = asyncio.Semaphore(self.data_update_concurrency)
+
+        async def update(tag):
+            async with semaphore:
+                start = dt.datetime.utcnow()
+                try:
+                    data = await self.update_clan_data(tag)
+                except Exception:
+                    data = False
+                elapsed = (dt.datetime.utcnow() - start).total_seconds()
+                self.fetch_timings[tag] = (elapsed, bool(data))
+            if not data:
+                data = self.cached_clan_data(tag)
+            if data is None:
+                data = CRClanModel(loaded=False, tag=tag)
+            return data
+
+        dataset = await asyncio.gather(*[update(tag) for tag in tags])
+        return list(dataset)
 
     def member2tag(self, server, member):
         """Return player tag from member."""
         try:
-            players = self.settings["servers"][server.id]["players"]
-            for member_id, player_tag in players.items():
-                if member_id == member.id:
-                    return player_tag
-        except KeyError:
-            pass
-        return None
-
-    def tag2member(self, server, tag):
-        """Return Discord member by player tag."""
-        try:
-            players = self.settings["servers"][server.id]["players"]
-            for member_id, player_tag in players.items():
-                if player_tag == tag:
-                    return server.get_member(member_id)
+            return self.settings["servers"][server.id]["players"].get(member.id)
         except KeyError:
-            pass
-        return None
+            return None
 
     @property
     def clan_api_url(self):
@@ -807,6 +828,17 @@ class ClanManager:
         self.settings["data_update_interval"] = int(value)
         self.save()
 
+    @property
+    def data_update_concurrency(self):
+        concurrency = self.settings.get("data_update_concurrency", DATA_UPDATE_CONCURRENCY)
+        return int(concurrency)
+
+    @data_update_concurrency.setter
+    def data_update_concurrency(self, value):
+        """Set max number of clans fetched concurrently."""
+        self.settings["data_update_concurrency"] = max(1, int(value))
+        self.save()
+
     @property
     def es_enabled(self):
         """Enable Elastic Search."""
@@ -1035,6 +1067,25 @@ class CRClan:
         self.manager.data_update_interval = seconds
         await self.bot.say("Data update interval updated.")
 
+    @crclanset.command(name="dataupdateconcurrency", pass_context=True)
+    async def crclanset_dataupdateconcurrency(self, ctx, count):
+        """Max number of clans fetched concurrently during data update."""
+        self.manager.data_update_concurrency = count
+        await self.bot.say("Data update concurrency updated.")
+
+    @crclanset.command(name="timings", pass_context=True)
+    async def crclanset_timings(self, ctx):
+        """Show fetch timings of the last data update, slowest first."""
+        timings = self.manager.fetch_timings
+        if not timings:
+            await self.bot.say("No data update has run yet.")
+            return
+        out = ['{:<12} {:>8} {}'.format("Tag", "Seconds", "Status")]
+        for tag, (elapsed, loaded) in sorted(timings.items(), key=lambda x: -x[1][0]):
+            out.append('{:<12} {:>8.2f} {}'.format(tag, elapsed, "OK" if loaded else "Failed"))
+        for page in pagify('\n'.join(out)):
+            await self.bot.say(box(page))
+
     @crclanset.command(name="update", pass_context=True)
     async def crclanset_update(self, ctx):
         """Update data from api."""
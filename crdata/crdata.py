@@ -30,6 +30,7 @@ import json
 import os
 import re
 import string
+from collections import defaultdict
 from collections import namedtuple
 from datetime import timedelta
 
@@ -54,7 +55,7 @@ try:
     HOST = 'localhost'
     PORT = 9200
     from elasticsearch import Elasticsearch
-    from elasticsearch_dsl import DocType, Date, Integer, Text
+    from elasticsearch.helpers import bulk
     from elasticsearch_dsl.connections import connections
 
     connections.create_connection(hosts=[HOST], timeout=20)
@@ -66,7 +67,9 @@ PATH = os.path.join("data", "crdata")
 SETTINGS_JSON = os.path.join(PATH, "settings.json")
 CLASHROYALE_JSON = os.path.join(PATH, "clashroyale.json")
 CARDPOP_FILE = "cardpop-%Y-%m-%d-%H.json"
+CARDPOP_FILE_P = re.compile('cardpop-\d{4}-\d{2}-\d{2}-\d{2}.json')
 SF_CREDITS = "Data provided by <http://starfi.re>"
+NO_DATA_MSG = "No data available."
 
 DATA_UPDATE_INTERVAL = timedelta(minutes=5).seconds
 
@@ -136,32 +139,6 @@ class BarChart:
         return out
 
 
-class BotEmoji:
-    """Emojis available in bot."""
-    def __init__(self, bot):
-        self.bot = bot
-
-    def name(self, name):
-        """Emoji by name."""
-        for server in self.bot.servers:
-            for emoji in server.emojis:
-                if emoji.name == name:
-                    return '<:{}:{}>'.format(emoji.name, emoji.id)
-        return ''
-
-    def key(self, key):
-        """Chest emojis by api key name or key.
-
-        name is used by this cog.
-        key is values returned by the api.
-        Use key only if name is not set
-        """
-        if key in self.map:
-            name = self.map[key]
-            return self.name(name)
-        return ''
-
-
 class ClashRoyale:
     """Clash Royale Data."""
     instance = None
@@ -208,7 +185,7 @@ class Card():
         """Elixir value."""
         return ClashRoyale().card_elixir(self.key)
 
-    def emoji(self, be: BotEmoji):
+    def emoji(self, be):
         """Emoji representation of the card."""
         if self.key is None:
             return ''
@@ -248,7 +225,7 @@ class Deck():
         """Average elixir with format."""
         return 'Average Elixir: {:.3}'.format(self.avg_elixir)
 
-    def emoji_repr(self, be: BotEmoji, show_levels=False):
+    def emoji_repr(self, be, show_levels=False):
         """Emoji representaion."""
         out = []
         for card in self.cards:
@@ -264,6 +241,93 @@ class Deck():
         return ' '.join([c.key for c in self.cards])
 
 
+class DeckIndex:
+    """Index of the Global 200 decks in a data snapshot.
+
+    Identical decks are merged into one entry, stored in order of
+    their best rank. Each entry has:
+    + deck: list of card dicts sorted by key
+    + sfids: frozenset of Starfire IDs
+    + ids: frozenset of card IDs
+    + elixir: average elixir
+    + ranks: list of ranks (1-based) where the deck appears
+
+    A posting list maps each sfid to the entries containing it.
+    """
+
+    def __init__(self, data, sfid_to_id, deck_elixir):
+        """Init.
+
+        Params
+        + data: snapshot JSON.
+        + sfid_to_id: function converting Starfire ID to card ID.
+        + deck_elixir: function returning average elixir of a list of sfids.
+        """
+        self.entries = []
+        # entry by rank - 1, None for empty rows
+        self.ranks = []
+        self.postings = defaultdict(set)
+
+        entry_by_sfids = {}
+        for rank, deck in enumerate(data.get("decks", []), 1):
+            # in unknown instances, starfi.re returns empty rows
+            if deck is None:
+                self.ranks.append(None)
+                continue
+
+            # when data is not clean, "key" may be missing
+            clean_deck = []
+            for card in deck:
+                if "key" not in card:
+                    card = dict(card, key="soon", level=13)
+                clean_deck.append(card)
+            clean_deck = sorted(clean_deck, key=lambda x: x["key"])
+            sfids = frozenset(card["key"] for card in clean_deck)
+
+            entry = entry_by_sfids.get(sfids)
+            if entry is None:
+                sfid_list = [card["key"] for card in clean_deck]
+                entry = {
+                    "deck": clean_deck,
+                    "sfids": sfids,
+                    "ids": frozenset(sfid_to_id(sfid) for sfid in sfid_list),
+                    "elixir": deck_elixir(sfid_list),
+                    "ranks": []
+                }
+                entry_by_sfids[sfids] = entry
+                for sfid in sfids:
+                    self.postings[sfid].add(len(self.entries))
+                self.entries.append(entry)
+            entry["ranks"].append(rank)
+            self.ranks.append(entry)
+
+    def search(self, include_sfids, exclude_sfids, elixir_min=0, elixir_max=10):
+        """Return entries with all included cards and no excluded cards."""
+        if include_sfids:
+            postings = [self.postings.get(sfid, set()) for sfid in include_sfids]
+            candidates = set.intersection(*postings)
+        else:
+            candidates = set(range(len(self.entries)))
+        for sfid in exclude_sfids:
+            candidates -= self.postings.get(sfid, set())
+        return [
+            self.entries[i] for i in sorted(candidates)
+            if elixir_min <= self.entries[i]["elixir"] <= elixir_max]
+
+    def similar(self, ids):
+        """Return (entry, similarity) sorted by Jaccard similarity of card IDs.
+
+        The deck itself (similarity 1) is excluded.
+        """
+        ids = set(ids)
+        results = []
+        for entry in self.entries:
+            similarity = jaccard_similarity(ids, entry["ids"])
+            if similarity != 1.0:
+                results.append((entry, similarity))
+        return sorted(results, key=lambda x: -x[1])
+
+
 class CRData:
     """Clash Royale Global 200 Decks."""
 
@@ -274,6 +338,12 @@ class CRData:
         self.settings = dataIO.load_json(SETTINGS_JSON)
         self.clashroyale = dataIO.load_json(CLASHROYALE_JSON)
 
+        # newest valid snapshot, kept in memory
+        self.last_data_path = None
+        self.last_data = None
+        self._deck_index = None
+        self.scan_data()
+
         if elasticsearch_available:
             self.es = Elasticsearch()
 
@@ -359,14 +429,10 @@ class CRData:
     @crdataset.command(name="lastdata", pass_context=True)
     async def crdataset_lastdata(self, ctx):
         """Return last known data filename."""
-        time = dt.datetime.utcnow()
-        file = time.strftime(CARDPOP_FILE)
-        path = os.path.join(PATH, file)
-        while not os.path.exists(path):
-            time = time - dt.timedelta(hours=1)
-            file = time.strftime(CARDPOP_FILE)
-            path = os.path.join(PATH, file)
-        await self.bot.say("Last known data path: {}".format(path))
+        if self.last_data_path is None:
+            await self.bot.say("No data found.")
+            return
+        await self.bot.say("Last known data path: {}".format(self.last_data_path))
 
     @crdataset.command(name="cleandata", pass_context=True)
     async def crdataset_cleandata(self, ctx):
@@ -376,10 +442,9 @@ class CRData:
         Some files were saved when no data can be found.
         This command removes all data json files that are invalid.
         """
-        prog = re.compile('cardpop-\d{4}-\d{2}-\d{2}-\d{2}.json')
         for root, dirs, files in os.walk(PATH):
             for file in files:
-                result = prog.match(file)
+                result = CARDPOP_FILE_P.match(file)
                 if result is not None:
                     path = os.path.join(PATH, file)
                     data = dataIO.load_json(path)
@@ -431,12 +496,52 @@ class CRData:
                         data = None
         if data is not None:
             dataIO.save_json(now_path, data)
+            if "decks" in data:
+                self.set_last_data(now_path, data)
 
             if self.elasticsearch_enabled:
-                self.eslog(data)
+                await self.eslog(data)
 
         return data
 
+    def create_deck_index(self, data):
+        """Create DeckIndex from snapshot data."""
+        return DeckIndex(data, self.sfid_to_id, self.deck_elixir_by_sfid)
+
+    @property
+    def deck_index(self):
+        """DeckIndex of last known data. Built on first use.
+
+        Return None if there is no data.
+        """
+        if self._deck_index is None and self.last_data is not None:
+            self._deck_index = self.create_deck_index(self.last_data)
+        return self._deck_index
+
+    def set_last_data(self, path, data):
+        """Set newest valid snapshot."""
+        self.last_data_path = path
+        self.last_data = data
+        self._deck_index = None
+
+    def scan_data(self):
+        """Find newest valid snapshot in the data folder.
+
+        Snapshot filenames sort chronologically, so files are checked
+        from newest to oldest until one contains decks.
+        """
+        if not os.path.exists(PATH):
+            return
+        files = sorted(
+            (f for f in os.listdir(PATH) if CARDPOP_FILE_P.match(f)),
+            reverse=True)
+        for file in files:
+            path = os.path.join(PATH, file)
+            data = dataIO.load_json(path)
+            if "decks" in data:
+                self.set_last_data(path, data)
+                return
+
     async def get_now_data(self):
         """Return data at this hour."""
         now = dt.datetime.utcnow()
@@ -446,13 +551,8 @@ class CRData:
         return data
 
     def get_last_data(self):
-        """Find and return last known data."""
-        time = dt.datetime.utcnow()
-        data = None
-        while data is None:
-            data = self.get_data(time)
-            time = time - dt.timedelta(hours=1)
-        return data
+        """Return last known data, or None if there is none."""
+        return self.last_data
 
     def get_data(self, datetime_):
         """Get data as json by date and hour."""
@@ -475,6 +575,9 @@ class CRData:
     async def crdata_decks(self, ctx: Context):
         """List popular decks."""
         data = self.get_last_data()
+        if data is None:
+            await self.bot.say(NO_DATA_MSG)
+            return
         decks = data["popularDecks"]
         await self.bot.say(
             "**Top 200 Decks**: Found {} results.".format(len(decks)))
@@ -502,6 +605,9 @@ class CRData:
         """List popular cards."""
         await self.bot.send_typing(ctx.message.channel)
         data = self.get_last_data()
+        if data is None:
+            await self.bot.say(NO_DATA_MSG)
+            return
         cards = data["popularCards"]
         await self.bot.say(
             "**Popular Cards** from Top 200 decks.")
@@ -517,6 +623,9 @@ class CRData:
         """List decks sorted by rank."""
         await self.bot.say("**Global 200 Leaderboard Decks**")
         data = self.get_last_data()
+        if data is None:
+            await self.bot.say(NO_DATA_MSG)
+            return
         decks = data["decks"]
         for i, deck in enumerate(decks):
             cards = [self.sfid_to_id(card["key"]) for card in deck]
@@ -620,68 +729,21 @@ class CRData:
         exclude_cards = self.normalize_deck_data(exclude_cards)
         exclude_sfids = [self.id_to_sfid(c) for c in exclude_cards]
 
-        data = self.get_last_data()
-        decks = data["decks"]
-
-        # sort card in decks
-        sorted_decks = []
-        for deck in decks:
-            # when data is not clean, "key" may be missing
-            # if this is the case, fix it
-            clean_deck = []
-
-            # data not clean = deck is None
-            if deck is not None:
-                for card in deck.copy():
-                    if not "key" in card:
-                        card["key"] = "soon"
-                        card["level"] = 13
-                    clean_deck.append(card)
-                deck = clean_deck
-
-                # for unknown reasons deck could sometimes be None in data src
-                if deck is not None:
-                    sorted_decks.append(
-                        sorted(
-                            deck.copy(),
-                            key=lambda x: x["key"]))
-        decks = sorted_decks
+        if self.deck_index is None:
+            await self.bot.say(NO_DATA_MSG)
+            return []
 
         found_decks = []
-        unique_decks = []
-
-        # debug: to show uniques or not
-        unique_only = False
-
-        for rank, deck in enumerate(decks):
-            # in unknown instances, starfi.re returns empty rows
-            if deck is not None:
-                deck_cards = [card["key"] for card in deck]
-                deck_elixir = self.deck_elixir_by_sfid(deck_cards)
-                if set(include_sfids) <= set(deck_cards):
-                    include_deck = True
-                    if len(exclude_sfids):
-                        for sfid in exclude_sfids:
-                            if sfid in deck_cards:
-                                include_deck = False
-                                break
-                    if not elixir_min <= deck_elixir <= elixir_max:
-                        include_deck = False
-                    if include_deck:
-                        found_deck = {
-                            "deck": deck,
-                            "cards": set([c["key"] for c in deck]),
-                            "count": 1,
-                            "ranks": [str(rank + 1)]
-                        }
-                        if found_deck["cards"] in unique_decks:
-                            found_deck["count"] += 1
-                            found_deck["ranks"].append(str(rank + 1))
-                            if not unique_only:
-                                unique_decks.append(found_deck["cards"])
-                        else:
-                            found_decks.append(found_deck)
-                            unique_decks.append(found_deck["cards"])
+        entries = self.deck_index.search(
+            include_sfids, exclude_sfids,
+            elixir_min=elixir_min, elixir_max=elixir_max)
+        for entry in entries:
+            found_decks.append({
+                "deck": entry["deck"],
+                "cards": set(entry["sfids"]),
+                "count": len(entry["ranks"]),
+                "ranks": [str(rank) for rank in entry["ranks"]]
+            })
 
         return found_decks
 
@@ -732,22 +794,19 @@ class CRData:
             await send_cmd_help(ctx)
             return
 
-        data = self.get_last_data()
-        decks = data["decks"]
-
-        # sort card in decks
-        # extract card keys as list
-        sorted_decks = []
-        for deck in decks:
-            d = sorted(deck.copy(), key=lambda x: x["key"])
-            d = [self.sfid_to_id(card["key"]) for card in d]
-            sorted_decks.append(d)
-        decks = sorted_decks
+        index = self.deck_index
+        if index is None:
+            await self.bot.say(NO_DATA_MSG)
+            return
 
         if is_rank:
             deck_name = "Rank {}".format(cards[0])
             deck_author = "Top 200 Decks"
-            deck = decks[int(cards[0]) - 1]
+            rank = int(cards[0])
+            if not 1 <= rank <= len(index.ranks) or index.ranks[rank - 1] is None:
+                await self.bot.say("No deck found at rank {}.".format(rank))
+                return
+            deck = [self.sfid_to_id(card["key"]) for card in index.ranks[rank - 1]["deck"]]
         else:
             deck_name = "User Deck"
             deck_author = "Similarity Search"
@@ -765,25 +824,13 @@ class CRData:
             deck_name=deck_name,
             author=deck_author)
 
-        # Similarity search
+        # Similarity search, same deck (similarity = 1) is excluded
         results = []
-        uniques = []
-        for candidate in decks:
-            similarity = jaccard_similarity(deck, candidate)
-            if similarity != 1.0:
-                result = {
-                    "deck": candidate,
-                    "similarity": similarity
-                }
-                if candidate not in uniques:
-                    uniques.append(candidate)
-                    results.append(result)
-
-        # Sort by similarity
-        results = sorted(results, key=lambda x: -x["similarity"])
-
-        # Remove same deck (similarity = 1)
-        results = [r for r in results if r["similarity"] != 1.0]
+        for entry, similarity in index.similar(deck):
+            results.append({
+                "deck": [self.sfid_to_id(card["key"]) for card in entry["deck"]],
+                "similarity": similarity
+            })
 
         # Output
 
@@ -905,7 +952,7 @@ class CRData:
         """Return average elixir for a list of sfids."""
         cards_data = self.clashroyale["Cards"]
         cards = [self.sfid_to_id(c) for c in deck]
-        elixirs = [cards_data[key]["elixir"] for key in cards]
+        elixirs = [cards_data.get(key, {}).get("elixir", 0) for key in cards]
         # count 1 less card if mirror
         total = 0
         for elixir in elixirs:
@@ -931,74 +978,51 @@ class CRData:
                     data = None
         if data is not None:
             if self.elasticsearch_enabled:
-                self.eslog(data)
+                await self.eslog(data)
+
+    async def eslog(self, data):
+        """Elasticsearch logging of data.
 
-    def eslog(self, data):
-        """Elasticsearch logging of data"""
+        All documents are sent in one bulk request in an executor.
+        """
+        actions = self.eslog_actions(data)
+        await self.bot.loop.run_in_executor(None, bulk, self.es, actions)
+
+    def eslog_actions(self, data):
+        """Bulk API actions for leaderboard, popular cards and decks."""
 
         now = dt.datetime.utcnow()
         now_str = now.strftime('%Y.%m.%d')
         index_name = 'crdata-{}'.format(now_str)
 
+        def action(doc_type, **source):
+            source["timestamp"] = now
+            return {
+                "_index": index_name,
+                "_type": doc_type,
+                "_source": source
+            }
 
-        class PopularCard(DocType):
-            """ESLog Popular Card"""
-            key = Text()
-            usage = Integer()
-            timestamp = Date()
-
-            def save(self, **kwargs):
-                return super(PopularCard, self).save(**kwargs)
-
-        class PopularDeck(DocType):
-            """ESLog Popular Deck"""
-            deck_name = Text()
-            usage = Integer()
-            timestamp = Date()
-            deck_cards = []
-
-            def save(self, **kwargs):
-                return super(PopularDeck, self).save(**kwargs)
-
-        class Leaderboard(DocType):
-            """ESLog Leaderboard"""
-            rank = Integer()
-            deck = []
-            timestamp = Date()
-
-            def save(self, **kwargs):
-                return super(Leaderboard, self).save(**kwargs)
+        actions = []
 
         # leaderboard
         for rank, deck in enumerate(data["decks"], 1):
-            lb = Leaderboard(
-                rank=rank,
-                deck=deck,
-                timestamp=dt.datetime.utcnow()
-            )
-            lb.save(index=index_name)
+            actions.append(action("leaderboard", rank=rank, deck=deck))
 
         # cards
         for card in data["popularCards"]:
-            pcard = PopularCard(
-                key=card["key"],
-                usage=card["usage"],
-                timestamp=dt.datetime.utcnow()
-            )
-            pcard.save(index=index_name)
+            actions.append(action(
+                "popular_card", key=card["key"], usage=card["usage"]))
 
         # decks
         for deck in data["popularDecks"]:
-            now = dt.datetime.utcnow()
-            now_str = now.strftime('%Y.%m.%d')
-            index_name = 'crdata-{}'.format(now_str)
-            pdeck = PopularDeck(
+            actions.append(action(
+                "popular_deck",
                 deck_name=deck["key"],
                 deck_cards=deck["key"].split('|'),
-                usage=deck["usage"],
-                timestamp=dt.datetime.utcnow()
-            )
-            pdeck.save(index=index_name)
+                usage=deck["usage"]))
+
+        return actions
 
 
 def check_folder():
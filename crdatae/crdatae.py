@@ -56,13 +56,26 @@ class BotEmoji:
     def __init__(self, bot):
         self.bot = bot
 
+    def get(self, name):
+        """Emoji object by name or None.
+
+        Looked up from the shared EmojiIndex cog. If it is not loaded,
+        scan the bot emojis.
+        """
+        index = self.bot.get_cog("EmojiIndex")
+        if index is not None:
+            return index.emojis.get(name)
+        for emoji in self.bot.get_all_emojis():
+            if emoji.name == name:
+                return emoji
+        return None
+
     def name(self, name):
         """Emoji by name."""
-        for server in self.bot.servers:
-            for emoji in server.emojis:
-                if emoji.name == name:
-                    return '<:{}:{}>'.format(emoji.name, emoji.id)
-        return ''
+        emoji = self.get(name)
+        if emoji is None:
+            return ''
+        return '<:{}:{}>'.format(emoji.name, emoji.id)
 
     def key(self, key):
         """Chest emojis by api key name or key.
@@ -213,6 +226,9 @@ class CRDataEnhanced:
             return
 
         data = crdata.get_last_data()
+        if data is None:
+            await self.bot.say("No data available.")
+            return
         # decks = data["decks"]
 
         decks = []
@@ -22,10 +22,15 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
+import asyncio
 import datetime as dt
 import itertools
+import json
+import logging
 import math
 import os
+from bisect import bisect_left
+from bisect import insort
 from random import choice
 
 import aiohttp
@@ -38,6 +43,8 @@ from discord.ext import commands
 from trueskill import Rating
 from trueskill import TrueSkill, rate_1vs1, quality_1vs1
 
+from .httpclient import SessionHTTP
+
 PATH = os.path.join("data", "crladder")
 JSON = os.path.join(PATH, "settings.json")
 
@@ -45,6 +52,12 @@ SERVER_DEFAULTS = {
     "SERIES": {}
 }
 
+# battle log auto-reporting
+AUTOREPORT_INTERVAL = 600
+AUTOREPORT_CONCURRENCY = 5
+
+log = logging.getLogger("red.crladder")
+
 # recommneded formula
 MU = 1000
 SIGMA = MU / 3
@@ -87,6 +100,16 @@ def random_discord_color():
     return discord.Color(value=color)
 
 
+def rate_battle(player1, player2, battle):
+    """Update ratings of player1 (team) and player2 (opponent) by battle."""
+    if battle.winner > 0:
+        player1.rating, player2.rating = rate_1vs1(player1.rating, player2.rating)
+    elif battle.winner < 0:
+        player2.rating, player1.rating = rate_1vs1(player2.rating, player1.rating)
+    else:
+        player1.rating, player2.rating = rate_1vs1(player1.rating, player2.rating, drawn=True)
+
+
 def win_probability(rA: Rating, rB: Rating):
     delta_mu = rA.mu - rB.mu
     rsss = math.sqrt(rA.sigma ** 2 + rB.sigma ** 2)
@@ -315,6 +338,85 @@ class Match:
         }
 
 
+class Standings:
+    """Per-player aggregates and leaderboard of a series.
+
+    Built once from the stored matches and updated as matches are saved,
+    so info and rating updates do not walk the whole series.
+    """
+
+    def __init__(self, series):
+        # tag -> player model, shared with the series players list
+        self.players = {}
+        self.players_by_id = {}
+        # tag -> wins / losses / draws / games
+        self.stats = {}
+        # sorted (-mu, tag)
+        self.leaderboard = []
+
+        for player in series['players']:
+            self.add_player(player)
+        for match in series['matches'].values():
+            self.add_match(match)
+
+    @staticmethod
+    def empty_stats():
+        return {
+            "wins": 0,
+            "losses": 0,
+            "draws": 0,
+            "games": 0
+        }
+
+    def add_player(self, player):
+        tag = player['tag']
+        self.players[tag] = player
+        self.players_by_id[str(player['discord_id'])] = player
+        self.stats.setdefault(tag, self.empty_stats())
+        insort(self.leaderboard, (-player['rating']['mu'], tag))
+
+    def update_rating(self, tag, rating: Rating):
+        """Set rating of player and move it on the leaderboard."""
+        player = self.players.get(tag)
+        if player is None:
+            return None
+        key = (-player['rating']['mu'], tag)
+        i = bisect_left(self.leaderboard, key)
+        if i < len(self.leaderboard) and self.leaderboard[i] == key:
+            del self.leaderboard[i]
+        player['rating'] = {
+            "mu": float(rating.mu),
+            "sigma": float(rating.sigma)
+        }
+        insort(self.leaderboard, (-player['rating']['mu'], tag))
+        return player
+
+    def add_match(self, match, sign=1):
+        """Count match results. Use sign=-1 to remove a match."""
+        p1 = match['player1']
+        p2 = match['player2']
+        s1 = self.stats.setdefault(p1['tag'], self.empty_stats())
+        s2 = self.stats.setdefault(p2['tag'], self.empty_stats())
+        s1['games'] += sign
+        s2['games'] += sign
+        if p1['crowns'] > p2['crowns']:
+            s1['wins'] += sign
+            s2['losses'] += sign
+        elif p1['crowns'] == p2['crowns']:
+            s1['draws'] += sign
+            s2['draws'] += sign
+        elif p1['crowns'] < p2['crowns']:
+            s1['losses'] += sign
+            s2['wins'] += sign
+
+    def remove_match(self, match):
+        self.add_match(match, sign=-1)
+
+    def ranked(self):
+        """Player models by rating, highest first."""
+        return [self.players[tag] for _, tag in self.leaderboard]
+
+
 class Settings:
     """CRLadder settings."""
     server_default = {
@@ -336,6 +438,18 @@ class Settings:
         if "servers" not in self.model:
             self.model["servers"] = {}
 
+        # (server id, series name) -> Standings
+        self.standings = {}
+        self.poll_lock = asyncio.Lock()
+
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
+
     def save(self):
         """Save settings to file."""
         # preprocess rating if found
@@ -367,6 +481,7 @@ class Settings:
                 for player_id, player in series['players'].items():
                     player_list.append(player.copy())
                 series['players'] = player_list
+        self.standings = {}
         self.save()
 
     def server_model(self, server):
@@ -378,7 +493,7 @@ class Settings:
         """Create server settings if required."""
         if server.id not in self.model['servers']:
             self.model['servers'][server.id] = self.server_default
-        self.save()
+            self.save()
 
     def get_all_series(self, server):
         """Get all series."""
@@ -391,6 +506,13 @@ class Settings:
         else:
             return series
 
+    def get_standings(self, server, name):
+        """Standings of a series, built on first use."""
+        key = (server.id, name)
+        if key not in self.standings:
+            self.standings[key] = Standings(self.get_series_by_name(server, name))
+        return self.standings[key]
+
     def get_series_names_by_member(self, server, member):
         names = []
         for series_name, series in self.server_model(server)["series"].items():
@@ -431,15 +553,8 @@ class Settings:
     def get_player(self, server, name, member: discord.Member):
         """Check player settings."""
         self.check_server(server)
-        try:
-            series = self.get_series(server, name=name)
-            for player in series['players']:
-                if player['discord_id'] == member.id:
-                    return player
-        except NoSuchSeries:
-            raise NoSuchSeries
-        else:
-            return None
+        standings = self.get_standings(server, name)
+        return standings.players_by_id.get(str(member.id))
 
     def init_server(self, server):
         """Initialize server settings to default"""
@@ -452,6 +567,7 @@ class Settings:
         if name in series:
             raise SeriesExist
         series[name] = self.series_default.copy()
+        self.standings.pop((server.id, name), None)
         self.save()
 
     def remove_series(self, server, name):
@@ -463,6 +579,7 @@ class Settings:
         else:
             all_series = self.get_all_series(server)
             all_series.pop(name)
+            self.standings.pop((server.id, name), None)
             self.save()
 
     def add_player(self, server, name, player: discord.Member, player_tag=None):
@@ -473,6 +590,7 @@ class Settings:
             return False
         else:
             series["players"].append(Player(discord_id=player.id, tag=player_tag).to_dict())
+            self.get_standings(server, name).add_player(series["players"][-1])
             self.save()
             return True
 
@@ -488,12 +606,18 @@ class Settings:
         else:
             return player_tag
 
-    def verify_player(self, series, member: discord.Member):
+    def verify_player(self, server, name, member: discord.Member):
         """Verify player is in series."""
-        for player in series['players']:
-            if player['discord_id'] == member.id:
-                return True
-        return False
+        return self.get_player(server, name, member) is not None
+
+    async def fetch_battles(self, tag):
+        """Battle log of a player."""
+        url = 'http://api.cr-api.com/player/{}?keys=battles'.format(tag)
+        resp = await self.http.get(url, headers={'auth': self.auth})
+        if resp.status != 200:
+            raise APIError(resp)
+        response = json.loads(resp.body.decode('utf-8'))
+        return [Battle(battle) for battle in response.get('battles') or []]
 
     async def find_battles(self, series, member1: discord.Member, member2: discord.Member):
         """Find battle by member1 vs member2."""
@@ -504,19 +628,9 @@ class Settings:
             if player['discord_id'] == member2.id:
                 player2 = player
 
-        url = 'http://api.cr-api.com/player/{}?keys=battles'.format(player1['tag'])
-        response = {}
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers={'auth': self.auth}) as resp:
-                if resp.status != 200:
-                    raise APIError(resp)
-                else:
-                    response = await resp.json()
-
-        all_battles = response.get('battles')
+        all_battles = await self.fetch_battles(player1['tag'])
         battles = []
-        for battle in all_battles:
-            b = Battle(battle)
+        for b in all_battles:
             add_this = True
             if not b.valid_type:
                 add_this = False
@@ -528,39 +642,150 @@ class Settings:
         return battles
 
     def is_battle_saved(self, server, name, battle: Battle):
-        self.save()
         series = self.get_series(server, name=name)
-        keys = [k for k in series['matches'].keys()]
-        is_in = str(battle.timestamp) in keys
-        return is_in
+        return str(battle.timestamp) in series['matches']
 
-    def save_battle(self,
+    def save_battle(self, server, name,
                     player1: Player = None,
                     player2: Player = None,
                     player1_old_rating: Rating = None,
                     player2_old_rating: Rating = None,
-                    series=None, battle=None):
+                    battle=None, save=True):
+        """Save match and new player ratings."""
+        series = self.get_series(server, name=name)
+        standings = self.get_standings(server, name)
         match = Match(player1=player1, player2=player2, player1_old_rating=player1_old_rating,
                       player2_old_rating=player2_old_rating, battle=battle)
 
-        series['matches'][str(battle.timestamp)] = match.to_dict()
-        self.save()
+        key = str(battle.timestamp)
+        if key in series['matches']:
+            standings.remove_match(series['matches'][key])
+        series['matches'][key] = match.to_dict()
+        standings.add_match(series['matches'][key])
+        standings.update_rating(player1.tag, player1.rating)
+        standings.update_rating(player2.tag, player2.rating)
+        if save:
+            self.save()
 
     def update_player_rating(self, server, name, player):
-        series = self.get_series(server, name=name)
-        update_player = None
-        for p in series['players']:
-            if p['tag'] == player.tag:
-                update_player = p
-        if update_player is None:
+        standings = self.get_standings(server, name)
+        if standings.update_rating(player.tag, player.rating) is None:
             return False
-        update_player['rating'] = {
-            "mu": float(player.rating.mu),
-            "sigma": float(player.rating.sigma)
-        }
         self.save()
         return True
 
+    @property
+    def autoreport(self):
+        """Auto-report settings."""
+        if 'autoreport' not in self.model:
+            self.model['autoreport'] = {
+                "enabled": False,
+                "interval": AUTOREPORT_INTERVAL
+            }
+        return self.model['autoreport']
+
+    async def poll_series(self, server, name):
+        """Record new friendly battles between players of a series.
+
+        Battle logs of all players are fetched concurrently. A battle seen
+        from both sides is recorded once, and battles older than the last
+        one seen for a player are skipped. Return list of saved battles.
+        """
+        async with self.poll_lock:
+            return await self._poll_series(server, name)
+
+    async def _poll_series(self, server, name):
+        series = self.get_series(server, name=name)
+        standings = self.get_standings(server, name)
+        if 'last_seen' not in series:
+            series['last_seen'] = {}
+        last_seen = series['last_seen']
+        semaphore = asyncio.Semaphore(AUTOREPORT_CONCURRENCY)
+
+        async def fetch(tag):
+            async with semaphore:
+                try:
+                    return await self.fetch_battles(tag)
+                except (APIError, asyncio.TimeoutError, aiohttp.ClientError,
+                        ValueError, OSError):
+                    return []
+
+        tags = list(standings.players.keys())
+        logs = await asyncio.gather(*[fetch(tag) for tag in tags])
+
+        found = {}
+        for tag, battles in zip(tags, logs):
+            since = last_seen.get(tag, 0)
+            for battle in battles:
+                if not battle.valid_type or battle.timestamp is None:
+                    continue
+                last_seen[tag] = max(last_seen.get(tag, 0), battle.timestamp)
+                if battle.timestamp <= since:
+                    continue
+                team_tag = normalize_tag(battle.team_tag)
+                opponent_tag = normalize_tag(battle.opponent_tag)
+                if opponent_tag not in standings.players:
+                    continue
+                key = (battle.timestamp, frozenset([team_tag, opponent_tag]))
+                if key in found or str(battle.timestamp) in series['matches']:
+                    continue
+                found[key] = battle
+
+        saved = []
+        for battle in sorted(found.values(), key=lambda b: int(b.timestamp)):
+            player1 = Player.from_dict(standings.players[normalize_tag(battle.team_tag)])
+            player2 = Player.from_dict(standings.players[normalize_tag(battle.opponent_tag)])
+            player1_old_rating = env.create_rating(mu=player1.rating.mu, sigma=player1.rating.sigma)
+            player2_old_rating = env.create_rating(mu=player2.rating.mu, sigma=player2.rating.sigma)
+            rate_battle(player1, player2, battle)
+            self.save_battle(
+                server, name,
+                player1=player1, player2=player2, player1_old_rating=player1_old_rating,
+                player2_old_rating=player2_old_rating, battle=battle, save=False)
+            saved.append(battle)
+
+        self.save()
+        return saved
+
+    def rebuild(self, server, name):
+        """Recompute ratings by replaying all matches in time order.
+
+        Return number of matches replayed.
+        """
+        series = self.get_series(server, name=name)
+        ratings = {p['tag']: env.create_rating() for p in series['players']}
+        matches = sorted(
+            series['matches'].values(), key=lambda m: int(m['timestamp']))
+
+        for match in matches:
+            p1 = match['player1']
+            p2 = match['player2']
+            r1 = ratings.get(p1['tag'], env.create_rating())
+            r2 = ratings.get(p2['tag'], env.create_rating())
+            p1['old_rating'] = {"mu": r1.mu, "sigma": r1.sigma}
+            p2['old_rating'] = {"mu": r2.mu, "sigma": r2.sigma}
+            if p1['crowns'] > p2['crowns']:
+                r1, r2 = rate_1vs1(r1, r2)
+            elif p1['crowns'] < p2['crowns']:
+                r2, r1 = rate_1vs1(r2, r1)
+            else:
+                r1, r2 = rate_1vs1(r1, r2, drawn=True)
+            p1['new_rating'] = {"mu": r1.mu, "sigma": r1.sigma}
+            p2['new_rating'] = {"mu": r2.mu, "sigma": r2.sigma}
+            ratings[p1['tag']] = r1
+            ratings[p2['tag']] = r2
+
+        for player in series['players']:
+            rating = ratings[player['tag']]
+            player['rating'] = {
+                "mu": float(rating.mu),
+                "sigma": float(rating.sigma)
+            }
+
+        self.standings.pop((server.id, name), None)
+        self.save()
+        return len(matches)
+
 
 class CRLadder:
     """CRLadder ranking system.
@@ -576,6 +801,44 @@ class CRLadder:
         """Init."""
         self.bot = bot
         self.settings = Settings(bot)
+        self.task = bot.loop.create_task(self.loop_task())
+
+    def __unload(self):
+        self.task.cancel()
+
+    async def loop_task(self):
+        """Auto-report battles of active series."""
+        await self.bot.wait_until_ready()
+        while self is self.bot.get_cog("CRLadder"):
+            autoreport = self.settings.autoreport
+            if autoreport.get('enabled'):
+                try:
+                    await self.poll_all()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("Auto-report poll failed")
+            await asyncio.sleep(autoreport.get('interval', AUTOREPORT_INTERVAL))
+
+    async def poll_all(self, servers=None):
+        """Poll all active series on servers, all servers by default.
+
+        Return number of saved battles.
+        """
+        if servers is None:
+            servers = list(self.bot.servers)
+        count = 0
+        for server in servers:
+            if server.id not in self.settings.model['servers']:
+                continue
+            for name, series in list(self.settings.get_all_series(server).items()):
+                if series.get('status') != 'active':
+                    continue
+                try:
+                    count += len(await self.settings.poll_series(server, name))
+                except NoSuchSeries:
+                    pass
+        return count
 
     @commands.group(pass_context=True)
     async def crladderset(self, ctx):
@@ -643,6 +906,54 @@ class CRLadder:
             else:
                 await self.bot.say("Status for {} set to {}.".format(name, status))
 
+    @checks.is_owner()
+    @crladderset.command(name="autoreport", pass_context=True)
+    async def crladderset_autoreport(self, ctx, on_off: bool, interval: int = None):
+        """Poll battle logs of active series in the background.
+
+        interval: seconds between polls.
+        """
+        autoreport = self.settings.autoreport
+        autoreport['enabled'] = on_off
+        if interval is not None:
+            autoreport['interval'] = max(60, interval)
+        self.settings.save()
+        await self.bot.say(
+            "Auto-report {}. Interval: {}s.".format(
+                "enabled" if on_off else "disabled", autoreport['interval']))
+
+    @checks.mod_or_permissions()
+    @crladderset.command(name="poll", pass_context=True)
+    async def crladderset_poll(self, ctx, name=None):
+        """Record new battles now.
+
+        Polls a series by name, or all active series on this server.
+        """
+        server = ctx.message.server
+        await self.bot.type()
+        if name is None:
+            count = await self.poll_all([server])
+        else:
+            try:
+                count = len(await self.settings.poll_series(server, name))
+            except NoSuchSeries:
+                await self.bot.say("Cannot find a series named {}".format(name))
+                return
+        await self.bot.say("Recorded {} new battles.".format(count))
+
+    @checks.mod_or_permissions()
+    @crladderset.command(name="rebuild", pass_context=True)
+    async def crladderset_rebuild(self, ctx, name):
+        """Recompute ratings of a series from its match history."""
+        server = ctx.message.server
+        try:
+            count = self.settings.rebuild(server, name)
+        except NoSuchSeries:
+            await self.bot.say("Cannot find a series named {}".format(name))
+        else:
+            await self.bot.say(
+                "Replayed {} matches. Ratings for {} rebuilt.".format(count, name))
+
     @checks.mod_or_permissions()
     @crladderset.command(name="addplayer", aliases=['ap'], pass_context=True)
     async def crladderset_addplayer(self, ctx, name, player: discord.Member, player_tag=None):
@@ -727,39 +1038,6 @@ class CRLadder:
                     name
                 ))
 
-    def calculate_stats(self, series):
-        """Calculate stats.
-
-        dictionary key: player tag.
-        """
-        # stats key = tag
-        stats = {}
-        # populate dicts
-        for player in series['players']:
-            stats[player["tag"]] = {
-                "wins": 0,
-                "losses": 0,
-                "draws": 0,
-                "games": 0
-            }
-
-        for timestamp, match in series['matches'].items():
-            p1 = match['player1']
-            p2 = match['player2']
-            stats[p1['tag']]['games'] += 1
-            stats[p2['tag']]['games'] += 1
-            if p1['crowns'] > p2['crowns']:
-                stats[p1['tag']]['wins'] += 1
-                stats[p2['tag']]['losses'] += 1
-            elif p1['crowns'] == p2['crowns']:
-                stats[p1['tag']]['draws'] += 1
-                stats[p2['tag']]['draws'] += 1
-            elif p1['crowns'] < p2['crowns']:
-                stats[p1['tag']]['losses'] += 1
-                stats[p2['tag']]['wins'] += 1
-
-        return stats
-
     @crladder.command(name="info", pass_context=True)
     async def crladder_info(self, ctx, name, *args):
         """Info about a series.
@@ -790,13 +1068,13 @@ class CRLadder:
             await self.bot.say("Cannot find a series named {}", format(name))
         else:
 
-            #  calculate total wins/losses by player
-            stats = self.calculate_stats(series)
+            #  total wins/losses by player
+            standings = self.settings.get_standings(server, name)
+            stats = standings.stats
 
             player_list = []
             player_ids = []
-            players = [Player.from_dict(d) for d in series['players']]
-            players = sorted(players, key=lambda p: p.rating_display, reverse=True)
+            players = [Player.from_dict(d) for d in standings.ranked()]
             for p in players:
                 member = server.get_member(p.discord_id)
                 player_ids.append(p.discord_id)
@@ -869,10 +1147,10 @@ class CRLadder:
             await self.bot.say("Player is in multiple series. Please specify name of the series.")
             return
         else:
-            if not self.settings.verify_player(series, author):
+            if not self.settings.verify_player(server, name, author):
                 await self.bot.say("You are not registered in this series.")
                 return
-            if not self.settings.verify_player(series, member):
+            if not self.settings.verify_player(server, name, member):
                 await self.bot.say("{} is not registered is this series.".format(member))
                 return
             try:
@@ -891,41 +1169,51 @@ class CRLadder:
                 battles = sorted(battles, key=lambda x: int(x.timestamp))
                 battle = battles[-1]
 
-                save_battle = True
-                if self.settings.is_battle_saved(server, name, battle):
-                    save_battle = False
-
-                # force update for debugging
-                if force_update:
-                    save_battle = True
-
                 def match_1vs1(winner: Player, loser: Player, drawn=False):
                     """Match score reporting."""
                     winner.rating, loser.rating = rate_1vs1(winner.rating, loser.rating, drawn=drawn)
                     return winner, loser
 
-                p_author = Player.from_dict(self.settings.get_player(server, name, author).copy())
-                p_member = Player.from_dict(self.settings.get_player(server, name, member).copy())
-                # print(p_author)
-
-                p_author_rating_old = env.create_rating(mu=p_author.rating.mu, sigma=p_author.rating.sigma)
-                p_member_rating_old = env.create_rating(mu=p_member.rating.mu, sigma=p_member.rating.sigma)
-
-                if battle.winner > 0:
-                    color = discord.Color.green()
-                    p_author, p_member = match_1vs1(p_author, p_member)
-                    # print("p_author", p_author)
-                    # print("p_member", p_member)
-                elif battle.winner == 0:
-                    color = discord.Color.light_grey()
-                    p_author, p_member = match_1vs1(p_author, p_member, drawn=True)
-                elif battle.winner < 0:
-                    color = discord.Color.red()
-                    p_member, p_author = match_1vs1(p_member, p_author)
-                    # print("p_author", p_author)
-                    # print("p_member", p_member)
-                else:
-                    color = discord.Color.gold()
+                # check, rate and save without an auto-report poll in between
+                async with self.settings.poll_lock:
+                    save_battle = True
+                    if self.settings.is_battle_saved(server, name, battle):
+                        save_battle = False
+
+                    # force update for debugging
+                    if force_update:
+                        save_battle = True
+
+                    p_author = Player.from_dict(self.settings.get_player(server, name, author).copy())
+                    p_member = Player.from_dict(self.settings.get_player(server, name, member).copy())
+                    # print(p_author)
+
+                    p_author_rating_old = env.create_rating(mu=p_author.rating.mu, sigma=p_author.rating.sigma)
+                    p_member_rating_old = env.create_rating(mu=p_member.rating.mu, sigma=p_member.rating.sigma)
+
+                    if battle.winner > 0:
+                        color = discord.Color.green()
+                        p_author, p_member = match_1vs1(p_author, p_member)
+                        # print("p_author", p_author)
+                        # print("p_member", p_member)
+                    elif battle.winner == 0:
+                        color = discord.Color.light_grey()
+                        p_author, p_member = match_1vs1(p_author, p_member, drawn=True)
+                    elif battle.winner < 0:
+                        color = discord.Color.red()
+                        p_member, p_author = match_1vs1(p_member, p_author)
+                        # print("p_author", p_author)
+                        # print("p_member", p_member)
+                    else:
+                        color = discord.Color.gold()
+
+                    # save battle
+                    if save_battle:
+                        self.settings.save_battle(
+                            server, name,
+                            player1=p_author, player2=p_member, player1_old_rating=p_author_rating_old,
+                            player2_old_rating=p_member_rating_old, battle=battle
+                        )
 
                 def display_rating(rating):
                     # return rating.mu - rating.sigma * 3
@@ -979,15 +1267,7 @@ class CRLadder:
                         inline=False
                     )
                 await self.bot.say(embed=em)
-
-                # save battle
                 if save_battle:
-                    self.settings.save_battle(
-                        player1=p_author, player2=p_member, player1_old_rating=p_author_rating_old,
-                        player2_old_rating=p_member_rating_old, series=series, battle=battle
-                    )
-                    updated = self.settings.update_player_rating(server, name, p_author)
-                    updated = self.settings.update_player_rating(server, name, p_member)
                     await self.bot.say("Elo updated.")
 
     @crladder.command(name="winprob", aliases=['w'], pass_context=True)
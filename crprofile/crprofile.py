@@ -29,8 +29,9 @@ import datetime as dt
 import itertools
 import json
 import os
-from collections import defaultdict, OrderedDict
+from collections import Counter, defaultdict, OrderedDict
 from datetime import timedelta
+from functools import lru_cache
 from random import choice
 
 import aiohttp
@@ -41,21 +42,45 @@ from cogs.utils import checks
 from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 
+from .httpclient import SessionHTTP
+
 PATH = os.path.join("data", "crprofile")
 PATH_PLAYERS = os.path.join(PATH, "players")
 JSON = os.path.join(PATH, "settings.json")
 BADGES_JSON = os.path.join(PATH, "badges.json")
-CHESTS = dataIO.load_json(os.path.join('data', 'crprofile', 'chests.json'))
+CHESTS_JSON = os.path.join(PATH, "chests.json")
+CLASHROYALE_JSON = os.path.join(PATH, "clashroyale.json")
 
 DATA_UPDATE_INTERVAL = timedelta(minutes=30).seconds
 
 API_FETCH_TIMEOUT = 10
 
+# player data cache: seconds before an entry is refreshed
+PLAYER_CACHE_TTL = 60
+# seconds before a stale entry is no longer served
+PLAYER_CACHE_MAX_STALE = timedelta(minutes=10).seconds
+PLAYER_CACHE_SIZE = 500
+
 BOTCOMMANDER_ROLES = ["Bot Commander"]
 
 CREDITS = 'Selfish + SML'
 
 
+# data files are loaded on first use so that other cogs can import
+# PlayerTagIndex without the crprofile data installed
+@lru_cache(maxsize=None)
+def load_chests():
+    """Chest cycle from apk."""
+    return dataIO.load_json(CHESTS_JSON)
+
+
+@lru_cache(maxsize=None)
+def sfid_to_key():
+    """Card key by sfid."""
+    cards = dataIO.load_json(CLASHROYALE_JSON)['Cards']
+    return {v['sfid']: k for k, v in cards.items()}
+
+
 def grouper(n, iterable, fillvalue=None):
     """Group lists into lists of items.
 
@@ -133,6 +158,83 @@ class Constants:
         return None
 
 
+class PlayerCache:
+    """In-memory LRU cache of player data by tag.
+
+    Entries younger than ttl are served as is. Stale entries are served
+    immediately and refreshed in the background, until they are older
+    than max_stale. Concurrent requests for the same tag share one fetch.
+    """
+
+    def __init__(self, loop, fetch, ttl=PLAYER_CACHE_TTL,
+                 max_stale=PLAYER_CACHE_MAX_STALE, size=PLAYER_CACHE_SIZE):
+        """Init.
+
+        fetch: coroutine function returning CRPlayerModel by tag.
+        """
+        self.loop = loop
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.size = size
+        # tag: (timestamp, data)
+        self.entries = OrderedDict()
+        # tag: task of in-flight fetch
+        self.pending = {}
+        self.stats = Counter()
+
+    def clear(self):
+        self.entries.clear()
+
+    def put(self, tag, data):
+        self.entries[tag] = (self.loop.time(), data)
+        self.entries.move_to_end(tag)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def _fetch(self, tag):
+        player = await self.fetch(tag)
+        if not player.error:
+            self.put(tag, player.data)
+        return player
+
+    def refresh(self, tag):
+        """Return in-flight fetch for tag, starting one if needed."""
+        task = self.pending.get(tag)
+        if task is None:
+            self.stats["fetches"] += 1
+            task = self.loop.create_task(self._fetch(tag))
+            self.pending[tag] = task
+            task.add_done_callback(lambda t: self.on_refresh_done(tag, t))
+        else:
+            self.stats["coalesced"] += 1
+        return task
+
+    def on_refresh_done(self, tag, task):
+        self.pending.pop(tag, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+
+    async def get(self, tag):
+        """Return CRPlayerModel by tag."""
+        entry = self.entries.get(tag)
+        if entry is not None:
+            timestamp, data = entry
+            age = self.loop.time() - timestamp
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                self.entries.move_to_end(tag)
+                return CRPlayerModel(data=data)
+            if age < self.max_stale:
+                self.stats["stale_hits"] += 1
+                self.entries.move_to_end(tag)
+                self.refresh(tag)
+                return CRPlayerModel(data=data)
+        self.stats["misses"] += 1
+        # shield so a cancelled caller does not cancel the shared fetch
+        return await asyncio.shield(self.refresh(tag))
+
+
 class BotEmoji:
     """Emojis available in bot."""
 
@@ -150,12 +252,26 @@ class BotEmoji:
             'epic': 'chestepic'
         }
 
-    def name(self, name):
-        """Emoji by name."""
+    def get(self, name):
+        """Emoji object by name or None.
+
+        Looked up from the shared EmojiIndex cog. If it is not loaded,
+        scan the bot emojis.
+        """
+        index = self.bot.get_cog("EmojiIndex")
+        if index is not None:
+            return index.emojis.get(name)
         for emoji in self.bot.get_all_emojis():
             if emoji.name == name:
-                return '<:{}:{}>'.format(emoji.name, emoji.id)
-        return ''
+                return emoji
+        return None
+
+    def name(self, name):
+        """Emoji by name."""
+        emoji = self.get(name)
+        if emoji is None:
+            return ''
+        return '<:{}:{}>'.format(emoji.name, emoji.id)
 
     def key(self, key):
         """Chest emojis by api key name or key.
@@ -236,7 +352,7 @@ class CRPlayerModel:
         """
         self.data = data
         self.is_cache = is_cache
-        self.CHESTS = CHESTS
+        self.CHESTS = load_chests()
         self.error = error
 
     def prop(self, section, prop, default=0):
@@ -587,13 +703,7 @@ class CRPlayerModel:
 
     def api_cardname_to_emoji(self, name, bot_emoji: BotEmoji):
         """Convert api card id to card emoji."""
-        cr = dataIO.load_json(os.path.join(PATH, "clashroyale.json"))
-        cards = cr["Cards"]
-        result = None
-        for crid, o in cards.items():
-            if o["sfid"] == name:
-                result = crid
-                break
+        result = sfid_to_key().get(name)
         if result is None:
             return None
         result = result.replace('-', '')
@@ -683,6 +793,52 @@ class CRPlayerModel:
         }
 
 
+class PlayerTagIndex:
+    """Member ids by player tag, by server id.
+
+    Built from the players settings of a server on first lookup and
+    updated as tags are set or removed. Several members can have the
+    same tag; the one who set it first is returned.
+
+    Shared by the CRProfile, CRClan and BSData cogs.
+    """
+
+    def __init__(self):
+        self.servers = {}
+
+    def get(self, server_id, players):
+        """Lists of member ids by player tag on server."""
+        if server_id not in self.servers:
+            index = defaultdict(list)
+            for member_id, player_tag in players.items():
+                index[player_tag].append(member_id)
+            self.servers[server_id] = index
+        return self.servers[server_id]
+
+    def member_id(self, server_id, players, tag):
+        """Member id with player tag on server, or None."""
+        member_ids = self.get(server_id, players).get(tag)
+        if member_ids:
+            return member_ids[0]
+        return None
+
+    def update(self, server_id, member_id, old_tag, tag):
+        """Move member from old_tag to tag. Either can be None."""
+        index = self.servers.get(server_id)
+        if index is None or old_tag == tag:
+            return
+        if old_tag is not None and member_id in index.get(old_tag, []):
+            index[old_tag].remove(member_id)
+            # other members may still hold old_tag
+            if not index[old_tag]:
+                del index[old_tag]
+        if tag is not None:
+            index[tag].append(member_id)
+
+    def reset(self, server_id):
+        self.servers.pop(server_id, None)
+
+
 class Settings:
     """Cog settings.
 
@@ -705,6 +861,19 @@ class Settings:
         self.filepath = filepath
         self.settings = nested_dict()
         self.settings.update(dataIO.load_json(filepath))
+        self.bot_emoji = BotEmoji(bot)
+        self.tag_index = PlayerTagIndex()
+        self.player_cache = PlayerCache(
+            bot.loop, self.fetch_player_data,
+            ttl=self.settings.get("player_cache_ttl", PLAYER_CACHE_TTL))
+
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
 
     def init_server(self, server):
         """Initialized server settings.
@@ -712,11 +881,13 @@ class Settings:
         This will wipe all clan data and player data.
         """
         self.settings["servers"][server.id] = self.SERVER_DEFAULTS
+        self.tag_index.reset(server.id)
         self.save()
 
     def init_players(self, server):
         """Initialized clan settings."""
         self.settings["servers"][server.id]["players"] = {}
+        self.tag_index.reset(server.id)
         self.save()
 
     def check_server(self, server):
@@ -743,6 +914,7 @@ class Settings:
         if "players" not in self.settings["servers"][server.id]:
             self.settings["servers"][server.id]["players"] = {}
         players = self.settings["servers"][server.id]["players"]
+        self.tag_index.update(server.id, member.id, players.get(member.id), tag)
         players[member.id] = tag
         self.settings["servers"][server.id]["players"] = players
         self.save()
@@ -751,7 +923,8 @@ class Settings:
         """Remove player tag from settings."""
         self.check_server(server)
         try:
-            self.settings["servers"][server.id]["players"].pop(member.id, None)
+            tag = self.settings["servers"][server.id]["players"].pop(member.id, None)
+            self.tag_index.update(server.id, member.id, tag, None)
         except KeyError:
             pass
         self.save()
@@ -760,20 +933,27 @@ class Settings:
         """Return Discord member from player tag."""
         try:
             players = self.settings["servers"][server.id]["players"]
-            for member_id, player_tag in players.items():
-                if player_tag == tag:
-                    return server.get_member(member_id)
         except KeyError:
-            pass
-        return None
+            return None
+        member_id = self.tag_index.member_id(server.id, players, tag)
+        if member_id is None:
+            return None
+        return server.get_member(member_id)
 
     def server_settings(self, server):
         """Return server settings."""
         return self.settings["servers"][server.id]
 
     async def player_data(self, tag):
-        """Return CRPlayerModel by tag."""
+        """Return CRPlayerModel by tag.
+
+        Served from the player cache when fresh enough.
+        """
         tag = SCTag(tag).tag
+        return await self.player_cache.get(tag)
+
+    async def fetch_player_data(self, tag):
+        """Fetch CRPlayerModel by tag from API."""
         url = API.player(tag)
 
         error = False
@@ -782,14 +962,13 @@ class Settings:
         headers = {"auth": self.auth}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=API_FETCH_TIMEOUT, headers=headers) as resp:
-                    if resp.status != 200:
-                        error = True
-                    else:
-                        data = await resp.json()
-                        file_path = self.cached_filepath(tag)
-                        dataIO.save_json(file_path, data)
+            response = await self.http.get(url, timeout=API_FETCH_TIMEOUT, headers=headers)
+            if response.status != 200:
+                error = True
+            else:
+                data = json.loads(response.body.decode("utf-8"))
+                file_path = self.cached_filepath(tag)
+                dataIO.save_json(file_path, data)
         except json.decoder.JSONDecodeError:
             raise
         except asyncio.TimeoutError:
@@ -841,13 +1020,9 @@ class Settings:
     def member2tag(self, server, member):
         """Return player tag from member."""
         try:
-            players = self.settings["servers"][server.id]["players"]
-            for member_id, player_tag in players.items():
-                if member_id == member.id:
-                    return player_tag
+            return self.settings["servers"][server.id]["players"].get(member.id)
         except KeyError:
-            pass
-        return None
+            return None
 
     def emoji(self, name=None, key=None):
         """Chest emojis by api key name or key.
@@ -868,11 +1043,7 @@ class Settings:
         if name is None:
             if key in emojis:
                 name = emojis[key]
-        for server in self.bot.servers:
-            for emoji in server.emojis:
-                if emoji.name == name:
-                    return '<:{}:{}>'.format(emoji.name, emoji.id)
-        return ''
+        return self.bot_emoji.name(name)
 
     @property
     def profile_api_url(self):
@@ -918,6 +1089,18 @@ class Settings:
         self.settings["auth"] = value
         self.save()
 
+    @property
+    def player_cache_ttl(self):
+        """Seconds before cached player data is refreshed."""
+        return self.player_cache.ttl
+
+    @player_cache_ttl.setter
+    def player_cache_ttl(self, value):
+        """Set player cache TTL."""
+        self.settings["player_cache_ttl"] = value
+        self.player_cache.ttl = value
+        self.save()
+
     def set_resources(self, server, value):
         """Show gold/gems or not."""
         self.settings[server.id]["show_resources"] = value
@@ -938,7 +1121,7 @@ class CRProfile:
         """Init."""
         self.bot = bot
         self.model = Settings(bot, JSON)
-        self.bot_emoji = BotEmoji(bot)
+        self.bot_emoji = self.model.bot_emoji
 
     async def player_data(self, tag):
         """Return CRPlayerModel by tag."""
@@ -992,6 +1175,25 @@ class CRProfile:
         self.model.profile_api_token = token
         await self.bot.say("API token save.")
 
+    @crprofileset.command(name="cachettl", pass_context=True)
+    async def crprofileset_cachettl(self, ctx, seconds: int):
+        """Seconds before cached player data is refreshed from API."""
+        self.model.player_cache_ttl = seconds
+        await self.bot.say("Player cache TTL set to {} seconds.".format(seconds))
+
+    @crprofileset.command(name="cachestats", pass_context=True)
+    @checks.is_owner()
+    async def crprofileset_cachestats(self, ctx):
+        """Player cache statistics."""
+        cache = self.model.player_cache
+        out = [
+            "Entries: {} / {}".format(len(cache.entries), cache.size),
+            "TTL: {}s".format(cache.ttl)
+        ]
+        for k in ["hits", "stale_hits", "misses", "fetches", "coalesced", "errors"]:
+            out.append("{}: {}".format(k, cache.stats[k]))
+        await self.bot.say("\n".join(out))
+
     @crprofileset.command(name="rmplayertag", pass_context=True)
     async def crprofileset_rmplayertag(self, ctx, member: discord.Member):
         """Remove player tag of a user."""
@@ -27,7 +27,11 @@ import os
 import io
 import datetime
 import asyncio
+import heapq
 import discord
+from collections import Counter
+from collections import defaultdict
+from operator import itemgetter
 
 from discord import Message
 from discord import Server
@@ -49,6 +53,111 @@ JSON = os.path.join(*PATH_LIST, "settings.json")
 HOST = '127.0.0.1'
 INTERVAL = 5
 
+# counters are aggregated locally and sent once per FLUSH_INTERVAL
+FLUSH_INTERVAL = 10
+# tags sent with aggregated counters; everything else is dropped
+TAGS = [
+    'server_id', 'server_name', 'channel_name', 'channel_id',
+    'role', 'command_name', 'cog_name']
+# distinct values kept per tag before new ones are sent as OTHER
+MAX_TAG_VALUES = 200
+# number of most active authors sent each interval
+TOP_K = 10
+TOP_K_CAPACITY = 100
+OTHER = 'other'
+
+
+class TopK:
+    """Space-Saving sketch of the most frequent keys.
+
+    Keeps at most capacity counters. When full, a new key replaces the
+    smallest counter and inherits its count, so heavy hitters are never
+    lost and counts are overestimated by at most the evicted count.
+    """
+
+    def __init__(self, capacity=TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+        else:
+            min_key = min(self.counts, key=self.counts.get)
+            self.counts[key] = self.counts.pop(min_key) + count
+
+    def top(self, k):
+        """List of (key, count) for the k largest counts."""
+        return heapq.nlargest(k, self.counts.items(), key=itemgetter(1))
+
+    def clear(self):
+        self.counts = {}
+
+
+class StatsAggregator:
+    """Local aggregation of DogStatsD counters.
+
+    Counters are keyed by metric and filtered tag set. Only tag names in
+    settings TAGS are kept. Tags with an allow-list in TAG_VALUES keep
+    only the listed values. Other tags keep the first MAX_TAG_VALUES
+    values seen. Values outside the allow-list or over the cap are sent
+    as OTHER.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.counters = Counter()
+        self.tag_values = defaultdict(set)
+        self.authors = TopK()
+
+    def filter_tags(self, tags):
+        """Tuple of allowed tags."""
+        allowed = self.settings['TAGS']
+        allow_lists = self.settings['TAG_VALUES']
+        filtered = []
+        for tag in tags:
+            name, _, value = tag.partition(':')
+            if name not in allowed:
+                continue
+            if name in allow_lists:
+                if value not in allow_lists[name]:
+                    value = OTHER
+            else:
+                values = self.tag_values[name]
+                if value not in values:
+                    if len(values) < self.settings['MAX_TAG_VALUES']:
+                        values.add(value)
+                    else:
+                        value = OTHER
+            filtered.append(name + ':' + value)
+        return tuple(sorted(filtered))
+
+    def increment(self, metric, tags=None, value=1):
+        self.counters[(metric, self.filter_tags(tags or []))] += value
+
+    def add_author(self, author):
+        self.authors.add((author.id, author.display_name))
+
+    def flush(self, tags):
+        """Send counters with global tags and reset."""
+        counters = self.counters
+        self.counters = Counter()
+        for (metric, metric_tags), value in counters.items():
+            statsd.increment(metric, value=value, tags=[*tags, *metric_tags])
+
+        for (author_id, author_name), value in self.authors.top(self.settings['TOP_K']):
+            statsd.increment(
+                'bot.msg.top_author',
+                value=value,
+                tags=[
+                    *tags,
+                    'author:' + str(author_name),
+                    'author_id:' + str(author_id)])
+        self.authors.clear()
+
+
 class DataDogLog:
     """DataDog Logger.
 
@@ -60,13 +169,20 @@ class DataDogLog:
         self.tags = []
         self.task = bot.loop.create_task(self.loop_task())
         self.settings = dataIO.load_json(JSON)
+        for k, v in default_settings().items():
+            self.settings.setdefault(k, v)
         datadog.initialize(statsd_host=self.settings['HOST'])
+        self.stats = StatsAggregator(self.settings)
+        self.flush_task = bot.loop.create_task(self.flush_loop_task())
 
     def save(self):
         dataIO.save_json(JSON, self.settings)
 
     def __unload(self):
         self.task.cancel()
+        self.flush_task.cancel()
+        if self.tags:
+            self.stats.flush(self.tags)
 
     async def loop_task(self):
         await self.bot.wait_until_ready()
@@ -79,6 +195,14 @@ class DataDogLog:
         if self is self.bot.get_cog('DataDogLog'):
             self.task = self.bot.loop.create_task(self.loop_task())
 
+    async def flush_loop_task(self):
+        """Send aggregated counters every FLUSH_INTERVAL."""
+        await self.bot.wait_until_ready()
+        while self is self.bot.get_cog('DataDogLog'):
+            await asyncio.sleep(self.settings['FLUSH_INTERVAL'])
+            if self.tags:
+                self.stats.flush(self.tags)
+
     async def on_message(self, message: Message):
         """Logs messages."""
         author = message.author
@@ -146,10 +270,9 @@ class DataDogLog:
     def dd_log_mentions(self, message: discord.Message):
         """Send mentions to datadog."""
         for member in message.mentions:
-            statsd.increment(
+            self.stats.increment(
                 'bot.mentions',
                 tags=[
-                    *self.tags,
                     'member:' + str(member.display_name),
                     'member_id:' + str(member.id),
                     'member_name:' + str(member.display_name)])
@@ -167,10 +290,10 @@ class DataDogLog:
         server_id = message.server.id
         server_name = message.server.name
 
-        statsd.increment(
+        self.stats.add_author(message.author)
+        self.stats.increment(
             'bot.msg',
             tags=[
-                *self.tags,
                 'author:' + str(message.author.display_name),
                 'author_id:' + str(message.author.id),
                 'author_name:' + str(message.author.name),
@@ -187,10 +310,9 @@ class DataDogLog:
         server_name = server.name
         for r in message.author.roles:
             if not r.is_everyone:
-                statsd.increment(
+                self.stats.increment(
                     'bot.msg.author.role',
                     tags=[
-                        *self.tags,
                         'server_id:' + str(server_id),
                         'server_name:' + str(server_name),
                         'role:' + str(r.name)])
@@ -204,10 +326,9 @@ class DataDogLog:
                  'echo', 'foxtrot', 'golf', 'hotel']
         for r in message.author.roles:
             if r.name.lower() in clans:
-                statsd.increment(
+                self.stats.increment(
                     'bot.msg.clan',
                     tags=[
-                        *self.tags,
                         'server_id:' + str(server_id),
                         'server_name:' + str(server_name),
                         'role:' + str(r.name)])
@@ -224,10 +345,9 @@ class DataDogLog:
         server = ctx.message.server
         server_id = server.id
         server_name = server.name
-        statsd.increment(
+        self.stats.increment(
             'bot.cmd',
             tags=[
-                *self.tags,
                 'author:' + str(ctx.message.author.display_name),
                 'author_id:' + str(ctx.message.author.id),
                 'author_name:' + str(ctx.message.author.name),
@@ -337,14 +457,22 @@ def check_folders():
         os.makedirs(PATH)
 
 
-def check_files():
-    defaults = {
+def default_settings():
+    return {
         'HOST': HOST,
-        'INTERVAL': INTERVAL
+        'INTERVAL': INTERVAL,
+        'FLUSH_INTERVAL': FLUSH_INTERVAL,
+        'TAGS': TAGS,
+        'TAG_VALUES': {},
+        'MAX_TAG_VALUES': MAX_TAG_VALUES,
+        'TOP_K': TOP_K
     }
+
+
+def check_files():
     if not dataIO.is_valid_json(JSON):
         print("Creating empty %s" % JSON)
-        dataIO.save_json(JSON, defaults)
+        dataIO.save_json(JSON, default_settings())
 
 
 def setup(bot):
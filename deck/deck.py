@@ -28,8 +28,12 @@ import datetime
 import io
 import os
 import re
+import sqlite3
 import yaml
 import string
+import threading
+from collections import OrderedDict
+from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor
 
 import aiohttp
@@ -43,6 +47,7 @@ from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 
 SETTINGS_PATH = os.path.join("data", "deck", "settings.json")
+DECKS_DB_PATH = os.path.join("data", "deck", "decks.db")
 AKA_PATH = os.path.join("data", "deck", "cards_aka.yaml")
 CARDS_JSON_PATH = os.path.join("data", "deck", "cards.json")
 max_deck_per_user = 5
@@ -51,6 +56,12 @@ PAGINATION_TIMEOUT = 20.0
 HELP_URL = "https://github.com/smlbiobot/SML-Cogs/wiki/Deck#usage"
 CARDS_JSON_URL = "https://cr-api.github.io/cr-api-data/json/cards.json"
 
+DECK_IMG_PATH = os.path.join("data", "deck", "img")
+DECK_FONT_PATH = os.path.join("data", "deck", "fonts")
+# deck images are composited at this scale and cached as PNG bytes
+DECK_IMAGE_SCALE = 0.5
+DECK_IMAGE_CACHE_SIZE = 64
+
 numbs = {
     "next": "➡",
     "back": "⬅",
@@ -58,18 +69,300 @@ numbs = {
 }
 
 
-class BotEmoji:
-    """Emojis available in bot."""
+class DeckImage:
+    """Deck image compositor.
+
+    Background, fonts and card sprites are loaded once, already scaled
+    to the output size, so each deck only needs a few pastes and text
+    draws. Finished images are kept in an LRU as PNG bytes.
+
+    Shared by the Deck and ClashRoyale cogs.
+    """
+
+    card_w = 302
+    card_h = 363
+    card_x = 30
+    card_y = 30
+    font_size = 50
+    txt_y_line1 = 430
+    txt_y_line2 = 500
+    txt_x_name = 50
+    txt_x_cards = 503
+    txt_x_elixir = 1872
+
+    def __init__(self, img_path, font_path, default_name="Deck",
+                 scale=DECK_IMAGE_SCALE, cache_size=DECK_IMAGE_CACHE_SIZE):
+        """Init."""
+        self.img_path = img_path
+        self.default_name = default_name
+        self.scale = scale
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # cache is read on the event loop and written from worker threads
+        self.cache_lock = threading.Lock()
+        self.sprites = {}
+        # Pillow fonts are not safe to share between threads
+        self.lock = threading.Lock()
+
+        bg_image = Image.open(os.path.join(img_path, "deck-bg-b.png"))
+        self.size = self.scaled(bg_image.size)
+        self.background = bg_image.convert("RGBA").resize(self.size, Image.LANCZOS)
+
+        font_size = int(self.font_size * scale)
+        self.font_regular = ImageFont.truetype(
+            os.path.join(font_path, "OpenSans-Regular.ttf"), size=font_size)
+        self.font_bold = ImageFont.truetype(
+            os.path.join(font_path, "OpenSans-Bold.ttf"), size=font_size)
+
+    def scaled(self, values):
+        """Scale a tuple of pixel values."""
+        return tuple(int(v * self.scale) for v in values)
+
+    def sprite(self, card):
+        """Card image scaled to output size."""
+        if card not in self.sprites:
+            card_image = Image.open(
+                os.path.join(self.img_path, "cards", "{}.png".format(card)))
+            self.sprites[card] = card_image.convert("RGBA").resize(
+                self.scaled((self.card_w, self.card_h)), Image.LANCZOS)
+        return self.sprites[card]
+
+    def cache_key(self, deck, deck_name, deck_author_name, average_elixir):
+        return tuple(deck), deck_name, deck_author_name, average_elixir
+
+    def get_cached(self, *args):
+        """Cached PNG bytes or None."""
+        key = self.cache_key(*args)
+        with self.cache_lock:
+            png = self.cache.get(key)
+            if png is not None:
+                self.cache.move_to_end(key)
+        return png
+
+    def render(self, deck, deck_name, deck_author_name, average_elixir):
+        """Composite deck image and return PNG bytes."""
+        png = self.get_cached(deck, deck_name, deck_author_name, average_elixir)
+        if png is not None:
+            return png
+
+        with self.lock:
+            image = self.compose(
+                deck, deck_name or self.default_name,
+                deck_author_name, average_elixir)
+
+        with io.BytesIO() as f:
+            image.save(f, "PNG")
+            png = f.getvalue()
+
+        key = self.cache_key(deck, deck_name, deck_author_name, average_elixir)
+        with self.cache_lock:
+            self.cache[key] = png
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return png
+
+    def compose(self, deck, deck_name, deck_author_name, average_elixir):
+        """Construct the deck with Pillow and return image."""
+        card_w, card_h = self.scaled((self.card_w, self.card_h))
+        card_x, card_y = self.scaled((self.card_x, self.card_y))
+        txt_y_line1, txt_y_line2 = self.scaled((self.txt_y_line1, self.txt_y_line2))
+        txt_x_name, txt_x_cards, txt_x_elixir = self.scaled(
+            (self.txt_x_name, self.txt_x_cards, self.txt_x_elixir))
+
+        image = self.background.copy()
+
+        # cards
+        for i, card in enumerate(deck):
+            card_image = self.sprite(card)
+            image.paste(card_image, (card_x + card_w * i, card_y), card_image)
+
+        # text
+        # Take out hyphnens and capitlize the name of each card
+        card_names = [string.capwords(c.replace('-', ' ')) for c in deck]
+
+        txt = Image.new("RGBA", self.size)
+        txt_name = Image.new(
+            "RGBA", (txt_x_cards - int(30 * self.scale), self.size[1]))
+
+        d = ImageDraw.Draw(txt)
+        d_name = ImageDraw.Draw(txt_name)
+
+        line1 = ', '.join(card_names[:4])
+        line2 = ', '.join(card_names[4:])
+
+        d_name.text(
+            (txt_x_name, txt_y_line1), deck_name, font=self.font_bold,
+            fill=(0xff, 0xff, 0xff, 255))
+        d_name.text(
+            (txt_x_name, txt_y_line2), deck_author_name, font=self.font_regular,
+            fill=(0xff, 0xff, 0xff, 255))
+        d.text(
+            (txt_x_cards, txt_y_line1), line1, font=self.font_regular,
+            fill=(0xff, 0xff, 0xff, 255))
+        d.text(
+            (txt_x_cards, txt_y_line2), line2, font=self.font_regular,
+            fill=(0xff, 0xff, 0xff, 255))
+        d.text(
+            (txt_x_elixir, txt_y_line1), "Avg elixir", font=self.font_bold,
+            fill=(0xff, 0xff, 0xff, 200))
+        d.text(
+            (txt_x_elixir, txt_y_line2), average_elixir, font=self.font_bold,
+            fill=(0xff, 0xff, 0xff, 255))
+
+        image.paste(txt, (0, 0), txt)
+        image.paste(txt_name, (0, 0), txt_name)
+
+        return image
 
-    def __init__(self, bot):
-        self.bot = bot
 
-    def name(self, name):
-        """Emoji by name."""
-        for emoji in self.bot.get_all_emojis():
-            if emoji.name == name:
-                return '<:{}:{}>'.format(emoji.name, emoji.id)
-        return ''
+DeckRecord = namedtuple(
+    "DeckRecord",
+    ["id", "server_id", "member_id", "member_name", "utc", "name", "cards"])
+
+
+class DeckLibrary:
+    """Personal deck library stored in SQLite.
+
+    Decks are indexed by member and timestamp for listing, and by card
+    through the deck_cards table for search. Every change is written as
+    its own transaction instead of rewriting the settings file.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS decks (
+            id INTEGER PRIMARY KEY,
+            server_id TEXT NOT NULL,
+            member_id TEXT NOT NULL,
+            member_name TEXT NOT NULL,
+            utc TEXT NOT NULL,
+            name TEXT NOT NULL,
+            cards TEXT NOT NULL)""",
+        """CREATE INDEX IF NOT EXISTS decks_member
+            ON decks (server_id, member_id, utc)""",
+        """CREATE INDEX IF NOT EXISTS decks_server
+            ON decks (server_id, utc)""",
+        """CREATE TABLE IF NOT EXISTS deck_cards (
+            server_id TEXT NOT NULL,
+            card TEXT NOT NULL,
+            deck_id INTEGER NOT NULL
+                REFERENCES decks (id) ON DELETE CASCADE,
+            PRIMARY KEY (server_id, card, deck_id)) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS deck_cards_deck
+            ON deck_cards (deck_id)"""
+    ]
+
+    COLUMNS = "id, server_id, member_id, member_name, utc, name, cards"
+
+    def __init__(self, path):
+        """Init."""
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, row):
+        """DeckRecord from a decks row."""
+        row = list(row)
+        row[-1] = row[-1].split(',')
+        return DeckRecord(*row)
+
+    def insert(self, server_id, member_id, member_name, utc, name, cards):
+        """Insert deck without committing. Return row id."""
+        cursor = self.conn.execute(
+            "INSERT INTO decks "
+            "(server_id, member_id, member_name, utc, name, cards) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (server_id, member_id, member_name, utc, name, ','.join(cards)))
+        deck_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO deck_cards (server_id, card, deck_id) "
+            "VALUES (?, ?, ?)",
+            [(server_id, card, deck_id) for card in cards])
+        return deck_id
+
+    def add(self, server_id, member_id, member_name, utc, name, cards,
+            max_decks=None):
+        """Add a deck, dropping the oldest decks of member over max_decks."""
+        with self.conn:
+            deck_id = self.insert(
+                server_id, member_id, member_name, utc, name, cards)
+            if max_decks is not None:
+                self.conn.execute(
+                    "DELETE FROM decks WHERE id IN ("
+                    "SELECT id FROM decks "
+                    "WHERE server_id = ? AND member_id = ? "
+                    "ORDER BY utc DESC, id DESC LIMIT -1 OFFSET ?)",
+                    (server_id, member_id, max_decks))
+        return deck_id
+
+    def member_decks(self, server_id, member_id):
+        """Decks of a member, oldest first."""
+        rows = self.conn.execute(
+            "SELECT {} FROM decks "
+            "WHERE server_id = ? AND member_id = ? "
+            "ORDER BY utc, id".format(self.COLUMNS),
+            (server_id, member_id))
+        return [self.record(row) for row in rows]
+
+    def member_deck(self, server_id, member_id, index):
+        """Deck of a member by 0-based position in member_decks."""
+        if index < 0:
+            return None
+        row = self.conn.execute(
+            "SELECT {} FROM decks "
+            "WHERE server_id = ? AND member_id = ? "
+            "ORDER BY utc, id LIMIT 1 OFFSET ?".format(self.COLUMNS),
+            (server_id, member_id, index)).fetchone()
+        if row is None:
+            return None
+        return self.record(row)
+
+    def search(self, server_id, cards):
+        """Decks of a server containing all cards, newest first."""
+        cards = list(set(cards))
+        rows = self.conn.execute(
+            "SELECT {} FROM decks WHERE id IN ("
+            "SELECT deck_id FROM deck_cards "
+            "WHERE server_id = ? AND card IN ({}) "
+            "GROUP BY deck_id HAVING COUNT(*) = ?) "
+            "ORDER BY utc DESC, id DESC".format(
+                self.COLUMNS, ', '.join('?' * len(cards))),
+            [server_id] + cards + [len(cards)])
+        return [self.record(row) for row in rows]
+
+    def rename(self, deck_id, name):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE decks SET name = ? WHERE id = ?", (name, deck_id))
+
+    def remove(self, deck_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM decks WHERE id = ?", (deck_id,))
+
+    def import_settings(self, settings):
+        """Move decks stored in settings into the library.
+
+        Return True if settings were changed.
+        """
+        changed = False
+        with self.conn:
+            for server_id, server_settings in settings["Servers"].items():
+                members = server_settings.pop("Members", None)
+                if members is None:
+                    continue
+                changed = True
+                for member_id, member in members.items():
+                    for utc, deck in member.get("Decks", {}).items():
+                        self.insert(
+                            server_id, member_id,
+                            member.get("MemberDisplayName", ""),
+                            utc, deck["DeckName"], deck["Deck"])
+        return changed
 
 
 class Deck:
@@ -80,6 +373,8 @@ class Deck:
         self.bot = bot
         self.settings = dataIO.load_json(SETTINGS_PATH)
         self.cards = dataIO.load_json(CARDS_JSON_PATH)
+        self.decklink_to_key = {str(card["decklink"]): card["key"] for card in self.cards}
+        self.key_to_decklink = {card["key"]: str(card["decklink"]) for card in self.cards}
 
         # init card data
         self.cards_abbrev = {}
@@ -109,6 +404,15 @@ class Deck:
 
         # Used for Pillow blocking code
         self.threadex = ThreadPoolExecutor(max_workers=2)
+        self.deck_image = DeckImage(DECK_IMG_PATH, DECK_FONT_PATH)
+
+        self.library = DeckLibrary(DECKS_DB_PATH)
+        if self.library.import_settings(self.settings):
+            self.save_settings()
+
+    def __unload(self):
+        self.threadex.shutdown(wait=False)
+        self.library.close()
 
     @property
     def valid_card_keys(self):
@@ -218,17 +522,11 @@ class Deck:
 
     async def card_decklink_to_key(self, decklink):
         """Decklink id to card."""
-        for card in self.cards:
-            if decklink == str(card["decklink"]):
-                return card["key"]
-        return None
+        return self.decklink_to_key.get(decklink)
 
     async def card_key_to_decklink(self, key):
         """Card key to decklink id."""
-        for card in self.cards:
-            if key == card["key"]:
-                return str(card["decklink"])
-        return None
+        return self.key_to_decklink.get(key)
 
     async def decklink_to_cards(self, url):
         """Convert decklink to cards."""
@@ -294,25 +592,13 @@ class Deck:
 
             await self.deck_upload(ctx, member_deck, deck_name)
 
-            decks = self.settings["Servers"][server.id]["Members"][author.id]["Decks"]
-
             if self.deck_is_valid:
                 await self.bot.say("Deck added.")
-                deck_key = str(datetime.datetime.utcnow())
-                decks[deck_key] = {
-                    "Deck": member_deck,
-                    "DeckName": deck_name
-                }
-
                 # If user has more than allowed by max, remove older decks
-                timestamp = decks.keys()
-                timestamp = sorted(timestamp)
-
-                while len(decks) > max_deck_per_user:
-                    t = timestamp.pop(0)
-                    decks.pop(t, None)
-
-                self.save_settings()
+                self.library.add(
+                    server.id, author.id, author.display_name,
+                    str(datetime.datetime.utcnow()), deck_name, member_deck,
+                    max_decks=max_deck_per_user)
 
     @deck.command(name="list", pass_context=True, no_pm=True)
     async def deck_list(self, ctx, member: discord.Member = None):
@@ -326,18 +612,15 @@ class Deck:
             member = author
             member_is_author = True
 
-        self.check_server_settings(server)
-        self.check_member_settings(server, member)
-
-        decks = self.settings["Servers"][server.id]["Members"][member.id]["Decks"]
+        decks = self.library.member_decks(server.id, member.id)
 
         deck_id = 1
 
-        for k, deck in decks.items():
+        for deck in decks:
             await self.upload_deck_image(
-                ctx, deck["Deck"], deck["DeckName"], member,
-                description="**{}**. {}".format(deck_id, deck["DeckName"]))
-            await self.decklink(ctx, deck["Deck"])
+                ctx, deck.cards, deck.name, member,
+                description="**{}**. {}".format(deck_id, deck.name))
+            await self.decklink(ctx, deck.cards)
             deck_id += 1
 
         if not len(decks):
@@ -359,10 +642,7 @@ class Deck:
             member = author
             member_is_author = True
 
-        self.check_server_settings(server)
-        self.check_member_settings(server, member)
-
-        decks = self.settings["Servers"][server.id]["Members"][member.id]["Decks"]
+        decks = self.library.member_decks(server.id, member.id)
 
         if not len(decks):
             if member_is_author:
@@ -374,10 +654,10 @@ class Deck:
 
         deck_id = 1
         results_max = 3
-        for k, deck in decks.items():
+        for deck in decks:
             await self.upload_deck_image(
-                ctx, deck["Deck"], deck["DeckName"], member,
-                description="**{}**. {}".format(deck_id, deck["DeckName"]))
+                ctx, deck.cards, deck.name, member,
+                description="**{}**. {}".format(deck_id, deck.name))
             deck_id += 1
 
             if (deck_id - 1) % results_max == 0:
@@ -402,23 +682,19 @@ class Deck:
         server = ctx.message.server
         if not member:
             member = author
-        self.check_server_settings(server)
-        members = self.settings["Servers"][server.id]["Members"]
-        if not member.id in members:
+        if not self.library.member_decks(server.id, member.id):
             await self.bot.say("You have not added any decks.")
         elif deck_id is None:
             await self.bot.say("You must enter a deck id.")
         elif not deck_id.isdigit():
             await self.bot.say("The deck_id you have entered is not a number.")
         else:
-            deck_id = int(deck_id) - 1
-            decks = members[member.id]["Decks"]
-            for i, deck in enumerate(decks.values()):
-                if i == deck_id:
-                    await self.deck_upload(ctx, deck["Deck"],
-                                           deck["DeckName"], member)
-                    # generate link
-                    await self.decklink(ctx, deck["Deck"])
+            deck = self.library.member_deck(
+                server.id, member.id, int(deck_id) - 1)
+            if deck is not None:
+                await self.deck_upload(ctx, deck.cards, deck.name, member)
+                # generate link
+                await self.decklink(ctx, deck.cards)
 
     async def decklink(self, ctx, deck_cards):
         """Show deck link depending on settings."""
@@ -473,7 +749,6 @@ class Deck:
     async def deck_search(self, ctx, *params):
         """Search all decks by cards."""
         server = ctx.message.server
-        server_members = self.settings["Servers"][server.id]["Members"]
 
         if not len(params):
             await self.bot.say("You must enter at least one card to search.")
@@ -482,25 +757,7 @@ class Deck:
             # normalize params
             params = self.normalize_deck_data(params)
 
-            found_decks = []
-
-            for k, server_member in server_members.items():
-                member_decks = server_member["Decks"]
-                member_id = server_member["MemberID"]
-                member_display_name = server_member["MemberDisplayName"]
-                member = server.get_member(member_id)
-                for k, member_deck in member_decks.items():
-                    cards = member_deck["Deck"]
-                    # await self.bot.say(set(params))
-                    if set(params) < set(cards):
-                        found_decks.append({
-                            "UTC": k,
-                            "Deck": member_deck["Deck"],
-                            "DeckName": member_deck["DeckName"],
-                            "Member": member,
-                            "MemberDisplayName": member_display_name})
-            found_decks = sorted(
-                found_decks, key=lambda x: x["UTC"], reverse=True)
+            found_decks = self.library.search(server.id, params)
 
             await self.bot.say("Found {} decks".format(len(found_decks)))
 
@@ -511,14 +768,13 @@ class Deck:
                 deck_id = 1
 
                 for deck in found_decks:
-                    timestamp = deck["UTC"][:19]
+                    timestamp = deck.utc[:19]
 
                     description = "**{}. {}** by {} — {}".format(
-                        deck_id, deck["DeckName"],
-                        deck["MemberDisplayName"],
-                        timestamp)
+                        deck_id, deck.name, deck.member_name, timestamp)
                     await self.upload_deck_image(
-                        ctx, deck["Deck"], deck["DeckName"], deck["Member"],
+                        ctx, deck.cards, deck.name,
+                        server.get_member(deck.member_id),
                         description=description)
 
                     deck_id += 1
@@ -551,27 +807,20 @@ class Deck:
         server = ctx.message.server
         author = ctx.message.author
 
-        members = self.settings["Servers"][server.id]["Members"]
-
         # check member has data
-        if author.id not in members:
-            self.bot.say("You have not added any decks.")
+        if not self.library.member_decks(server.id, author.id):
+            await self.bot.say("You have not added any decks.")
         elif not deck_id.isdigit():
             await self.bot.say("The deck_id you have entered is not a number.")
         else:
-            deck_id = int(deck_id) - 1
-            member = members[author.id]
-            decks = member["Decks"]
-            if deck_id >= len(decks):
+            deck = self.library.member_deck(
+                server.id, author.id, int(deck_id) - 1)
+            if deck is None:
                 await self.bot.say("The deck id you have entered is invalid.")
             else:
-                for i, deck in enumerate(decks.values()):
-                    if deck_id == i:
-                        # await self.bot.say(deck["DeckName"])
-                        deck["DeckName"] = new_name
-                        await self.bot.say("Deck renamed to {}.".format(new_name))
-                        await self.deck_upload(ctx, deck["Deck"], new_name, author)
-                        self.save_settings()
+                self.library.rename(deck.id, new_name)
+                await self.bot.say("Deck renamed to {}.".format(new_name))
+                await self.deck_upload(ctx, deck.cards, new_name, author)
 
     @deck.command(name="remove", pass_context=True, no_pm=True)
     async def deck_remove(self, ctx, deck_id):
@@ -579,26 +828,18 @@ class Deck:
         server = ctx.message.server
         author = ctx.message.author
 
-        members = self.settings["Servers"][server.id]["Members"]
-
-        if not author.id in members:
+        if not self.library.member_decks(server.id, author.id):
             await self.bot.say("You have not added any decks.")
         elif not deck_id.isdigit():
             await self.bot.say("The deck_id you have entered is not a number.")
         else:
             deck_id = int(deck_id) - 1
-            member = members[author.id]
-            decks = member["Decks"]
-            if deck_id >= len(decks):
+            deck = self.library.member_deck(server.id, author.id, deck_id)
+            if deck is None:
                 await self.bot.say("The deck id you have entered is invalid.")
             else:
-                remove_key = ""
-                for i, key in enumerate(decks.keys()):
-                    if deck_id == i:
-                        remove_key = key
-                decks.pop(remove_key)
+                self.library.remove(deck.id)
                 await self.bot.say("Deck {} removed.".format(deck_id + 1))
-                self.save_settings()
 
     @deck.command(name="help", pass_context=True, no_pm=True)
     async def deck_help(self, ctx):
@@ -615,7 +856,6 @@ class Deck:
             member = author
 
         self.check_server_settings(server)
-        self.check_member_settings(server, author)
 
         member_deck = self.normalize_deck_data(member_deck)
 
@@ -646,65 +886,32 @@ class Deck:
 
     async def upload_deck_image(self, ctx, deck, deck_name, author, description=""):
         """Upload deck image to the server."""
-
-        deck_image = await self.bot.loop.run_in_executor(
-            self.threadex,
-            self.get_deck_image,
-            deck, deck_name, author
-        )
+        deck_author_name = author.name if author else ""
+        average_elixir = self.get_average_elixir(deck)
+
+        png = self.deck_image.get_cached(
+            deck, deck_name, deck_author_name, average_elixir)
+        if png is None:
+            png = await self.bot.loop.run_in_executor(
+                self.threadex,
+                self.deck_image.render,
+                deck, deck_name, deck_author_name, average_elixir
+            )
 
         # construct a filename using first three letters of each card
         filename = "deck-{}.png".format("-".join([card[:3] for card in deck]))
 
         message = None
 
-        with io.BytesIO() as f:
-            deck_image.save(f, "PNG")
-            f.seek(0)
+        with io.BytesIO(png) as f:
             message = await ctx.bot.send_file(
                 ctx.message.channel, f,
                 filename=filename, content=description)
 
         return message
 
-    def get_deck_image(self, deck, deck_name=None, deck_author=None):
-        """Construct the deck with Pillow and return image."""
-        card_w = 302
-        card_h = 363
-        card_x = 30
-        card_y = 30
-        font_size = 50
-        txt_y_line1 = 430
-        txt_y_line2 = 500
-        txt_x_name = 50
-        txt_x_cards = 503
-        txt_x_elixir = 1872
-
-        bg_image = Image.open("data/deck/img/deck-bg-b.png")
-        size = bg_image.size
-
-        font_file_regular = "data/deck/fonts/OpenSans-Regular.ttf"
-        font_file_bold = "data/deck/fonts/OpenSans-Bold.ttf"
-
-        image = Image.new("RGBA", size)
-        image.paste(bg_image)
-
-        if not deck_name:
-            deck_name = "Deck"
-
-        # cards
-        for i, card in enumerate(deck):
-            card_image_file = "data/deck/img/cards/{}.png".format(card)
-            card_image = Image.open(card_image_file)
-            # size = (card_w, card_h)
-            # card_image.thumbnail(size)
-            box = (card_x + card_w * i,
-                   card_y,
-                   card_x + card_w * (i + 1),
-                   card_h + card_y)
-            image.paste(card_image, box, card_image)
-
-        # elixir
+    def get_average_elixir(self, deck):
+        """Average elixir of deck as string."""
         total_elixir = 0
         # total card exclude mirror (0-elixir cards)
         card_count = 0
@@ -715,54 +922,7 @@ class Deck:
                 if card["elixir"]:
                     card_count += 1
 
-        average_elixir = "{:.3f}".format(total_elixir / card_count)
-
-        # text
-        # Take out hyphnens and capitlize the name of each card
-        card_names = [string.capwords(c.replace('-', ' ')) for c in deck]
-
-        txt = Image.new("RGBA", size)
-        txt_name = Image.new("RGBA", (txt_x_cards - 30, size[1]))
-        font_regular = ImageFont.truetype(font_file_regular, size=font_size)
-        font_bold = ImageFont.truetype(font_file_bold, size=font_size)
-
-        d = ImageDraw.Draw(txt)
-        d_name = ImageDraw.Draw(txt_name)
-
-        line1 = ', '.join(card_names[:4])
-        line2 = ', '.join(card_names[4:])
-        # card_text = '\n'.join([line0, line1])
-
-        deck_author_name = deck_author.name if deck_author else ""
-
-        d_name.text(
-            (txt_x_name, txt_y_line1), deck_name, font=font_bold,
-            fill=(0xff, 0xff, 0xff, 255))
-        d_name.text(
-            (txt_x_name, txt_y_line2), deck_author_name, font=font_regular,
-            fill=(0xff, 0xff, 0xff, 255))
-        d.text(
-            (txt_x_cards, txt_y_line1), line1, font=font_regular,
-            fill=(0xff, 0xff, 0xff, 255))
-        d.text(
-            (txt_x_cards, txt_y_line2), line2, font=font_regular,
-            fill=(0xff, 0xff, 0xff, 255))
-        d.text(
-            (txt_x_elixir, txt_y_line1), "Avg elixir", font=font_bold,
-            fill=(0xff, 0xff, 0xff, 200))
-        d.text(
-            (txt_x_elixir, txt_y_line2), average_elixir, font=font_bold,
-            fill=(0xff, 0xff, 0xff, 255))
-
-        image.paste(txt, (0, 0), txt)
-        image.paste(txt_name, (0, 0), txt_name)
-
-        # scale down and return
-        scale = 0.5
-        scaled_size = tuple([x * scale for x in image.size])
-        image.thumbnail(scaled_size)
-
-        return image
+        return "{:.3f}".format(total_elixir / card_count)
 
     def normalize_deck_data(self, deck):
         """Return a deck list with normalized names."""
@@ -775,22 +935,12 @@ class Deck:
 
         return deck
 
-    def check_member_settings(self, server, member):
-        """Init member section if necessary."""
-        if member.id not in self.settings["Servers"][server.id]["Members"]:
-            self.settings["Servers"][server.id]["Members"][member.id] = {
-                "MemberID": member.id,
-                "MemberDisplayName": member.display_name,
-                "Decks": {}}
-            self.save_settings()
-
     def check_server_settings(self, server):
         """Init server data if necessary."""
         if server.id not in self.settings["Servers"]:
             self.settings["Servers"][server.id] = {
                 "ServerName": str(server),
-                "ServerID": str(server.id),
-                "Members": {}}
+                "ServerID": str(server.id)}
             self.save_settings()
 
     def save_settings(self):
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2017 SML
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from discord.ext import commands
+from discord.ext.commands import Context
+
+from cogs.utils import checks
+from cogs.utils.chat_formatting import box
+
+
+def build_index(bot):
+    """Return dict of emoji name to emoji for all servers the bot is in.
+
+    If names collide, the first emoji found wins.
+    """
+    emojis = {}
+    for emoji in bot.get_all_emojis():
+        emojis.setdefault(emoji.name, emoji)
+    return emojis
+
+
+class EmojiIndex:
+    """Shared index of bot emojis by name.
+
+    Built on first use and reset when servers or server emojis change,
+    so that cogs do not scan every server's emojis on each lookup.
+
+    Usage from another cog:
+
+        index = self.bot.get_cog("EmojiIndex")
+        emoji = index.emojis.get(name)
+    """
+
+    def __init__(self, bot):
+        """Init."""
+        self.bot = bot
+        self._emojis = None
+
+    @property
+    def emojis(self):
+        """Emojis by name."""
+        if self._emojis is None:
+            self._emojis = build_index(self.bot)
+        return self._emojis
+
+    def reset(self):
+        """Reset emoji index."""
+        self._emojis = None
+
+    async def on_ready(self):
+        """Event: on_ready."""
+        self.reset()
+
+    async def on_server_join(self, server):
+        """Event: on_server_join."""
+        self.reset()
+
+    async def on_server_remove(self, server):
+        """Event: on_server_remove."""
+        self.reset()
+
+    async def on_server_emojis_update(self, before, after):
+        """Event: on_server_emojis_update."""
+        self.reset()
+
+    @commands.group(pass_context=True)
+    @checks.is_owner()
+    async def emojiindex(self, ctx: Context):
+        """Shared emoji index."""
+        if ctx.invoked_subcommand is None:
+            await self.bot.send_cmd_help(ctx)
+
+    @emojiindex.command(name="stats", pass_context=True)
+    async def emojiindex_stats(self, ctx: Context):
+        """Show number of indexed emojis."""
+        await self.bot.say(box("{:<12}{}".format("emojis", len(self.emojis))))
+
+    @emojiindex.command(name="reset", pass_context=True)
+    async def emojiindex_reset(self, ctx: Context):
+        """Rebuild the index on next lookup."""
+        self.reset()
+        await self.bot.say("Emoji index reset.")
+
+
+def setup(bot):
+    bot.add_cog(EmojiIndex(bot))
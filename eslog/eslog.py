@@ -25,11 +25,14 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import argparse
+import asyncio
 import datetime as dt
 import itertools
+import logging
 import os
 import pprint
 import re
+import time
 from collections import Counter, OrderedDict, defaultdict
 from datetime import timedelta
 from random import choice
@@ -39,6 +42,9 @@ from __main__ import send_cmd_help
 from discord import Member
 from discord import Message
 from discord.ext import commands
+from elasticsearch import ConnectionError as ESConnectionError
+from elasticsearch import TransportError
+from elasticsearch.helpers import streaming_bulk
 from elasticsearch_dsl import DocType, Date, Nested, Boolean, \
     analyzer, Keyword, Text, Integer
 from elasticsearch_dsl import FacetedSearch, TermsFacet
@@ -54,9 +60,21 @@ connections.create_connection(hosts=['localhost'], timeout=20)
 
 INTERVAL = timedelta(hours=4).seconds
 
+# bulk indexing
+BULK_QUEUE_SIZE = 10000
+BULK_SIZE = 500
+# seconds
+BULK_INTERVAL = 5
+BULK_RETRIES = 3
+BULK_RETRY_BACKOFF = 1
+# per-document statuses from the bulk API worth retrying
+BULK_RETRY_STATUSES = [429, 503]
+
 PATH = os.path.join('data', 'keenlog')
 JSON = os.path.join(PATH, 'settings.json')
 
+log = logging.getLogger("red.eslog")
+
 EMOJI_P = re.compile('\<\:.+?\:\d+\>')
 UEMOJI_P = re.compile(u'['
                       u'\U0001F300-\U0001F64F'
@@ -183,9 +201,9 @@ class MessageDoc(DocType):
         doc_type = 'message'
 
     @classmethod
-    def log(cls, message, **kwargs):
-        """Log all."""
-        doc = MessageDoc(
+    def from_message(cls, message):
+        """Document from message."""
+        doc = cls(
             content=message.content,
             embeds=message.embeds,
             attachments=message.attachments,
@@ -196,7 +214,22 @@ class MessageDoc(DocType):
         doc.set_channel(message.channel)
         doc.set_author(message.author)
         doc.set_mentions(message.mentions)
-        doc.save(**kwargs)
+        return doc
+
+    @classmethod
+    def log(cls, message, **kwargs):
+        """Log all."""
+        cls.from_message(message).save(**kwargs)
+
+    def bulk_action(self, index):
+        """Action for the bulk API."""
+        return {
+            '_index': index,
+            '_type': self._doc_type.name,
+            # resending a batch which ES already applied overwrites
+            '_id': self.id,
+            '_source': self.to_dict()
+        }
 
     def set_author(self, author):
         """Set author."""
@@ -232,22 +265,6 @@ class MessageDeleteDoc(MessageDoc):
     class Meta:
         doc_type = 'message_delete'
 
-    @classmethod
-    def log(cls, message, **kwargs):
-        """Log all."""
-        doc = MessageDeleteDoc(
-            content=message.content,
-            embeds=message.embeds,
-            attachments=message.attachments,
-            id=message.id,
-            timestamp=dt.datetime.utcnow()
-        )
-        doc.set_server(message.server)
-        doc.set_channel(message.channel)
-        doc.set_author(message.author)
-        doc.set_mentions(message.mentions)
-        doc.save(**kwargs)
-
     def save(self, **kwargs):
         return super(MessageDeleteDoc, self).save(**kwargs)
 
@@ -260,14 +277,130 @@ class MessageAuthorSearch(FacetedSearch):
     }
 
 
+class BulkIndexer:
+    """Background bulk indexer.
+
+    Documents are queued as bulk actions and sent to ES by a single
+    worker whenever BULK_SIZE actions are waiting or BULK_INTERVAL has
+    passed. The blocking bulk request runs in an executor. When the
+    queue is full, new actions are dropped and counted instead of
+    holding up the event handlers.
+
+    The batch being collected is kept on the indexer so that close()
+    can send it along with whatever is still queued.
+    """
+
+    def __init__(self, bot, client=None):
+        """Init."""
+        self.bot = bot
+        self.client = client or connections.get_connection()
+        self.queue = asyncio.Queue(maxsize=BULK_QUEUE_SIZE, loop=bot.loop)
+        self.stats = Counter()
+        self.batch = []
+        self.task = bot.loop.create_task(self.worker())
+
+    def put(self, action):
+        """Queue bulk action."""
+        try:
+            self.queue.put_nowait(action)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+        else:
+            self.stats['queued'] += 1
+
+    @property
+    def pending(self):
+        """Number of actions not yet sent."""
+        return len(self.batch) + self.queue.qsize()
+
+    def get_batch(self):
+        """Take the batch in progress, topped up to BULK_SIZE from the queue."""
+        actions, self.batch = self.batch, []
+        while len(actions) < BULK_SIZE and not self.queue.empty():
+            actions.append(self.queue.get_nowait())
+        return actions
+
+    async def worker(self):
+        """Flush queue by size or time."""
+        loop = self.bot.loop
+        while True:
+            actions = []
+            try:
+                self.batch.append(await self.queue.get())
+                deadline = loop.time() + BULK_INTERVAL
+                while len(self.batch) < BULK_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        self.batch.append(await asyncio.wait_for(
+                            self.queue.get(), timeout, loop=loop))
+                    except asyncio.TimeoutError:
+                        break
+                actions, self.batch = self.batch, []
+                await loop.run_in_executor(None, self.send, actions)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # keep the worker alive for the next batch
+                log.exception("Bulk indexing failed.")
+                self.stats['failed'] += len(actions)
+
+    def send(self, actions):
+        """Send actions with the bulk API, retrying on transient errors.
+
+        A failed request is retried as a whole. Documents rejected with
+        a status in BULK_RETRY_STATUSES are retried on their own; other
+        document errors are counted as failed.
+        """
+        for attempt in range(BULK_RETRIES + 1):
+            if attempt:
+                self.stats['retries'] += 1
+                time.sleep(BULK_RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                results = list(streaming_bulk(
+                    self.client, actions, chunk_size=len(actions),
+                    raise_on_error=False))
+            except (ESConnectionError, TransportError):
+                continue
+            self.stats['batches'] += 1
+            retry = []
+            for action, (ok, item) in zip(actions, results):
+                if ok:
+                    self.stats['indexed'] += 1
+                elif self.item_status(item) in BULK_RETRY_STATUSES:
+                    retry.append(action)
+                else:
+                    self.stats['failed'] += 1
+            if not retry:
+                return
+            actions = retry
+        self.stats['failed'] += len(actions)
+
+    @staticmethod
+    def item_status(item):
+        """HTTP status of a bulk response item."""
+        for result in item.values():
+            return result.get('status')
+
+    def close(self):
+        """Stop worker and flush the batch in progress and the queue."""
+        self.task.cancel()
+        actions = self.get_batch()
+        while actions:
+            self.send(actions)
+            actions = self.get_batch()
+
+
 class ESLogger:
     """Elastic Search Logging v2.
     
     Separated into own class to make migration easier.
     """
 
-    def __init__(self, index_name_fmt=None):
+    def __init__(self, index_name_fmt=None, indexer=None):
         self.index_name_fmt = index_name_fmt
+        self.indexer = indexer
 
     @property
     def index_name(self):
@@ -287,11 +420,13 @@ class ESLogger:
 
     def log_message(self, message: Message):
         """Log message v2."""
-        MessageDoc.log(message, index=self.index_name)
+        doc = MessageDoc.from_message(message)
+        self.indexer.put(doc.bulk_action(self.index_name))
 
     def log_message_delete(self, message: Message):
         """Log deleted message."""
-        MessageDeleteDoc.log(message, index=self.index_name)
+        doc = MessageDeleteDoc.from_message(message)
+        self.indexer.put(doc.bulk_action(self.index_name))
 
     @staticmethod
     def parser():
@@ -399,26 +534,13 @@ class ESLogView:
 
         return em
 
-    def embed_members(self, server=None, results=None, p_args=None):
-        """Results by members"""
-        results = sorted(results, key=lambda x: x["timestamp"])
-
-        count = 10
-        if p_args.count is not None:
-            count = p_args.count
-
-        most_common_author_ids = Counter([r["doc"].author.id for r in results]).most_common(count)
-
-        # split results in channel ids by count
-        author_channels = nested_dict()
-        for author_id, count in most_common_author_ids:
-            channel_ids = []
-            for result in results:
-                doc = result["doc"]
-                if doc.author.id == author_id:
-                    channel_ids.append(doc.channel.id)
-            author_channels[author_id] = Counter(channel_ids).most_common()
+    def embed_members(self, server=None, author_counts=None,
+                      author_channels=None, p_args=None):
+        """Results by members.
 
+        author_counts is a list of (author_id, count) sorted by count
+        and author_channels maps author IDs to (channel_id, count).
+        """
         # embed
         embed = discord.Embed(
             title="{}: User activity by messages".format(server.name),
@@ -427,7 +549,7 @@ class ESLogView:
         )
 
         max_count = 0
-        for rank, (author_id, count) in enumerate(most_common_author_ids, 1):
+        for rank, (author_id, count) in enumerate(author_counts, 1):
             max_count = max(count, max_count)
             # author name
             author = server.get_member(author_id)
@@ -497,12 +619,24 @@ class MessageDocSearch:
         time_gte = 'now-{}'.format(time)
         return Range(timestamp={'gte': time_gte, 'lt': 'now'})
 
+    def server_search(self, server, time):
+        """Server messages during this period, with no hits returned.
+
+        Used as the base for aggregations so that only bucket counts
+        are sent back by ES.
+        """
+        return self.search \
+            .query(self.time_range(time)) \
+            .query(Match(**{'server.id': server.id})) \
+            .extra(size=0)
+
     def active_members(self, server, time):
         """Number of active users during this period."""
-        s = self.search \
-            .query(self.time_range(time)) \
-            .query(Match(**{'server.id': server.id}))
-        return len(set([doc.author.id for doc in s.scan()]))
+        s = self.server_search(server, time)
+        s.aggs.metric(
+            'active_members', 'cardinality',
+            field='author.id.keyword', precision_threshold=40000)
+        return s.execute().aggregations.active_members.value
 
     def author_lastseen(self, author):
         """Last known date where author has send a message."""
@@ -516,15 +650,20 @@ class MessageDocSearch:
             return hit.timestamp
 
     def author_rank(self, author, time):
-        """Author’s activity rank on a server."""
-        s = self.search \
-            .query(self.time_range(time)) \
-            .query(Match(**{'server.id': author.server.id}))
+        """Author’s activity rank on a server.
 
-        author_ids = [doc.author.id for doc in s.scan()]
-        counter = Counter(author_ids)
-        for rank, (author_id, count) in enumerate(counter.most_common(), 1):
-            if author_id == author.id:
+        Only authors with at least as many messages are bucketed.
+        """
+        message_count = self.author_messages_count(author, time)
+        if not message_count:
+            return 0
+        s = self.server_search(author.server, time)
+        s.aggs.bucket(
+            'authors', 'terms', field='author.id.keyword',
+            size=len(author.server.members), min_doc_count=message_count)
+        buckets = s.execute().aggregations.authors.buckets
+        for rank, bucket in enumerate(buckets, 1):
+            if bucket.key == author.id:
                 return rank
         return 0
 
@@ -545,13 +684,33 @@ class MessageDocSearch:
         
         Return as OrderedDict with channel IDs and count.
         """
-        s = self.author_messages_search(author, time)
-        channel_ids = [doc.to_dict()["channel"]["id"] for doc in s.scan()]
+        s = self.author_messages_search(author, time).extra(size=0)
+        s.aggs.bucket(
+            'channels', 'terms', field='channel.id.keyword',
+            size=len(author.server.channels))
         channels = OrderedDict()
-        for channel_id, count in Counter(channel_ids).most_common():
-            channels[channel_id] = count
+        for bucket in s.execute().aggregations.channels.buckets:
+            channels[bucket.key] = bucket.doc_count
         return channels
 
+    def author_channel_counts(self, s, count, channel_count):
+        """Top authors in search with their message counts by channel.
+
+        Return list of (author_id, count) and dict of author ID to
+        list of (channel_id, count).
+        """
+        s = s.extra(size=0)
+        s.aggs.bucket(
+            'authors', 'terms', field='author.id.keyword', size=count) \
+            .bucket('channels', 'terms', field='channel.id.keyword', size=channel_count)
+        author_counts = []
+        author_channels = {}
+        for bucket in s.execute().aggregations.authors.buckets:
+            author_counts.append((bucket.key, bucket.doc_count))
+            author_channels[bucket.key] = [
+                (b.key, b.doc_count) for b in bucket.channels.buckets]
+        return author_counts, author_channels
+
     def server_messages(self, server, parser_args):
         """all of server messages."""
         time = parser_args.time
@@ -648,15 +807,30 @@ class ESLog:
         """Init."""
         self.bot = bot
         self.message_search = MessageDocSearch(index="discord-*")
-        self.eslogger = ESLogger(index_name_fmt='discord-{}')
+        self.indexer = BulkIndexer(bot)
+        self.eslogger = ESLogger(index_name_fmt='discord-{}', indexer=self.indexer)
         self.view = ESLogView(bot)
 
+    def __unload(self):
+        self.indexer.close()
+
     @commands.group(pass_context=True, no_pm=True)
     async def eslogset(self, ctx):
         """ES Log settings."""
         if ctx.invoked_subcommand is None:
             await send_cmd_help(ctx)
 
+    @eslogset.command(name="bulkstats", pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def eslogset_bulkstats(self, ctx):
+        """Bulk indexer statistics."""
+        stats = self.indexer.stats
+        out = ["{:<10}{}".format("pending", self.indexer.pending)]
+        out.extend(
+            "{:<10}{}".format(k, stats[k])
+            for k in ['queued', 'indexed', 'batches', 'retries', 'failed', 'dropped'])
+        await self.bot.say(box('\n'.join(out)))
+
     @eslogset.command(name="logall", pass_context=True, no_pm=True)
     async def eslogset_logall(self, ctx):
         """Log all gauges."""
@@ -833,18 +1007,15 @@ class ESLog:
 
         # s = self.message_search.server_messages(server, p_args)
 
-        results = [{
-            "author_id": doc.author.id,
-            "channel_id": doc.channel.id,
-            "timestamp": doc.timestamp,
-            "rng_index": None,
-            "rng_timestamp": None,
-            "doc": doc
-        } for doc in s.scan()]
+        count = 10
+        if p_args.count is not None:
+            count = p_args.count
 
-        server = ctx.message.server
+        author_counts, author_channels = self.message_search.author_channel_counts(
+            s, count, len(server.channels))
 
-        embed = self.view.embed_members(server, results, p_args)
+        embed = self.view.embed_members(
+            server, author_counts, author_channels, p_args)
         await self.bot.say(embed=embed)
 
     @eslog.command(name="userheatmap", pass_context=True, no_pm=True)
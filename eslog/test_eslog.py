@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the ESLog aggregation queries.
+
+MessageDocSearch is given a fake ES client which records each request
+body and returns a canned response, so no ES server is needed. Run with
+the Red root on PYTHONPATH so that cogs.utils is importable.
+"""
+
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+import __main__
+
+pytest.importorskip("discord")
+pytest.importorskip("elasticsearch_dsl")
+pytest.importorskip("cogs.utils.dataIO")
+
+# provided by red.py at runtime
+if not hasattr(__main__, "send_cmd_help"):
+    __main__.send_cmd_help = None
+
+from eslog import MessageDocSearch  # noqa: E402
+
+
+class FakeES:
+    """ES client returning canned responses in order."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.bodies = []
+
+    def search(self, index=None, body=None, **kwargs):
+        self.bodies.append(body)
+        return self.responses.pop(0)
+
+    def count(self, index=None, body=None, **kwargs):
+        self.bodies.append(body)
+        return self.responses.pop(0)
+
+
+def search_response(aggregations):
+    return {
+        "took": 1,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "failed": 0},
+        "hits": {"total": 0, "max_score": None, "hits": []},
+        "aggregations": aggregations
+    }
+
+
+def terms(*buckets):
+    return {
+        "doc_count_error_upper_bound": 0,
+        "sum_other_doc_count": 0,
+        "buckets": list(buckets)
+    }
+
+
+def bucket(key, doc_count, **sub_aggs):
+    b = {"key": key, "doc_count": doc_count}
+    b.update(sub_aggs)
+    return b
+
+
+@pytest.fixture
+def server():
+    return SimpleNamespace(
+        id="100",
+        members=[object()] * 5,
+        channels=[object()] * 3)
+
+
+@pytest.fixture
+def author(server):
+    return SimpleNamespace(id="2", server=server)
+
+
+def test_active_members(server):
+    es = FakeES(search_response({"active_members": {"value": 42}}))
+    search = MessageDocSearch(using=es)
+
+    assert search.active_members(server, "7d") == 42
+
+    body = es.bodies[0]
+    assert body["size"] == 0
+    assert body["aggs"]["active_members"]["cardinality"]["field"] == "author.id.keyword"
+    assert {"match": {"server.id": "100"}} in body["query"]["bool"]["must"]
+
+
+def test_author_rank(author):
+    es = FakeES(
+        {"count": 7},
+        search_response({"authors": terms(
+            bucket("1", 12),
+            bucket("2", 7),
+            bucket("3", 7))}))
+    search = MessageDocSearch(using=es)
+
+    assert search.author_rank(author, "7d") == 2
+
+    aggs = es.bodies[1]["aggs"]["authors"]["terms"]
+    assert aggs["field"] == "author.id.keyword"
+    assert aggs["min_doc_count"] == 7
+    assert aggs["size"] == 5
+
+
+def test_author_rank_no_messages(author):
+    es = FakeES({"count": 0})
+    search = MessageDocSearch(using=es)
+
+    assert search.author_rank(author, "7d") == 0
+    # no aggregation is sent when the author has no messages
+    assert len(es.bodies) == 1
+
+
+def test_author_channels(author):
+    es = FakeES(search_response({"channels": terms(
+        bucket("10", 5),
+        bucket("11", 2))}))
+    search = MessageDocSearch(using=es)
+
+    channels = search.author_channels(author, "7d")
+
+    assert channels == OrderedDict([("10", 5), ("11", 2)])
+    assert list(channels.keys()) == ["10", "11"]
+    body = es.bodies[0]
+    assert body["size"] == 0
+    assert body["aggs"]["channels"]["terms"]["field"] == "channel.id.keyword"
+    assert body["aggs"]["channels"]["terms"]["size"] == 3
+
+
+def test_author_channel_counts(server):
+    es = FakeES(search_response({"authors": terms(
+        bucket("1", 8, channels=terms(bucket("10", 6), bucket("11", 2))),
+        bucket("2", 3, channels=terms(bucket("11", 3))))}))
+    search = MessageDocSearch(using=es)
+
+    author_counts, author_channels = search.author_channel_counts(
+        search.server_search(server, "7d"), 2, 3)
+
+    assert author_counts == [("1", 8), ("2", 3)]
+    assert author_channels == {
+        "1": [("10", 6), ("11", 2)],
+        "2": [("11", 3)]
+    }
+    aggs = es.bodies[0]["aggs"]["authors"]
+    assert aggs["terms"] == {"field": "author.id.keyword", "size": 2}
+    assert aggs["aggs"]["channels"]["terms"] == {
+        "field": "channel.id.keyword", "size": 3}
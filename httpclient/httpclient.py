@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2017 SML
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import asyncio
+import json
+import os
+from collections import Counter
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from discord.ext import commands
+from discord.ext.commands import Context
+
+from cogs.utils import checks
+from cogs.utils.chat_formatting import box
+from cogs.utils.dataIO import dataIO
+
+PATH = os.path.join("data", "httpclient")
+JSON = os.path.join(PATH, "settings.json")
+
+# total connections kept in the pool
+POOL_LIMIT = 100
+# concurrent requests per host
+HOST_LIMIT = 10
+# seconds
+TIMEOUT = 30
+RETRIES = 2
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = [500, 502, 503, 504]
+
+HTTPResponse = namedtuple("HTTPResponse", ["status", "body"])
+
+
+class SessionHTTP:
+    """Stand-in for the HTTPClient cog using a one-off session per request.
+
+    Used by API cogs when the HTTPClient cog is not loaded.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    async def get(self, url, headers=None, timeout=None, retries=None):
+        async with aiohttp.ClientSession(loop=self.loop) as session:
+            async with session.get(url, headers=headers, timeout=timeout) as resp:
+                body = await resp.read()
+                return HTTPResponse(status=resp.status, body=body)
+
+    async def get_json(self, url, headers=None, timeout=None, retries=None):
+        response = await self.get(url, headers=headers, timeout=timeout)
+        return response.status, json.loads(response.body.decode("utf-8"))
+
+
+class HTTPClient:
+    """Shared HTTP client.
+
+    Owns one long-lived aiohttp session with a bounded connection pool
+    so that API cogs do not pay connection setup on every request.
+
+    Usage from another cog:
+
+        http = self.bot.get_cog("HTTPClient")
+        status, data = await http.get_json(url, headers=headers)
+    """
+
+    def __init__(self, bot):
+        """Init."""
+        self.bot = bot
+        self.settings = dataIO.load_json(JSON)
+        self.session = self.create_session()
+        self.semaphores = {}
+        self.stats = Counter()
+
+    def __unload(self):
+        self.session.close()
+
+    def save(self):
+        dataIO.save_json(JSON, self.settings)
+
+    def create_session(self):
+        """Create session with a bounded, keep-alive connection pool."""
+        connector = aiohttp.TCPConnector(
+            limit=self.settings["POOL_LIMIT"],
+            loop=self.bot.loop)
+        return aiohttp.ClientSession(connector=connector, loop=self.bot.loop)
+
+    def semaphore(self, host):
+        """Semaphore limiting concurrent requests per host."""
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(
+                self.settings["HOST_LIMIT"], loop=self.bot.loop)
+        return self.semaphores[host]
+
+    async def get(self, url, headers=None, timeout=None, retries=None):
+        """GET url and return HTTPResponse.
+
+        Timeouts, client errors such as dropped connections and 5xx
+        responses are retried with exponential backoff. Raise
+        asyncio.TimeoutError or aiohttp.ClientError if all attempts fail.
+        """
+        if timeout is None:
+            timeout = self.settings["TIMEOUT"]
+        if retries is None:
+            retries = self.settings["RETRIES"]
+        host = urlsplit(url).netloc
+
+        attempt = 0
+        while True:
+            self.stats["requests"] += 1
+            try:
+                async with self.semaphore(host):
+                    async with self.session.get(
+                            url, headers=headers, timeout=timeout) as resp:
+                        body = await resp.read()
+                        response = HTTPResponse(status=resp.status, body=body)
+                if response.status not in RETRY_STATUSES or attempt >= retries:
+                    return response
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                self.stats["errors"] += 1
+                if attempt >= retries:
+                    raise
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+    async def get_json(self, url, headers=None, timeout=None, retries=None):
+        """GET url and return (status, data) with data decoded from JSON.
+
+        Raise json.decoder.JSONDecodeError if the body is not valid JSON.
+        """
+        response = await self.get(
+            url, headers=headers, timeout=timeout, retries=retries)
+        data = json.loads(response.body.decode("utf-8"))
+        return response.status, data
+
+    @commands.group(pass_context=True)
+    @checks.is_owner()
+    async def httpclient(self, ctx: Context):
+        """Shared HTTP client."""
+        if ctx.invoked_subcommand is None:
+            await self.bot.send_cmd_help(ctx)
+
+    @httpclient.command(name="stats", pass_context=True)
+    async def httpclient_stats(self, ctx: Context):
+        """Show request statistics."""
+        out = [
+            "{:<12}{}".format(k, self.settings[k])
+            for k in ["POOL_LIMIT", "HOST_LIMIT", "TIMEOUT", "RETRIES"]]
+        out.append("")
+        out.extend(
+            "{:<12}{}".format(k, self.stats[k])
+            for k in ["requests", "retries", "errors"])
+        await self.bot.say(box("\n".join(out)))
+
+    @httpclient.command(name="timeout", pass_context=True)
+    async def httpclient_timeout(self, ctx: Context, seconds: int):
+        """Set default request timeout in seconds."""
+        self.settings["TIMEOUT"] = seconds
+        self.save()
+        await self.bot.say("Request timeout set to {}s.".format(seconds))
+
+    @httpclient.command(name="retries", pass_context=True)
+    async def httpclient_retries(self, ctx: Context, retries: int):
+        """Set number of retries on transient errors."""
+        self.settings["RETRIES"] = retries
+        self.save()
+        await self.bot.say("Retries set to {}.".format(retries))
+
+    @httpclient.command(name="limit", pass_context=True)
+    async def httpclient_limit(self, ctx: Context, pool: int, host: int):
+        """Set connection pool size and concurrent requests per host."""
+        self.settings["POOL_LIMIT"] = pool
+        self.settings["HOST_LIMIT"] = host
+        self.save()
+        old_session = self.session
+        self.session = self.create_session()
+        self.semaphores = {}
+        old_session.close()
+        await self.bot.say(
+            "Pool limit set to {}, per host limit set to {}.".format(pool, host))
+
+
+def check_folders():
+    if not os.path.exists(PATH):
+        print("Creating %s folder..." % PATH)
+        os.makedirs(PATH)
+
+
+def check_files():
+    defaults = {
+        "POOL_LIMIT": POOL_LIMIT,
+        "HOST_LIMIT": HOST_LIMIT,
+        "TIMEOUT": TIMEOUT,
+        "RETRIES": RETRIES
+    }
+    if not dataIO.is_valid_json(JSON):
+        print("Creating empty %s" % JSON)
+        dataIO.save_json(JSON, defaults)
+
+
+def setup(bot):
+    check_folders()
+    check_files()
+    bot.add_cog(HTTPClient(bot))
@@ -25,8 +25,10 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import argparse
+import asyncio
 import datetime as dt
 import itertools
+import json
 import os
 import pprint
 import re
@@ -51,6 +53,11 @@ INTERVAL = timedelta(hours=4).seconds
 
 PATH = os.path.join('data', 'keenlog')
 JSON = os.path.join(PATH, 'settings.json')
+SPILL = os.path.join(PATH, 'spill.jsonl')
+
+# events are posted to Keen in batches
+FLUSH_INTERVAL = 10
+BATCH_SIZE = 500
 
 EMOJI_P = re.compile('\<\:.+?\:\d+\>')
 UEMOJI_P = re.compile(u'['
@@ -199,6 +206,8 @@ class MemberModel(BaseModel):
 class BaseEventModel:
     """Base event."""
 
+    collection = None
+
     def __init__(self):
         pass
 
@@ -206,9 +215,10 @@ class BaseEventModel:
     def event_dict(self):
         return {}
 
-    def save(self):
-        """Save to keen"""
-        print("please overwrite")
+    def save(self, sink):
+        """Queue Keen event on sink."""
+        if self.collection is not None:
+            sink.add(self.collection, self.event_dict)
 
 
 class MemberEventModel(BaseEventModel):
@@ -225,30 +235,24 @@ class MemberEventModel(BaseEventModel):
             "member": MemberModel(self.member).to_dict()
         }
 
-    def save(self):
-        """Save to Keen."""
-        pass
-
 
 class MemberJoinEventModel(MemberEventModel):
     """Discord member joins server."""
 
-    def save(self):
-        """Save to Keen."""
-        keen.add_event("member_join", self.event_dict)
+    collection = "member_join"
 
 
 class MemberRemoveEventModel(MemberEventModel):
     """Discord member leaves server."""
 
-    def save(self):
-        """Save to Keen."""
-        keen.add_event("member_remove", self.event_dict)
+    collection = "member_remove"
 
 
 class MemberUpdateEventModel(BaseEventModel):
     """Discord member joins server."""
 
+    collection = "member_update"
+
     def __init__(self, before, after):
         """Init."""
         self.before = before
@@ -262,14 +266,12 @@ class MemberUpdateEventModel(BaseEventModel):
             "after": MemberModel(self.after).to_dict()
         }
 
-    def save(self):
-        """Save to Keen."""
-        keen.add_event("member_update", self.event_dict)
-
 
 class MessageEventModel(BaseEventModel):
     """Discord Message."""
 
+    collection = "message"
+
     def __init__(self, message):
         self.message = message
 
@@ -313,22 +315,18 @@ class MessageEventModel(BaseEventModel):
             "attachments": self.message.attachments
         }
 
-    def save(self, **kwargs):
-        """Save to Keen."""
-        keen.add_event("message", self.event_dict)
-
 
 class MessageDeleteEventModel(MessageEventModel):
     """Discord Message Delete."""
 
-    def save(self, **kwargs):
-        """Save to Keen."""
-        keen.add_event("message_delete", self.event_dict)
+    collection = "message_delete"
 
 
 class MessageEditEventModel(BaseEventModel):
     """Discord Message Edit."""
 
+    collection = "message_edit"
+
     def __init__(self, before, after):
         self.before = MessageEventModel(before)
         self.after = MessageEventModel(after)
@@ -341,14 +339,12 @@ class MessageEditEventModel(BaseEventModel):
             "after": self.after.event_dict
         }
 
-    def save(self):
-        """Save Keen event."""
-        keen.add_event("message_edit", self.event_dict)
-
 
 class ServerStatsModel(BaseEventModel):
     """Discord server stats."""
 
+    collection = "server_stats"
+
     def __init__(self, server):
         self.server = server
 
@@ -371,9 +367,126 @@ class ServerStatsModel(BaseEventModel):
             d["channels"][channel.position] = ChannelModel(channel).to_dict()
         return d
 
-    def save(self):
-        """Save keen event."""
-        keen.add_event("server_stats", self.event_dict)
+
+class KeenEventSink:
+    """Batched Keen event sink.
+
+    Events are buffered in memory and posted with keen.add_events from a
+    background task every flush_interval seconds, or sooner when
+    batch_size events are waiting. Batches which cannot be posted are
+    appended to a spill file and retried on the next flush.
+    """
+
+    def __init__(self, bot, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE):
+        """Init."""
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer = defaultdict(list)
+        self.pending = 0
+        self.stats = Counter()
+        self.full = asyncio.Event(loop=bot.loop)
+        self.task = bot.loop.create_task(self.loop_task())
+
+    def add(self, collection, event):
+        """Queue event."""
+        # keep the time the event happened rather than when it is posted
+        event.setdefault("keen", {})["timestamp"] = dt.datetime.utcnow().isoformat()
+        self.buffer[collection].append(event)
+        self.pending += 1
+        self.stats["queued"] += 1
+        if self.pending >= self.batch_size:
+            self.full.set()
+
+    def take(self):
+        """Take buffered events."""
+        events = self.buffer
+        self.buffer = defaultdict(list)
+        self.pending = 0
+        self.full.clear()
+        return events
+
+    async def loop_task(self):
+        """Flush by time or size."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.full.wait(), self.flush_interval, loop=self.bot.loop)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Post buffered and spilled events.
+
+        Spilled events are posted in batch_size chunks like live events.
+        Chunks left when Keen cannot be reached are spilled again.
+        """
+        events = self.take()
+        if events and not await self.post(events):
+            self.spill(events)
+            return
+        batches = self.unspill()
+        for i, batch in enumerate(batches):
+            if not await self.post(batch):
+                for batch in batches[i:]:
+                    self.spill(batch)
+                return
+
+    async def post(self, events):
+        """Post events and return True if Keen was reached."""
+        count = sum(len(v) for v in events.values())
+        try:
+            resp = await self.bot.loop.run_in_executor(
+                None, keen.add_events, dict(events))
+        except Exception:
+            self.stats["failed"] += count
+            return False
+        failed = sum(
+            1 for results in resp.values()
+            for result in results if not result.get("success"))
+        self.stats["sent"] += count - failed
+        self.stats["failed"] += failed
+        return True
+
+    def spill(self, events):
+        """Append events to the spill file."""
+        with open(SPILL, "a") as f:
+            for collection, items in events.items():
+                for event in items:
+                    f.write(json.dumps([collection, event]) + "\n")
+                    self.stats["spilled"] += 1
+
+    def unspill(self):
+        """Read and remove events from the spill file.
+
+        Return list of batches of up to batch_size events.
+        """
+        batches = []
+        if not os.path.exists(SPILL):
+            return batches
+        events = defaultdict(list)
+        count = 0
+        with open(SPILL) as f:
+            for line in f:
+                collection, event = json.loads(line)
+                events[collection].append(event)
+                count += 1
+                if count >= self.batch_size:
+                    batches.append(events)
+                    events = defaultdict(list)
+                    count = 0
+        if count:
+            batches.append(events)
+        os.remove(SPILL)
+        return batches
+
+    def close(self):
+        """Stop task and spill buffered events for the next load."""
+        self.task.cancel()
+        events = self.take()
+        if events:
+            self.spill(events)
 
 
 class KeenLogger:
@@ -585,6 +698,13 @@ class KeenLog:
         keen.project_id = self.settings["keen_project_id"]
         keen.read_key = self.settings["keen_read_key"]
         keen.write_key = self.settings["keen_write_key"]
+        self.sink = KeenEventSink(
+            bot,
+            flush_interval=self.settings.get("flush_interval", FLUSH_INTERVAL),
+            batch_size=self.settings.get("batch_size", BATCH_SIZE))
+
+    def __unload(self):
+        self.sink.close()
 
     @commands.group(pass_context=True)
     async def keenlogset(self, ctx):
@@ -622,10 +742,34 @@ class KeenLog:
         await self.bot.say("Keen.IO settings updated.")
         await self.bot.delete_message(ctx.message)
 
+    @checks.is_owner()
+    @keenlogset.command(name="batch", pass_context=True)
+    async def keenlogset_batch(self, ctx, flush_interval: int, batch_size: int):
+        """Set flush interval in seconds and batch size."""
+        self.settings["flush_interval"] = flush_interval
+        self.settings["batch_size"] = batch_size
+        self.sink.flush_interval = flush_interval
+        self.sink.batch_size = batch_size
+        dataIO.save_json(JSON, self.settings)
+        await self.bot.say(
+            "Flushing events every {}s or every {} events.".format(
+                flush_interval, batch_size))
+
+    @checks.is_owner()
+    @keenlogset.command(name="stats", pass_context=True)
+    async def keenlogset_stats(self, ctx):
+        """Event sink statistics."""
+        stats = self.sink.stats
+        out = ["{:<10}{}".format("pending", self.sink.pending)]
+        out.extend(
+            "{:<10}{}".format(k, stats[k])
+            for k in ["queued", "sent", "failed", "spilled"])
+        await self.bot.say(box("\n".join(out)))
+
     @keenlogset.command(name="test", pass_context=True)
     async def keenlogset_test(self, ctx, a, b):
         """Test keen"""
-        keen.add_event("test", {
+        self.sink.add("test", {
             "a": a,
             "b": b
         })
@@ -634,7 +778,7 @@ class KeenLog:
     async def keenlogset_logall(self, ctx):
         """Log all gauges."""
         for server in self.bot.servers:
-            ServerStatsModel(server).save()
+            ServerStatsModel(server).save(self.sink)
 
         await self.bot.say("Logged all server stats")
 
@@ -928,27 +1072,27 @@ class KeenLog:
 
     async def on_message(self, message: Message):
         """Track on message."""
-        MessageEventModel(message).save()
+        MessageEventModel(message).save(self.sink)
 
     async def on_message_delete(self, message: Message):
         """Track message deletion."""
-        MessageDeleteEventModel(message).save()
+        MessageDeleteEventModel(message).save(self.sink)
 
     async def on_message_edit(self, before: Message, after: Message):
         """Track message editing."""
-        MessageEditEventModel(before, after).save()
+        MessageEditEventModel(before, after).save(self.sink)
 
     async def on_member_join(self, member: Member):
         """Track members joining server."""
-        MemberJoinEventModel(member).save()
+        MemberJoinEventModel(member).save(self.sink)
 
     async def on_member_update(self, before: Member, after: Member):
         """Called when a Member updates their profile."""
-        MemberUpdateEventModel(before, after).save()
+        MemberUpdateEventModel(before, after).save(self.sink)
 
     async def on_member_remove(self, member: Member):
         """Track members leaving server."""
-        MemberRemoveEventModel(member).save()
+        MemberRemoveEventModel(member).save(self.sink)
 
 
 
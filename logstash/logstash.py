@@ -27,6 +27,7 @@ import logging
 import os
 import re
 import json
+from collections import Counter
 from datetime import timedelta
 
 import logstash
@@ -56,6 +57,12 @@ PORT = 5959
 INTERVAL = timedelta(hours=4).seconds
 DB_PATH = os.path.join('data', 'logstash', 'logstash.db')
 
+# gauge sweeps yield to the event loop after this many objects
+GAUGE_CHUNK_SIZE = 1000
+# delta: only log channels / members which changed since the last sweep
+# full: log every channel / member
+GAUGE_MODES = ['delta', 'full']
+
 PATH = os.path.join('data', 'logstash')
 JSON = os.path.join(PATH, 'settings.json')
 
@@ -76,6 +83,12 @@ class Logstash:
         self.bot = bot
         self.settings = dataIO.load_json(JSON)
         self.extra = {}
+        # compact fingerprints of channels and members from the last sweep
+        self.fingerprints = {
+            'channel': {},
+            'member': {}
+        }
+        self.gauge_lock = asyncio.Lock()
         self.task = bot.loop.create_task(self.loop_task())
 
         self.handler = logstash.LogstashHandler(HOST, PORT, version=1)
@@ -106,7 +119,7 @@ class Logstash:
             'bot_id': self.bot.user.id,
             'bot_name': self.bot.user.name
         }
-        self.log_all_gauges()
+        await self.log_all_gauges()
         await asyncio.sleep(INTERVAL)
         if self is self.bot.get_cog('Logstash'):
             self.task = self.bot.loop.create_task(self.loop_task())
@@ -121,9 +134,25 @@ class Logstash:
     @logstash.command(name="all", pass_context=True)
     async def logstash_all(self):
         """Send all stats."""
-        self.log_all_gauges()
+        await self.log_all_gauges()
         await self.bot.say("Logged all.")
 
+    @logstash.command(name="gaugemode", pass_context=True)
+    @checks.is_owner()
+    async def logstash_gaugemode(self, ctx, mode):
+        """Set gauge mode.
+
+        delta: only log channels and members which changed since the last sweep.
+        full: log every channel and member.
+        """
+        if mode not in GAUGE_MODES:
+            await self.bot.say(
+                "Gauge mode must be one of: {}.".format(", ".join(GAUGE_MODES)))
+            return
+        self.settings['gauge_mode'] = mode
+        dataIO.save_json(JSON, self.settings)
+        await self.bot.say("Gauge mode set to {}.".format(mode))
+
     @logstash.command(name="log", pass_context=True)
     async def logstash_log(self, ctx, key, *, json_str):
         """Log an arbitrary event with key an json input.
@@ -180,11 +209,11 @@ class Logstash:
 
     async def on_ready(self):
         """Bot ready."""
-        self.log_all_gauges()
+        await self.log_all_gauges()
 
     async def on_resume(self):
         """Bot resume."""
-        self.log_all_gauges()
+        await self.log_all_gauges()
 
     def get_message_sca(self, message: Message):
         """Return server, channel and author from message."""
@@ -452,16 +481,27 @@ class Logstash:
         extra.update(self.get_mentions_extra(after))
         self.log_discord_event('message.edit', extra)
 
-    def log_all_gauges(self):
-        """Log all gauge values."""
-        self.log_servers()
-        self.log_channels()
-        self.log_members()
-        self.log_voice()
-        self.log_players()
-        self.log_uptime()
-        self.log_server_roles()
-        self.log_server_channels()
+    @property
+    def gauge_full(self):
+        """True if every channel and member is logged on each sweep."""
+        return self.settings.get('gauge_mode', 'delta') == 'full'
+
+    async def log_all_gauges(self):
+        """Log all gauge values.
+
+        Skipped if a sweep is already running.
+        """
+        if self.gauge_lock.locked():
+            return
+        async with self.gauge_lock:
+            self.log_servers()
+            await self.log_channels()
+            await self.log_members()
+            self.log_voice()
+            self.log_players()
+            self.log_uptime()
+            await self.log_server_roles()
+            self.log_server_channels()
 
     def log_servers(self):
         """Log servers."""
@@ -480,8 +520,26 @@ class Logstash:
         extra['servers'] = servers_data
         self.logger.info(self.get_event_key(event_key), extra=extra)
 
-    def log_channels(self):
-        """Log channels."""
+    @staticmethod
+    def channel_fingerprint(channel: Channel):
+        """Hash of channel fields logged by gauges."""
+        return hash((
+            channel.name, channel.position, channel.is_default, channel.type))
+
+    @staticmethod
+    def member_fingerprint(member: Member):
+        """Hash of member fields logged by gauges."""
+        return hash((
+            member.name, member.display_name, member.status,
+            member.game.name if member.game else None,
+            tuple(r.id for r in member.roles)))
+
+    async def log_channels(self):
+        """Log channels.
+
+        Only channels which changed since the last sweep are logged
+        unless gauge mode is full.
+        """
         channels = list(self.bot.get_all_channels())
         extra = {
             'channel_count': len(channels)
@@ -489,27 +547,68 @@ class Logstash:
         self.log_discord_gauge('all_channels', extra=extra)
 
         # individual channels
-        for channel in channels:
-            self.log_channel(channel)
+        last = self.fingerprints['channel']
+        seen = {}
+        for index, channel in enumerate(channels, 1):
+            fingerprint = self.channel_fingerprint(channel)
+            seen[channel.id] = fingerprint
+            if self.gauge_full or last.get(channel.id) != fingerprint:
+                self.log_channel(channel)
+            if index % GAUGE_CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+        self.fingerprints['channel'] = seen
 
     def log_channel(self, channel: Channel):
         """Log one channel."""
         extra = {'channel': self.get_channel_params(channel)}
         self.log_discord_gauge('channel', extra=extra)
 
-    def log_members(self):
-        """Log members."""
-        members = list(self.bot.get_all_members())
-        unique = set(m.id for m in members)
+    async def log_members(self):
+        """Log members.
+
+        Log aggregated counts per server, and members which changed since
+        the last sweep unless gauge mode is full.
+        """
+        last = self.fingerprints['member']
+        seen = {}
+        unique = set()
+        member_count = 0
+        index = 0
+        for server in list(self.bot.servers):
+            counts = {
+                'member_count': 0,
+                'online_count': 0,
+                'bot_count': 0,
+                'changed_count': 0
+            }
+            for member in list(server.members):
+                key = (server.id, member.id)
+                fingerprint = self.member_fingerprint(member)
+                seen[key] = fingerprint
+                unique.add(member.id)
+                counts['member_count'] += 1
+                if member.status != Status.offline:
+                    counts['online_count'] += 1
+                if member.bot:
+                    counts['bot_count'] += 1
+                if self.gauge_full or last.get(key) != fingerprint:
+                    counts['changed_count'] += 1
+                    self.log_member(member)
+                index += 1
+                if index % GAUGE_CHUNK_SIZE == 0:
+                    await asyncio.sleep(0)
+            member_count += counts['member_count']
+            extra = {'server': self.get_server_params(server)}
+            extra.update(counts)
+            self.log_discord_gauge('server.members', extra)
+        self.fingerprints['member'] = seen
+
         extra = {
-            'member_count': len(members),
+            'member_count': member_count,
             'unique_member_count': len(unique)
         }
         self.log_discord_gauge('all_members', extra=extra)
 
-        for member in members:
-            self.log_member(member)
-
     def log_member(self, member: Member):
         """Log member."""
         extra = {'member': self.get_member_params(member)}
@@ -527,18 +626,24 @@ class Logstash:
         """Log updtime."""
         pass
 
-    def log_server_roles(self):
+    async def log_server_roles(self):
         """Log server roles."""
-        for server in self.bot.servers:
+        for server in list(self.bot.servers):
             extra = {}
             extra['server'] = self.get_server_params(server)
             extra['roles'] = []
 
             roles = server.role_hierarchy
 
-            # count number of members with a particular role
+            # count number of members with a particular role in one pass
+            role_counts = Counter()
+            for member_index, member in enumerate(list(server.members), 1):
+                role_counts.update(member.roles)
+                if member_index % GAUGE_CHUNK_SIZE == 0:
+                    await asyncio.sleep(0)
+
             for index, role in enumerate(roles):
-                count = sum([1 for m in server.members if role in m.roles])
+                count = role_counts[role]
 
                 role_params = self.get_role_params(role)
                 role_params['count'] = count
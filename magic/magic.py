@@ -197,7 +197,11 @@ class Magic:
 
     async def verify_members(self, server, magic_role):
         """Check members on server with the magic_role are in the permitted list."""
-        magic_members = [m for m in server.members if magic_role in m.roles]
+        mm = self.bot.get_cog("MemberManagement")
+        if mm is not None:
+            magic_members = mm.role_members(server, magic_role)
+        else:
+            magic_members = [m for m in server.members if magic_role in m.roles]
         for member in magic_members:
             await self.verify_member_magic(member, magic_role)
 
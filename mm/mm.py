@@ -61,6 +61,84 @@ def nested_dict():
     return defaultdict(nested_dict)
 
 
+def trigrams(text):
+    """Set of 3-character substrings."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class ServerIndex:
+    """Role and name index of members on a server.
+
+    roles maps role ids to sets of member ids. names maps member ids to
+    lowercase (display_name, name) and trigrams maps each 3-character
+    substring of those names to member ids, so that name searches only
+    check members which share every trigram of the query.
+    """
+
+    def __init__(self, server):
+        self.roles = defaultdict(set)
+        self.names = {}
+        self.trigrams = defaultdict(set)
+        for member in list(server.members):
+            self.add_member(member)
+
+    def add_member(self, member):
+        for role in member.roles:
+            self.roles[role.id].add(member.id)
+        self.add_names(member)
+
+    def remove_member(self, member):
+        for role in member.roles:
+            self.roles[role.id].discard(member.id)
+        self.remove_names(member.id)
+
+    def add_names(self, member):
+        names = (member.display_name.lower(), member.name.lower())
+        self.names[member.id] = names
+        for name in names:
+            for t in trigrams(name):
+                self.trigrams[t].add(member.id)
+
+    def remove_names(self, member_id):
+        names = self.names.pop(member_id, ())
+        for name in names:
+            for t in trigrams(name):
+                self.trigrams[t].discard(member_id)
+
+    def update_member(self, before, after):
+        before_roles = set(r.id for r in before.roles)
+        after_roles = set(r.id for r in after.roles)
+        for role_id in before_roles - after_roles:
+            self.roles[role_id].discard(after.id)
+        for role_id in after_roles - before_roles:
+            self.roles[role_id].add(after.id)
+        if (before.display_name, before.name) != (after.display_name, after.name):
+            self.remove_names(after.id)
+            self.add_names(after)
+
+    def role_members(self, roles):
+        """Set of member ids with any of the roles."""
+        member_ids = set()
+        for role in roles:
+            member_ids |= self.roles.get(role.id, set())
+        return member_ids
+
+    def search_names(self, query):
+        """Set of member ids whose display name or username contains query."""
+        query = query.lower()
+        candidates = None
+        for t in trigrams(query):
+            candidates = self.trigrams.get(t, set()) if candidates is None \
+                else candidates & self.trigrams.get(t, set())
+            if not candidates:
+                return set()
+        if candidates is None:
+            candidates = self.names.keys()
+        return set(
+            member_id for member_id in candidates
+            if any(query in name for name in self.names[member_id]))
+
+
 class MemberManagement:
     """Member Management plugin for Red Discord bot."""
 
@@ -69,6 +147,25 @@ class MemberManagement:
         self.bot = bot
         self.settings = nested_dict()
         self.settings.update(dataIO.load_json(JSON))
+        # member indexes by server id, built on first use
+        self.indexes = {}
+
+    def get_index(self, server):
+        """Member index of server.
+
+        The index is rebuilt when its member count differs from the
+        server's, as members loaded by chunking send no join events.
+        """
+        index = self.indexes.get(server.id)
+        if index is None or len(index.names) != len(server.members):
+            index = self.indexes[server.id] = ServerIndex(server)
+        return index
+
+    def role_members(self, server, *roles):
+        """List of members on server with any of the roles."""
+        member_ids = self.get_index(server).role_members(roles)
+        members = [server.get_member(member_id) for member_id in member_ids]
+        return [m for m in members if m is not None]
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.mod_or_permissions()
@@ -211,7 +308,8 @@ class MemberManagement:
         option_output_mentions = (pargs.output == 'mention')
         option_output_id = (pargs.output == 'id')
         option_output_mentions_only = (pargs.output == 'mentiononly')
-        option_everyone = pargs.everyone or 'everyone' in pargs.roles
+        option_everyone = pargs.everyone or any(
+            r.lower() in ['everyone', '@everyone'] for r in pargs.roles)
         option_sort_alpha = (pargs.sort == 'alpha')
         option_csv = (pargs.result == 'csv')
         option_list = (pargs.result == 'list')
@@ -226,7 +324,7 @@ class MemberManagement:
             minus = set([r.lower() for r in pargs.exclude if r.lower() in server_roles_names])
 
         # Used for output only, so it won’t mention everyone in chat
-        plus_out = plus.copy()
+        plus_out = plus - {'@everyone'}
 
         if option_everyone:
             plus.add('@everyone')
@@ -253,14 +351,26 @@ class MemberManagement:
         if len(plus):
             # include roles with '+' flag
             # exclude roles with '-' flag
+            index = self.get_index(server)
+            roles_by_name = defaultdict(list)
+            for role in server.roles:
+                roles_by_name[role.name.lower()].append(role)
+
+            if option_everyone:
+                member_ids = set(index.names.keys())
+            else:
+                member_ids = None
+            for name in plus - {'@everyone'}:
+                ids = index.role_members(roles_by_name[name])
+                member_ids = ids if member_ids is None else member_ids & ids
+            for name in minus:
+                member_ids -= index.role_members(roles_by_name[name])
+
             out_members = set()
-            for m in server.members:
-                roles = set([r.name.lower() for r in m.roles])
-                if option_everyone:
-                    roles.add('@everyone')
-                exclude = len(roles & minus)
-                if not exclude and roles >= plus:
-                    out_members.add(m)
+            for member_id in member_ids:
+                member = server.get_member(member_id)
+                if member is not None:
+                    out_members.add(member)
 
             # only role
             if option_only_role:
@@ -387,18 +497,12 @@ class MemberManagement:
         out.append("__List of roles on {}__".format(server.name))
         roles_to_list = self.get_server_roles(server, *roles)
 
-        out_roles = {}
-        for role in roles_to_list:
-            out_roles[role.id] = {'role': role, 'count': 0}
-        for member in server.members:
-            for role in member.roles:
-                if role in roles_to_list:
-                    out_roles[role.id]['count'] += 1
+        index = self.get_index(server)
         for role in server.role_hierarchy:
             if role in roles_to_list:
                 out.append(
                     "**{}** ({} members)".format(
-                        role.name, out_roles[role.id]['count']))
+                        role.name, len(index.roles.get(role.id, ()))))
         for page in pagify("\n".join(out), shorten_by=12):
             await self.bot.say(page)
 
@@ -506,11 +610,10 @@ class MemberManagement:
 
         server = ctx.message.server
         results = []
-        for member in server.members:
-            for member_name in [member.display_name, member.name]:
-                if name.lower() in member_name.lower():
-                    results.append(member)
-                    break
+        for member_id in self.get_index(server).search_names(name):
+            member = server.get_member(member_id)
+            if member is not None:
+                results.append(member)
 
         if not len(results):
             await self.bot.say("Cannot find any users with that name.")
@@ -543,8 +646,7 @@ class MemberManagement:
             await self.bot.say("Cannot find the role **{}** on this server.".format(to_add_role_name))
             return
 
-        server_members = [member for member in server.members]
-        for member in server_members:
+        for member in self.role_members(server, with_role):
             if with_role in member.roles:
                 if to_add_role not in member.roles:
                     try:
@@ -613,6 +715,43 @@ class MemberManagement:
             await self.bot.say(page)
 
 
+    async def on_member_join(self, member):
+        """Add member to index."""
+        if member.server.id in self.indexes:
+            self.indexes[member.server.id].add_member(member)
+
+    async def on_member_remove(self, member):
+        """Remove member from index."""
+        if member.server.id in self.indexes:
+            self.indexes[member.server.id].remove_member(member)
+
+    async def on_member_update(self, before, after):
+        """Update roles and names in index."""
+        if after.server.id in self.indexes:
+            self.indexes[after.server.id].update_member(before, after)
+
+    async def on_server_role_delete(self, role):
+        """Remove role from index."""
+        if role.server.id in self.indexes:
+            self.indexes[role.server.id].roles.pop(role.id, None)
+
+    async def on_server_remove(self, server):
+        """Drop index of server."""
+        self.indexes.pop(server.id, None)
+
+    async def on_server_available(self, server):
+        """Drop index of server, members may have changed while away."""
+        self.indexes.pop(server.id, None)
+
+    async def on_ready(self):
+        """Drop all indexes, member state is reloaded on connect."""
+        self.indexes = {}
+
+    async def on_resumed(self):
+        """Drop all indexes, events may have been missed."""
+        self.indexes = {}
+
+
 def check_folder():
     """Check folder."""
     if not os.path.exists(PATH):
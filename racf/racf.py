@@ -30,9 +30,9 @@ import os
 from random import choice
 from cogs.utils.dataIO import dataIO
 
-import aiohttp
 import cogs
 import crapipy
+import aiohttp
 import discord
 import yaml
 from __main__ import send_cmd_help
@@ -42,6 +42,8 @@ from cogs.utils.chat_formatting import pagify
 from discord.ext import commands
 from discord.ext.commands import Context
 
+from .httpclient import SessionHTTP
+
 CHANGECLAN_ROLES = ["Leader", "Co-Leader", "Elder", "High Elder", "Member"]
 BS_CHANGECLAN_ROLES = ["Member", "Brawl-Stars"]
 DISALLOWED_ROLES = ["SUPERMOD", "MOD", "AlphaBot"]
@@ -232,6 +234,14 @@ class RACF:
             self.config = Box(yaml.load(f))
         self.settings = dataIO.load_json(JSON)
 
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
+
 
     @property
     def auth(self):
@@ -321,9 +331,7 @@ class RACF:
         headers = {'Authorization': 'Bearer {}'.format(self.auth)}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30) as resp:
-                    data = await resp.json()
+            status, data = await self.http.get_json(url, headers=headers, timeout=30)
         except json.decoder.JSONDecodeError:
             raise
         except asyncio.TimeoutError:
@@ -730,7 +738,11 @@ class RACF:
         if new_role is None:
             await self.bot.say('{} is not a valid role.'.format(new_role))
             return
-        members = [m for m in server.members if with_role in m.roles]
+        mm = self.bot.get_cog("MemberManagement")
+        if mm is not None:
+            members = mm.role_members(server, with_role)
+        else:
+            members = [m for m in server.members if with_role in m.roles]
         for member in members:
             await self.bot.add_roles(member, new_role)
             await self.bot.say("Added {} for {}".format(
@@ -25,9 +25,10 @@ DEALINGS IN THE SOFTWARE.
 """
 
 import argparse
+import logging
 import os
 import re
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, namedtuple, OrderedDict
 
 import discord
 import unidecode
@@ -48,6 +49,27 @@ import asyncio
 
 PATH = os.path.join("data", "racf_audit")
 JSON = os.path.join(PATH, "settings.json")
+AUDITS_PATH = os.path.join(PATH, "audits")
+# scheduled and manual audits keep separate baselines
+AUDIT_SCHEDULED = "scheduled"
+AUDIT_MANUAL = "manual"
+
+# seconds a clan snapshot is reused before fetching again
+CLAN_SNAPSHOT_TTL = 300
+# seconds between checks for scheduled audits
+SCHEDULE_CHECK_INTERVAL = 60
+
+log = logging.getLogger("red.racf_audit")
+
+AuditResult = namedtuple("AuditResult", ["tag", "name", "clan_name", "issues"])
+
+# audit issues with their titles in clan based output
+AUDIT_ISSUES = OrderedDict([
+    ("elder_promotion_req", "Elders that need to be promoted:"),
+    ("coleader_promotion_req", "Co-Leaders that need to be promoted:"),
+    ("no_discord", "No Discord:"),
+    ("no_clan_role", "No clan role on Discord:"),
+])
 
 
 def nested_dict():
@@ -115,6 +137,7 @@ class DiscordUsers:
         self.crclan_cog = crclan_cog
         self.server = server
         self._user_list = None
+        self._users_by_tag = None
 
     @property
     def user_list(self):
@@ -134,27 +157,37 @@ class DiscordUsers:
             self._user_list = out
         return self._user_list
 
+    @property
+    def users_by_tag(self):
+        """DiscordUser by player tag."""
+        if self._users_by_tag is None:
+            users = {}
+            for u in self.user_list:
+                users.setdefault(u.tag, u)
+            self._users_by_tag = users
+        return self._users_by_tag
+
     def tag_to_member(self, tag):
         """Return Discord member from tag."""
-        for u in self.user_list:
-            if u.tag == tag:
-                return u.user
+        u = self.users_by_tag.get(tag)
+        if u is not None:
+            return u.user
         return None
 
     def tag_to_member_id(self, tag):
         """Return Discord member from tag."""
-        for u in self.user_list:
-            if u.tag == tag:
-                return u.user
-        return None
+        return self.tag_to_member(tag)
 
 
 class MemberAudit:
-    """Member audit object associates API model with discord model."""
+    """Member audit object associates API model with discord model.
 
-    def __init__(self, member_model, server, clans):
+    roles is a dict of Discord roles by name, resolved once per audit.
+    """
+
+    def __init__(self, member_model, roles, clans):
         self.member_model = member_model
-        self.server = server
+        self.roles = roles
         self.clans = clans
 
     @property
@@ -185,21 +218,24 @@ class MemberAudit:
     def api_is_leader(self):
         return self.member_model.role_is_leader
 
+    def discord_has_role(self, role_name):
+        return self.roles.get(role_name) in self.discord_member.roles
+
     @property
     def discord_role_member(self):
-        return member_has_role(self.server, self.discord_member, "Member")
+        return self.discord_has_role("Member")
 
     @property
     def discord_role_elder(self):
-        return member_has_role(self.server, self.discord_member, "Elder")
+        return self.discord_has_role("Elder")
 
     @property
     def discord_role_coleader(self):
-        return member_has_role(self.server, self.discord_member, "Co-Leader")
+        return self.discord_has_role("Co-Leader")
 
     @property
     def discord_role_leader(self):
-        return member_has_role(self.server, self.discord_member, "Leader")
+        return self.discord_has_role("Leader")
 
     @property
     def discord_clan_roles(self):
@@ -226,6 +262,35 @@ class RACFAudit:
         with open('data/racf_audit/family_config.yaml') as f:
             self.config = yaml.load(f)
 
+        # (timestamp, clan models) of last API fetch
+        self.clan_snapshot = None
+        self.task = bot.loop.create_task(self.loop_task())
+
+    def __unload(self):
+        self.task.cancel()
+
+    async def loop_task(self):
+        """Run scheduled audits."""
+        await self.bot.wait_until_ready()
+        while self is self.bot.get_cog("RACFAudit"):
+            now = dt.datetime.utcnow()
+            for server_id, schedule in list(self.settings.get("schedules", {}).items()):
+                last_run = schedule.get("last_run")
+                if last_run is not None:
+                    elapsed = (now - dateutil.parser.parse(last_run)).total_seconds()
+                    if elapsed < schedule["interval"] * 60:
+                        continue
+                schedule["last_run"] = now.isoformat()
+                dataIO.save_json(JSON, self.settings)
+                try:
+                    await self.run_scheduled_audit(server_id, schedule)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception(
+                        "Scheduled audit failed for server %s", server_id)
+            await asyncio.sleep(SCHEDULE_CHECK_INTERVAL)
+
     def cache_file_path(self, clan_tag):
         """Return cache path by clan tag."""
         return os.path.join(PATH, "clans", clan_tag + ".json")
@@ -264,23 +329,27 @@ class RACFAudit:
         clan_models = self.load_from_cache(clan_tags)
         return clan_models
 
-    async def family_clan_models(self, server):
-        """All family clan models."""
+    async def family_clan_models(self, server, max_age=CLAN_SNAPSHOT_TTL):
+        """All family clan models.
+
+        Reuse the last fetch if it is less than max_age seconds old.
+        """
+        now = dt.datetime.utcnow()
+        if self.clan_snapshot is not None:
+            timestamp, clan_models = self.clan_snapshot
+            if (now - timestamp).total_seconds() < max_age:
+                return clan_models
+
         clans = self.clans(server)
         clan_tags = [c.tag for c in clans]
-        clan_models = []
 
-        try:
-            client = crapipy.AsyncClient(token=self.auth)
-            clan_models = await client.get_clans(clan_tags)
+        client = crapipy.AsyncClient(token=self.auth)
+        clan_models = await client.get_clans(clan_tags)
+        self.clan_snapshot = (now, clan_models)
 
-            self.save_to_cache(clan_models)
-            self.settings["cache_timestamp"] = dt.datetime.utcnow().isoformat()
-            dataIO.save_json(JSON, self.settings)
-            # TODO purely for testing
-            # raise crapipy.APIError
-        except crapipy.APIError:
-            raise crapipy.APIError
+        await self.bot.loop.run_in_executor(None, self.save_to_cache, clan_models)
+        self.settings["cache_timestamp"] = now.isoformat()
+        dataIO.save_json(JSON, self.settings)
 
         return clan_models
 
@@ -325,6 +394,142 @@ class RACFAudit:
             )
         return out
 
+    def audit_members(self, server, member_models):
+        """Audit family members in a single pass.
+
+        Roles are resolved once per run. Return list of AuditResult.
+        """
+        clans = self.clans(server)
+        clan_roles = {clan.name: clan.role for clan in clans}
+        roles = {
+            name: server_role(server, name)
+            for name in ["Member", "Elder", "Co-Leader", "Leader"]}
+        discord_users = DiscordUsers(crclan_cog=self.crclan, server=server)
+
+        results = []
+        for member_model in member_models:
+            member_model.discord_member = discord_users.tag_to_member(member_model.tag)
+            ma = MemberAudit(member_model, roles, clans)
+            issues = []
+            if ma.has_discord:
+                if not ma.api_is_elder and ma.discord_role_elder:
+                    issues.append("elder_promotion_req")
+                if not ma.api_is_coleader and ma.discord_role_coleader:
+                    issues.append("coleader_promotion_req")
+                clan_role = clan_roles.get(member_model.clan_name)
+                if clan_role is not None:
+                    if clan_role not in ma.discord_member.roles:
+                        issues.append("no_clan_role")
+            else:
+                issues.append("no_discord")
+            results.append(AuditResult(
+                tag=member_model.tag,
+                name=member_model.name,
+                clan_name=member_model.clan_name,
+                issues=tuple(issues)))
+        return results
+
+    @staticmethod
+    def audit_file_path(server_id, kind):
+        return os.path.join(AUDITS_PATH, kind, "{}.json".format(server_id))
+
+    def load_audit(self, server_id, kind):
+        """Last audit results of server by player tag."""
+        fp = self.audit_file_path(server_id, kind)
+        if not dataIO.is_valid_json(fp):
+            return None
+        return {
+            tag: AuditResult(*result)
+            for tag, result in dataIO.load_json(fp).items()}
+
+    def save_audit(self, server_id, kind, results):
+        """Save audit results of server."""
+        dataIO.save_json(
+            self.audit_file_path(server_id, kind),
+            {r.tag: list(r) for r in results})
+
+    @staticmethod
+    def audit_diff(previous, results):
+        """Compare audit results with previous results by player tag.
+
+        Return (new, resolved) as lists of AuditResult with only the
+        issues which appeared or went away.
+        """
+        current = {r.tag: r for r in results}
+        new = []
+        for r in results:
+            old_issues = previous[r.tag].issues if r.tag in previous else ()
+            issues = tuple(i for i in r.issues if i not in old_issues)
+            if issues:
+                new.append(r._replace(issues=issues))
+        resolved = []
+        for tag, r in previous.items():
+            cur_issues = current[tag].issues if tag in current else ()
+            issues = tuple(i for i in r.issues if i not in cur_issues)
+            if issues:
+                resolved.append(r._replace(issues=issues))
+        return new, resolved
+
+    @staticmethod
+    def audit_clan_output(results, clan_names):
+        """Clan based output lines of audit results."""
+        by_clan = OrderedDict((name, defaultdict(list)) for name in clan_names)
+        for r in results:
+            clan = by_clan.setdefault(r.clan_name, defaultdict(list))
+            for issue in r.issues:
+                clan[issue].append(r.name)
+        out = []
+        for clan_name, issues in by_clan.items():
+            if not issues:
+                continue
+            out.append("**{}**".format(clan_name))
+            for issue, title in AUDIT_ISSUES.items():
+                if issues[issue]:
+                    out.append(title)
+                    out.append(", ".join(issues[issue]))
+        return out
+
+    def audit_diff_output(self, server, new, resolved):
+        """Output lines of audit diff."""
+        clan_names = [c.name for c in self.clans(server)]
+        out = []
+        if new:
+            out.append(bold("New issues"))
+            out.extend(self.audit_clan_output(new, clan_names))
+        if resolved:
+            out.append(bold("Resolved"))
+            out.extend(self.audit_clan_output(resolved, clan_names))
+        return out
+
+    async def run_audit(self, server, kind=AUDIT_MANUAL):
+        """Audit server and return (results, previous results, is_cache).
+
+        kind is AUDIT_MANUAL or AUDIT_SCHEDULED. Each kind is compared
+        with and saved as its own baseline, so running an audit by hand
+        does not hide changes from the next scheduled post.
+        """
+        member_models, is_cache = await self.family_member_models(server)
+        results = self.audit_members(server, member_models)
+        previous = self.load_audit(server.id, kind)
+        self.save_audit(server.id, kind, results)
+        return results, previous, is_cache
+
+    async def run_scheduled_audit(self, server_id, schedule):
+        """Post changes since the last audit to the scheduled channel."""
+        server = self.bot.get_server(server_id)
+        if server is None:
+            return
+        channel = server.get_channel(schedule["channel_id"])
+        if channel is None:
+            return
+        results, previous, is_cache = await self.run_audit(
+            server, AUDIT_SCHEDULED)
+        if previous is None:
+            return
+        out = self.audit_diff_output(server, *self.audit_diff(previous, results))
+        for page in pagify('\n'.join(out), shorten_by=24):
+            await self.bot.send_message(channel, page)
+
     def clan_roles(self, server):
         """Clan roles."""
         return [clan.role for clan in self.clans(server)]
@@ -389,6 +594,32 @@ class RACFAudit:
         dataIO.save_json(JSON, self.settings)
         await self.bot.say("Updated settings.")
 
+    @racfauditset.command(name="schedule", pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_roles=True)
+    async def racfauditset_schedule(
+            self, ctx, channel: discord.Channel=None, minutes: int=0):
+        """Post audit changes to a channel on a schedule.
+
+        [p]racfauditset schedule #channel 60
+        Omit arguments to disable.
+        """
+        server = ctx.message.server
+        schedules = self.settings.setdefault("schedules", {})
+        if channel is None or minutes <= 0:
+            schedules.pop(server.id, None)
+            dataIO.save_json(JSON, self.settings)
+            await self.bot.say("Scheduled audit disabled.")
+            return
+        schedules[server.id] = {
+            "channel_id": channel.id,
+            "interval": minutes,
+            "last_run": None
+        }
+        dataIO.save_json(JSON, self.settings)
+        await self.bot.say(
+            "Audit changes will be posted to {} every {} minutes.".format(
+                channel.mention, minutes))
+
     @racfauditset.command(name="settings", pass_context=True, no_pm=True)
     @checks.is_owner()
     async def racfauditset_settings(self, ctx):
@@ -472,10 +703,6 @@ class RACFAudit:
             await self.bot.send_cmd_help(ctx)
             return
 
-        client = crapipy.AsyncClient(token=self.auth)
-        clans = await client.get_clans(self.clan_tags())
-        # print(clans)
-
         server = ctx.message.server
         results = []
         await self.bot.type()
@@ -538,116 +765,79 @@ class RACFAudit:
         """Audit the entire RACF family.
         
         Options:
-        --removerole   Remove clan role from people who aren’t in clan
-        --addrole      Add clan role to people who are in clan
-        --exec         Run both add and remove role options
+        --details      Show issues by member as well as by clan
         --debug        Show debug in console 
         """
         server = ctx.message.server
-        family_tags = self.crclan.manager.get_bands(server).keys()
 
-        option_exec = '--exec' in options
+        option_details = '--details' in options
         option_debug = '--debug' in options
 
         await self.bot.type()
 
-        clans = self.clans(server)
-
         # Show settings
         await ctx.invoke(self.racfaudit_config)
 
-        # Create list of all discord users with associated tags
-        discord_users = DiscordUsers(crclan_cog=self.crclan, server=server)
-
-        # Member models from API
-        member_models = await self.family_member_models(server)
+        try:
+            results, previous, is_cache = await self.run_audit(server)
+        except (crapipy.APIError, OSError):
+            await self.bot.say("Cannot reach API and cannot load from cache. Aborting…")
+            return
 
-        # associate Discord user to member
-        for member_model in member_models:
-            member_model.discord_member = discord_users.tag_to_member(member_model.tag)
+        if is_cache:
+            await self.bot.say("Cannot load from API. Results are from cache.")
 
         if option_debug:
-            for du in discord_users.user_list:
-                print(du.tag, du.user)
-
-        """
-        Member processing.
-        
-        """
-        clan_defaults = {
-            "elder_promotion_req": [],
-            "coleader_promotion_req": [],
-            "no_discord": [],
-            "no_clan_role": []
-        }
-        clans_out = OrderedDict([(c.name, clan_defaults) for c in clans])
-
-        def update_clan(clan_name, field, member_model):
-            clans_out[clan_name][field].append(member_model)
-
-        out = []
-        for i, member_model in enumerate(member_models):
-            if i % 20 == 0:
-                await self.bot.type()
-
-            ma = MemberAudit(member_model, server, clans)
-            clan_name = member_model.clan_name
-            m_out = []
-            if ma.has_discord:
-                if not ma.api_is_elder and ma.discord_role_elder:
-                    update_clan(clan_name, "elder_promotion_req", member_model)
-                    m_out.append(":warning: Has Elder role but not promoted in clan.")
-                if not ma.api_is_coleader and ma.discord_role_coleader:
-                    update_clan(clan_name, "coleader_promotion_req", member_model)
-                    m_out.append(":warning: Has Co-Leader role but not promoted in clan.")
-                clan_role = self.clan_name_to_role(server, member_model.clan_name)
-                if clan_role is not None:
-                    if clan_role not in ma.discord_clan_roles:
-                        update_clan(clan_name, "no_clan_role", member_model)
-                        m_out.append(":warning: Does not have {}".format(clan_role.name))
-            else:
-                update_clan(clan_name, "no_discord", member_model)
-                m_out.append(':x: No Discord')
-
-            if len(m_out):
-                out.append(
-                    "**{ign}** {clan}\n{status}".format(
-                        ign=member_model.name,
-                        clan=member_model.clan_name,
-                        status='\n'.join(m_out)
-                    )
-                )
+            for r in results:
+                print(r)
 
         # line based output
-        for page in pagify('\n'.join(out)):
-            await self.bot.type()
-            await self.bot.say(page)
+        if option_details:
+            out = []
+            for r in results:
+                if r.issues:
+                    out.append(
+                        "**{ign}** {clan}\n{status}".format(
+                            ign=r.name,
+                            clan=r.clan_name,
+                            status='\n'.join(AUDIT_ISSUES[i] for i in r.issues)))
+            for page in pagify('\n'.join(out)):
+                await self.bot.say(page)
 
         # clan based output
-        out = []
-        print(clans_out)
-        for clan_name, clan_dict in clans_out.items():
-            out.append("**{}**".format(clan_name))
-            if len(clan_dict["elder_promotion_req"]):
-                out.append("Elders that need to be promoted:")
-                out.append(", ".join([m.name for m in clan_dict["elder_promotion_req"]]))
-            if len(clan_dict["no_discord"]):
-                out.append("No Discord:")
-                out.append(", ".join([m.name for m in clan_dict["no_discord"]]))
-            if len(clan_dict["no_clan_role"]):
-                out.append("No clan role on Discord:")
-                out.append(", ".join([m.name for m in clan_dict["no_clan_role"]]))
-
+        out = self.audit_clan_output(results, [c.name for c in self.clans(server)])
         for page in pagify('\n'.join(out), shorten_by=24):
-            await self.bot.type()
             if len(page):
                 await self.bot.say(page)
 
+    @racfaudit.command(name="diff", pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(manage_roles=True)
+    async def racfaudit_diff(self, ctx):
+        """Audit the RACF family and show changes since the last audit."""
+        server = ctx.message.server
+        await self.bot.type()
+        try:
+            results, previous, is_cache = await self.run_audit(server)
+        except (crapipy.APIError, OSError):
+            await self.bot.say("Cannot reach API and cannot load from cache. Aborting…")
+            return
+        if previous is None:
+            await self.bot.say("No previous audit. Saved results for next time.")
+            return
+        out = self.audit_diff_output(server, *self.audit_diff(previous, results))
+        if not out:
+            await self.bot.say("No changes since the last audit.")
+            return
+        for page in pagify('\n'.join(out), shorten_by=24):
+            await self.bot.say(page)
+
 
 def check_folder():
     """Check folder."""
     os.makedirs(PATH, exist_ok=True)
     os.makedirs(os.path.join(PATH, "clans"), exist_ok=True)
+    for kind in [AUDIT_SCHEDULED, AUDIT_MANUAL]:
+        os.makedirs(os.path.join(AUDITS_PATH, kind), exist_ok=True)
 
 
 def check_file():
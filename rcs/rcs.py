@@ -27,10 +27,10 @@ DEALINGS IN THE SOFTWARE.
 import os
 from collections import defaultdict
 
+import aiohttp
 import discord
 from __main__ import send_cmd_help
 from discord.ext import commands
-import aiohttp
 import json
 import asyncio
 
@@ -38,6 +38,8 @@ from cogs.utils import checks
 from cogs.utils.dataIO import dataIO
 from cogs.utils.chat_formatting import pagify, box
 
+from .httpclient import SessionHTTP
+
 BOTCOMMANDER_ROLES = ['Bot Commander']
 
 TOGGLE_ROLES = ["Trusted", "Visitor"]
@@ -121,7 +123,15 @@ class RCS:
         self.bot = bot
         self.settings = nested_dict()
         self.settings.update(dataIO.load_json(JSON))
-        
+
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
+
     def _getAuth(self):
         return {"auth" : self.settings['token']}
 
@@ -283,9 +293,7 @@ class RCS:
         url = "{}{}{}".format('http://api.cr-api.com/player/', tag, "?keys=name,clan")
 
         try:
-            async with aiohttp.ClientSession(headers=self._getAuth()) as session:
-                async with session.get(url, timeout=30) as resp:
-                    data = await resp.json()
+            status, data = await self.http.get_json(url, headers=self._getAuth(), timeout=30)
         except json.decoder.JSONDecodeError:
             raise
         except asyncio.TimeoutError:
@@ -36,6 +36,8 @@ from cogs.utils import checks
 from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 
+from .httpclient import SessionHTTP
+
 PATH = os.path.join("data", "trophies")
 JSON = os.path.join(PATH, "settings.json")
 
@@ -90,6 +92,14 @@ class Trophies:
         self.bot = bot
         self.settings = dataIO.load_json(JSON)
 
+    @property
+    def http(self):
+        """Shared HTTPClient cog, or one-off sessions if it is not loaded."""
+        http = self.bot.get_cog("HTTPClient")
+        if http is None:
+            http = SessionHTTP(self.bot.loop)
+        return http
+
     @property
     def racf_clan_names(self):
         return [c['name'] for c in RACF_CLANS[ClanType.CR]]
@@ -165,9 +175,7 @@ class Trophies:
         """Grabs trophy info from player and return suitable clans."""
         url = 'http://api.cr-api.com/profile/' + tag
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as resp:
-                    data = await resp.json()
+            status, data = await self.http.get_json(url, timeout=10)
         except json.decoder.JSONDecodeError:
             await self.bot.say("Failed to decode data from API. Aborting…")
             return